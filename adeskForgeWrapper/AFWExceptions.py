@@ -3,5 +3,56 @@
 class AFWError(Exception):
     '''Base class for AFW exceptions'''
 
+class DeadlineExceeded(AFWError, TimeoutError):
+    '''The deadline of a call (transport.deadline, Transport deadlines) passed before it got a response'''
+
 class APIError(Exception):
-    '''Base class for API response exceptions'''
\ No newline at end of file
+    '''Base class for API response exceptions.<br>
+    status - HTTP status, None if the error was read from a body (ReCap answers errors with 200)<br>
+    code - Error code of the API, eg "AUTH-006"<br>
+    headers - Response headers<br>
+    retry_after - Seconds the server asked to wait before trying again, None if it didn't<br>
+    errors - The error list of data management responses<br>
+    retryable - True if sending the same request again may succeed'''
+    retryable = False
+
+    def __init__(self, message, status=None, code=None, headers=None, retry_after=None, errors=None):
+        super().__init__(message)
+        self.status = status
+        self.code = code
+        self.headers = headers if headers is not None else {}
+        self.retry_after = retry_after
+        self.errors = errors
+
+class ValidationError(APIError):
+    '''400, 422 - The request is malformed or its values are not valid'''
+
+class AuthExpiredError(APIError):
+    '''401 - The token expired or was revoked, refresh it and try again'''
+    retryable = True
+
+class ForbiddenError(APIError):
+    '''403 - The token lacks the scope or the user the permission'''
+
+class NotFoundError(APIError):
+    '''404'''
+
+class ConflictError(APIError):
+    '''409 - The entity exists already or was changed by someone else'''
+
+class ThrottledError(APIError):
+    '''429 - Rate limited, wait retry_after seconds'''
+    retryable = True
+
+class ServerError(APIError):
+    '''5xx'''
+    retryable = True
+
+_STATUS_ERRORS = {400: ValidationError, 401: AuthExpiredError, 403: ForbiddenError, 404: NotFoundError,
+                  409: ConflictError, 422: ValidationError, 429: ThrottledError}
+
+def error_class(status):
+    '''The APIError subclass of an HTTP status'''
+    if status is not None and status >= 500:
+        return ServerError
+    return _STATUS_ERRORS.get(status, APIError)
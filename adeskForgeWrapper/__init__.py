@@ -1,5 +1,15 @@
-from . import b360
-from . import datamgt
-from . import tokenflex
-from . import client
-from . import realitycapture
\ No newline at end of file
+'''Python wrapper for Autodesk's Forge API. The submodules are imported the first time 
+they are used, so a process only pays for the APIs it calls'''
+import importlib
+
+__all__ = ["b360", "datamgt", "tokenflex", "client", "realitycapture", "designautomation",
+           "sync", "cache", "transport", "tokenstore", "metrics", "tracing", "profiling", "cassette", "events", "http2",
+           "utils", "AFWExceptions"]
+
+def __getattr__(name): # PEP 562
+    if name in __all__:
+        return importlib.import_module("."+name, __name__)
+    raise AttributeError("module {m!r} has no attribute {n!r}".format(m=__name__, n=name))
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
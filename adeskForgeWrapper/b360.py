@@ -4,14 +4,14 @@
 # ----------
 '''Module for the BIM 360 API'''
 
-import requests
-
 from . import AFWExceptions
 from . import client
+from . import events
 from .utils import checkScopes
 from .utils import checkResponse
 from . import utils
 from .utils import AUTODESK_BASE_URL as BASE_URL
+from .cache import stale_while_revalidate
 import json
 
 
@@ -383,14 +383,14 @@ class Project(object):
 #endRegion
 
     @classmethod
+    @stale_while_revalidate("b360.Project.get_projects")
     def get_projects(cls, token):
         '''Query all the projects in a specific BIM 360 account.<br>
         Scope - account:read<br>
         Returns a list of project objects.'''
         endpoint_url = BASE_URL+"/hq/v1/accounts/{aId}/projects".format(aId=token.bim_account_id)
         checkScopes(token, "account:read")
-        r = requests.get(endpoint_url, headers=token.get_header).json()
-        checkResponse(r)
+        r = checkResponse(token.transport.get(endpoint_url, headers=token.get_header)).json()
         return [cls(p) for p in r]
 
     @classmethod
@@ -399,8 +399,7 @@ class Project(object):
         Scope: account:read'''
         endpoint_url = BASE_URL+"/hq/v1/accounts/{aId}/projects/{pId}".format(aId=token.bim_account_id, pId=p_id)
         checkScopes(token, "account:read")
-        r = requests.get(endpoint_url, headers=token.get_header).json()
-        checkResponse(r)
+        r = checkResponse(token.transport.get(endpoint_url, headers=token.get_header)).json()
         return cls(r)
 
     @classmethod
@@ -410,9 +409,8 @@ class Project(object):
         creationOps - From Options Class, createProjectOptions()'''
         checkScopes(token, "account:write")
         endpoint_url = BASE_URL+"/hq/v1/accounts/{aId}/projects".format(aId=token.bim_account_id)
-        r = requests.post(endpoint_url, headers=token.patch_header, data=create_project_options).json()
-        print(r)
-        checkResponse(r)
+        r = checkResponse(token.transport.post(endpoint_url, headers=token.patch_header, data=create_project_options)).json()
+        events.emit("b360.project.created", project_id=r.get("id", None), project_name=r.get("name", None))
         return cls(r)
 
     def update_project(self, token, update_project_options):
@@ -420,8 +418,7 @@ class Project(object):
            Scope - `account:write account:read`'''
         checkScopes(token, "account:read account:write")
         endpoint_url = BASE_URL+"/hq/v1/accounts/{aId}/projects/{pId}".format(aId=self.account_id, pId=self.id)
-        r = requests.patch(endpoint_url, headers=token.patch_header, data=update_project_options).json()
-        checkResponse(r)
+        r = checkResponse(token.transport.patch(endpoint_url, headers=token.patch_header, data=update_project_options)).json()
         return Project(r)
     
     def get_users(self, token):
@@ -430,8 +427,7 @@ class Project(object):
         Scope - account:read'''
         checkScopes(token, "account:read")
         endpoint_url = BASE_URL+"/bim360/admin/v1/projects/{pId}/users".format(pId=self.id)
-        r = requests.get(endpoint_url, headers=token.get_header).json()
-        checkResponse(r)
+        r = checkResponse(token.transport.get(endpoint_url, headers=token.get_header)).json()
         return [User(u) for u in r["results"]]
 
     def user_by_id(self, token, user_id):
@@ -439,8 +435,7 @@ class Project(object):
         Scope - account:read'''
         checkScopes(token, "account:read")
         endpoint_url = BASE_URL+"/bim360/admin/v1/projects/{pId}/users/{uId}".format(pId=self.id, uId=user_id)
-        r = requests.get(endpoint_url, headers=token.get_header).json()
-        checkResponse(r)
+        r = checkResponse(token.transport.get(endpoint_url, headers=token.get_header)).json()
         return User(r)
 
     def add_users(self, token, add_user_options: list):
@@ -466,10 +461,10 @@ class Project(object):
         endpoint_url = BASE_URL+"/hq/v2/accounts/{aId}/projects/{pId}/users/import".format(
             aId=self.account_id ,pId=self.id)
 
-        r = requests.post(endpoint_url, headers=token.content_x_user, data=add_user_options).json()
-        checkResponse(r)
-        print("Success:", r["success"])
-        print("Failed:", r["failure"])
+        r = checkResponse(token.transport.post(endpoint_url, headers=token.content_x_user, data=add_user_options)).json()
+        events.emit("b360.project.users_added", events.WARNING if r["failure"] else events.INFO,
+                    project_id=self.id, success=r["success"], failure=r["failure"],
+                    failure_items=r.get("failure_items", []))
         return [User.user_by_id(token, u["user_id"]) for u in r["success_items"]]
 
     def update_user_by_id(self, token, user_id, update_user_options):
@@ -488,10 +483,10 @@ class Project(object):
         endpoint_url = BASE_URL+"/hq/v2/accounts/{aId}/projects/{pId}/users/{uId}".format(
             aId=self.account_id ,pId=self.id, uId=user_id)
 
-        r = requests.patch(endpoint_url, headers=token.content_x_user, data=update_user_options).json()
-        checkResponse(r)
+        r = checkResponse(token.transport.patch(endpoint_url, headers=token.content_x_user, data=update_user_options)).json()
         return User(r)
 
+    @stale_while_revalidate("b360.Project.industry_roles")
     def industry_roles(self, token):
         '''Retrieves the industry roles for the project. For example, contractor and architect.<br>
         Scope - account:read'''
@@ -501,8 +496,7 @@ class Project(object):
         endpoint_url = BASE_URL+"/hq/v2/accounts/{aId}/projects/{pId}/industry_roles".format(
             aId=self.account_id ,pId=self.id)
 
-        r = requests.get(endpoint_url, headers=token.patch_header).json()
-        checkResponse(r)
+        r = checkResponse(token.transport.get(endpoint_url, headers=token.patch_header)).json()
         return [IndustryRoles(i) for i in r]
 
     def export_PDF(self, token, export_PDF_options):
@@ -546,11 +540,10 @@ class Project(object):
         endpoint_url = BASE_URL+"/bim360/docs/v1/projects/{pId}/versions/{vId}/exports".format(
             pId=self.id, vId=export_PDF_options[0])
 
-        r = requests.post(endpoint_url, 
-                          headers=token.patch_header, 
-                          data=str(export_PDF_options[1])).json()
-        checkResponse(r)
-        print("Id: {id}\nStatus: {status}".format(id=r["id"], status=r["status"]))
+        r = checkResponse(token.transport.post(endpoint_url,
+                                               headers=token.patch_header,
+                                               data=str(export_PDF_options[1]))).json()
+        events.emit("b360.pdf_export.started", project_id=self.id, export_id=r["id"], status=r["status"])
         return r
 
     def get_PDF_export(self, token, versionId: str, exportId: str):
@@ -570,11 +563,10 @@ class Project(object):
             pId=self.id, vId=versionId, eId=exportId)
 
         endpoint_url = BASE_URL + urlEnd
-        r = requests.get(endpoint_url, headers=token.content_x_user).json()
-        checkResponse(r)
-        print(r) #TODO: Try, .json() may not work here. will probably find a way once 
-                 # model derivative api is running.
-                 #TODO: Range header
+        r = checkResponse(token.transport.get(endpoint_url, headers=token.content_x_user)).json()
+        #TODO: Range header
+        events.emit("b360.pdf_export.status", events.DEBUG, project_id=self.id, export_id=exportId,
+                    status=r.get("status", None))
         return r
 
 
@@ -667,8 +659,7 @@ class Company(object):
         endpoint_url = BASE_URL+"/hq/v1/accounts/{aId}/companies/{cId}".format(
             aId=token.bim_account_id, cId=c_id)
 
-        r = requests.get(endpoint_url, headers=token.get_header).json()
-        checkResponse(r)
+        r = checkResponse(token.transport.get(endpoint_url, headers=token.get_header)).json()
         return cls(r)
 
     @classmethod
@@ -677,8 +668,7 @@ class Company(object):
         Scope account:read'''
         checkScopes(token, "account:read")
         endpoint_url = BASE_URL+"/hq/v1/accounts/{aId}/companies".format(aId=token.bim_account_id)
-        r = requests.get(endpoint_url, headers=token.get_header).json()
-        checkResponse(r)
+        r = checkResponse(token.transport.get(endpoint_url, headers=token.get_header)).json()
         return [cls(c) for c in r]
 
     @classmethod
@@ -691,8 +681,7 @@ class Company(object):
         endpoint_url = BASE_URL+"/hq/v1/accounts/{aId}/companies/search".format(
             aId=token.bim_account_id)
 
-        r = requests.get(endpoint_url, headers=token.get_header, params=searchOps).json()
-        checkResponse(r)
+        r = checkResponse(token.transport.get(endpoint_url, headers=token.get_header, params=searchOps)).json()
         if r == []:
             return None
         else:
@@ -710,10 +699,9 @@ class Company(object):
         endpoint_url = BASE_URL+"/hq/v1/accounts/{aId}/companies/import".format(
             aId=token.bim_account_id)
 
-        r = requests.post(endpoint_url, headers=token.patch_header,data=data).json()
-        checkResponse(r)
-        print("Success:", r["success"])
-        print("Failure:", r["failure"])
+        r = checkResponse(token.transport.post(endpoint_url, headers=token.patch_header,data=data)).json()
+        events.emit("b360.companies.imported", events.WARNING if r["failure"] else events.INFO,
+                    success=r["success"], failure=r["failure"], failure_items=r.get("failure_items", []))
         return [cls(c) for c in r["success_items"]]
 
     def updateCompany(self, token, updateCompanyOptions):
@@ -723,10 +711,9 @@ class Company(object):
         endpoint_url = BASE_URL+"/hq/v1/accounts/{aId}/companies/{cId}".format(
             aId=self.account_id, cId=self.id)
 
-        r = requests.patch(endpoint_url, 
-                           headers=token.patch_header,
-                           data=updateCompanyOptions).json()
-        checkResponse(r)
+        r = checkResponse(token.transport.patch(endpoint_url,
+                                                headers=token.patch_header,
+                                                data=updateCompanyOptions)).json()
         return Company(r)
 
 
@@ -857,8 +844,7 @@ class User(object):
         Scope account:read'''
         checkScopes(token, "account:read")
         endpoint_url = BASE_URL+"/hq/v1/accounts/{aId}/users".format(aId=token.bim_account_id)
-        r = requests.get(endpoint_url, headers=token.get_header).json()
-        checkResponse(r)
+        r = checkResponse(token.transport.get(endpoint_url, headers=token.get_header)).json()
         return [cls(u) for u in r]
 
     @classmethod
@@ -866,11 +852,10 @@ class User(object):
         '''Query the details of a specific user.<br>
         Scope `account:read'''
         checkScopes(token, "account:read")
-        endpoint_url = "/hq/v1/accounts/{aId}/users/{uId}".format(
+        endpoint_url = BASE_URL+"/hq/v1/accounts/{aId}/users/{uId}".format(
             aId=token.bim_account_id, uId=user_id)
 
-        r = requests.get(endpoint_url, headers=token.get_header).json()
-        checkResponse(r)
+        r = checkResponse(token.transport.get(endpoint_url, headers=token.get_header)).json()
         return cls(r)
 
     @classmethod
@@ -879,13 +864,11 @@ class User(object):
         Scope - account:write<br>
         updateUserOptions - From Options class'''
         checkScopes(token, "account:write")
-        endpoint_url = "/hq/v1/accounts/{aId}/users/{uId}".format(aId=token.bim_account_id, uId=user_id)
-
-        r = requests.patch(endpoint_url,
-                           headers=token.patch_header,
-                           data=update_user_options).json()
+        endpoint_url = BASE_URL+"/hq/v1/accounts/{aId}/users/{uId}".format(aId=token.bim_account_id, uId=user_id)
 
-        checkResponse(r)
+        r = checkResponse(token.transport.patch(endpoint_url,
+                                                headers=token.patch_header,
+                                                data=update_user_options)).json()
         return cls(r)
 
     def update_user(self, token, update_user_options):
@@ -893,13 +876,12 @@ class User(object):
         Scope - account:write<br>
         updateUserOptions - From Options class'''
         checkScopes(token, "account:write")
-        endpoint_url = "/hq/v1/accounts/{aId}/users/{uId}".format(
+        endpoint_url = BASE_URL+"/hq/v1/accounts/{aId}/users/{uId}".format(
             aId=token.bim_account_id, uId=self.id)
 
-        r = requests.patch(endpoint_url,
-                           headers=token.patch_header,
-                           data=update_user_options).json()
-        checkResponse(r)
+        r = checkResponse(token.transport.patch(endpoint_url,
+                                                headers=token.patch_header,
+                                                data=update_user_options)).json()
         return User(r)
 
 
@@ -983,13 +965,13 @@ class BusinessUnits(object):
         return self._raw.get("updated_at", None)
 
     @classmethod
+    @stale_while_revalidate("b360.BusinessUnits.get_business_units")
     def get_business_units(cls, token):
         '''Query all the business units in a specific BIM 360 account.
         Scope account:read'''
         checkScopes(token, "account:read")
-        endpoint_url = "/hq/v1/accounts/{aId}/business_units_structure".format(aId=token.bim_account_id)
-        r = requests.get(endpoint_url, headers=token.get_header).json()
-        checkResponse(r)
+        endpoint_url = BASE_URL+"/hq/v1/accounts/{aId}/business_units_structure".format(aId=token.bim_account_id)
+        r = checkResponse(token.transport.get(endpoint_url, headers=token.get_header)).json()
         if r == {}:
             raise AFWExceptions.APIError("No business units in this account.")
         else:
@@ -1018,10 +1000,9 @@ class BusinessUnits(object):
                      # batch _createBusinessUnits (this func)
 
         checkScopes(token, "account:read")
-        endpoint_url = "/hq/v1/accounts/{aId}/business_units_structure".format(aId=token.bim_account_id)
+        endpoint_url = BASE_URL+"/hq/v1/accounts/{aId}/business_units_structure".format(aId=token.bim_account_id)
         bness = {"business_units": Data}
-        r = requests.put(endpoint_url, headers=token.patch_header, data=str(bness)).json()
-        checkResponse(r)
+        r = checkResponse(token.transport.put(endpoint_url, headers=token.patch_header, data=str(bness))).json()
         return [cls(u) for u in r["business_units"]]
 
 
@@ -0,0 +1,401 @@
+'''Caches used across the wrapper'''
+
+import os
+import json
+import hashlib
+import threading
+import functools
+
+from collections import OrderedDict
+from time import monotonic
+
+# Headers responses vary with: the user and the region routing headers
+_KEY_HEADERS = ("Authorization", "x-user-id", "x-ads-region", "Region")
+
+
+def _header(headers, name):
+    '''Case insensitive header lookup'''
+    name = name.lower()
+    return next((v for k, v in headers.items() if k.lower() == name), None)
+
+
+class IdentityMap(object):
+    '''Keeps a single object per entity id.<br>
+    max_size - Past this many entries the least recently used are evicted<br>
+    ttl - Seconds an entry is served before it has to be requested again'''
+    def __init__(self, max_size=1024, ttl=300):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        '''Returns the cached object or None if missing or expired'''
+        with self._lock:
+            entry = self._entries.get(key, None)
+            if entry is None:
+                return None
+            obj, expires = entry
+            if expires < monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return obj
+
+    def intern(self, key, obj):
+        '''Caches obj, or if key is already cached refreshes that object in place with
+        the attributes of obj and returns it. Either way the ttl starts again'''
+        with self._lock:
+            entry = self._entries.get(key, None)
+            if entry is not None and type(entry[0]) is type(obj):
+                cached = entry[0]
+                cached.__dict__.update({k: v for k, v in obj.__dict__.items() if v is not None})
+                obj = cached
+            self._entries[key] = (obj, monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+            return obj
+
+    def discard(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class CachedResponse(object):
+    '''A stored response body and the headers it came with'''
+    # The body is stored decoded, these would describe the original one
+    _dropped_headers = ("content-encoding", "content-length", "transfer-encoding")
+
+    def __init__(self, url, status_code, headers, content):
+        self.url = url
+        self.status_code = status_code
+        self.headers = {k: v for k, v in headers.items() if k.lower() not in self._dropped_headers}
+        self.content = content
+
+    @property
+    def etag(self):
+        return _header(self.headers, "ETag")
+    @property
+    def last_modified(self):
+        return _header(self.headers, "Last-Modified")
+    @property
+    def size(self):
+        return len(self.content)
+
+    def to_response(self, revalidation):
+        '''Builds a requests.Response with the stored body, revalidation is the 304 response'''
+        from requests.models import Response
+        from requests.structures import CaseInsensitiveDict
+        from requests.utils import get_encoding_from_headers
+
+        r = Response()
+        r.status_code = self.status_code
+        r.reason = "OK"
+        r.headers = CaseInsensitiveDict(self.headers)
+        r.encoding = get_encoding_from_headers(r.headers)
+        r.url = self.url
+        r._content = self.content
+        r.request = revalidation.request
+        r.elapsed = revalidation.elapsed
+        r.connection = revalidation.connection
+        return r
+
+
+class MemoryBackend(object):
+    '''Keeps cached responses in memory.<br>
+    max_bytes - Past this many body bytes the least recently used responses are evicted'''
+    def __init__(self, max_bytes=64*1024*1024):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key, None)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key, entry):
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._size -= old.size
+            if entry.size > self.max_bytes:
+                return
+            self._entries[key] = entry
+            self._size += entry.size
+            while self._size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= evicted.size
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+
+class DiskBackend(object):
+    '''Keeps cached responses as files in a directory, so they outlive the process.<br>
+    directory - Created if missing<br>
+    max_bytes - Past this many body bytes the least recently used responses are deleted'''
+    def __init__(self, directory, max_bytes=256*1024*1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+        # key -> body size, ordered from least to most recently used
+        self._index = OrderedDict()
+        self._size = 0
+        bodies = [f for f in os.listdir(directory) if f.endswith(".body")]
+        bodies.sort(key=lambda f: os.path.getmtime(os.path.join(directory, f)))
+        for f in bodies:
+            size = os.path.getsize(os.path.join(directory, f))
+            self._index[f[:-len(".body")]] = size
+            self._size += size
+
+    def _path(self, key, ext):
+        return os.path.join(self.directory, key+ext)
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._index:
+                return None
+            try:
+                with open(self._path(key, ".json")) as f:
+                    meta = json.load(f)
+                with open(self._path(key, ".body"), "rb") as f:
+                    content = f.read()
+            except (OSError, ValueError):
+                self._remove(key)
+                return None
+            os.utime(self._path(key, ".body"))
+            self._index.move_to_end(key)
+        return CachedResponse(meta["url"], meta["status_code"], meta["headers"], content)
+
+    def put(self, key, entry):
+        with self._lock:
+            if key in self._index:
+                self._remove(key)
+            if entry.size > self.max_bytes:
+                return
+            meta = {"url": entry.url, "status_code": entry.status_code, "headers": entry.headers}
+            with open(self._path(key, ".json.tmp"), "w") as f:
+                json.dump(meta, f)
+            with open(self._path(key, ".body.tmp"), "wb") as f:
+                f.write(entry.content)
+            os.replace(self._path(key, ".json.tmp"), self._path(key, ".json"))
+            os.replace(self._path(key, ".body.tmp"), self._path(key, ".body"))
+            self._index[key] = entry.size
+            self._size += entry.size
+            while self._size > self.max_bytes:
+                self._remove(next(iter(self._index)))
+
+    def _remove(self, key):
+        self._size -= self._index.pop(key, 0)
+        for ext in (".json", ".body"):
+            try:
+                os.remove(self._path(key, ext))
+            except OSError:
+                pass
+
+    def clear(self):
+        with self._lock:
+            for key in list(self._index):
+                self._remove(key)
+
+
+class ResponseCache(object):
+    '''HTTP response cache for transport.Transport. Only responses with an ETag or
+    Last-Modified header are stored, they are always revalidated with the server.<br>
+    backend - MemoryBackend (default) or DiskBackend'''
+    def __init__(self, backend=None):
+        self.backend = backend or MemoryBackend()
+
+    @staticmethod
+    def key(url, params=None, headers=None):
+        '''Responses are cached per url, query, user and region (utils.REGION_ROUTES routes some
+        APIs with a header, the same url and token may get another region's data)'''
+        headers = headers or {}
+        params = sorted((str(k), str(v)) for k, v in dict(params or {}).items())
+        raw = json.dumps([url, params] + [_header(headers, h) for h in _KEY_HEADERS])
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        return self.backend.get(key)
+
+    def put(self, key, response):
+        if "ETag" not in response.headers and "Last-Modified" not in response.headers:
+            return
+        self.backend.put(key, CachedResponse(response.url, response.status_code,
+                                             dict(response.headers), response.content))
+
+    def clear(self):
+        self.backend.clear()
+
+
+class _Call(object):
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+class SingleFlight(object):
+    '''Collapses concurrent calls with the same key into one, the callers that
+    arrive while it runs wait for it and get the same result (or exception)'''
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn, *args, **kwargs):
+        return self.do_within(None, key, fn, *args, **kwargs)
+
+    def do_within(self, timeout, key, fn, *args, **kwargs):
+        '''Like do, but a caller that joins a running call waits at most timeout seconds
+        (None for as long as it takes) and then raises TimeoutError'''
+        with self._lock:
+            call = self._calls.get(key, None)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            if not call.event.wait(timeout):
+                raise TimeoutError("The call it joined didn't finish within {t:.3f}s".format(t=timeout))
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn(*args, **kwargs)
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+        return call.result
+
+
+class SWRCache(object):
+    '''Stale-while-revalidate cache for endpoints whose data rarely changes.<br>
+    windows - {endpoint name: seconds a result is fresh}, see DEFAULT_SWR_WINDOWS<br>
+    default_max_age - Freshness of endpoints missing from windows<br>
+    max_stale - Seconds past freshness a result is still served while it is refreshed 
+    in the background. Older results are requested again before returning<br>
+    max_entries - Past this many results the least recently used ones are evicted<br><br>
+
+    Concurrent misses of the same key send a single request'''
+    def __init__(self, windows=None, default_max_age=300, max_stale=3600, max_entries=1024):
+        self.windows = dict(windows or {})
+        self.default_max_age = default_max_age
+        self.max_stale = max_stale
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._refreshing = set()
+        self._lock = threading.Lock()
+        self._flight = SingleFlight()
+
+    def call(self, name, key, fn):
+        '''Returns the cached result of fn for key, calling it when missing or too old'''
+        max_age = self.windows.get(name, self.default_max_age)
+        with self._lock:
+            entry = self._entries.get(key, None)
+            if entry is not None:
+                self._entries.move_to_end(key)
+        if entry is not None:
+            value, fetched = entry
+            age = monotonic() - fetched
+            if age < max_age:
+                return value
+            if age < max_age + self.max_stale:
+                self._refresh(key, fn)
+                return value
+        return self._flight.do(key, self._fetch, key, fn)
+
+    def _fetch(self, key, fn):
+        value = fn()
+        with self._lock:
+            self._entries[key] = (value, monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return value
+
+    def _refresh(self, key, fn):
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+
+        def refresh():
+            try:
+                self._flight.do(key, self._fetch, key, fn)
+            except Exception:
+                pass # Keep serving the stale result, the next call past max_stale raises
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+        threading.Thread(target=refresh, daemon=True).start()
+
+    def invalidate(self, name=None):
+        '''Drops the results of one endpoint, or all of them'''
+        with self._lock:
+            for key in list(self._entries):
+                if name is None or key[0] == name:
+                    self._entries.pop(key, None)
+
+
+DEFAULT_SWR_WINDOWS = {"b360.Project.get_projects": 300,
+                       "b360.BusinessUnits.get_business_units": 3600,
+                       "b360.Project.industry_roles": 3600,
+                       "tokenflex.Contract.get_contracts": 3600}
+
+_swr_cache = None
+
+def enable_stale_while_revalidate(windows=None, default_max_age=300, max_stale=3600, max_entries=1024):
+    '''Caches the endpoints decorated with stale_while_revalidate, see SWRCache.<br>
+    windows - Updates DEFAULT_SWR_WINDOWS'''
+    global _swr_cache
+    _swr_cache = SWRCache(dict(DEFAULT_SWR_WINDOWS, **(windows or {})), default_max_age, max_stale,
+                          max_entries)
+    return _swr_cache
+
+def disable_stale_while_revalidate():
+    global _swr_cache
+    _swr_cache = None
+
+def _token_identity(token):
+    '''2 legged tokens of the same app, account and scopes see the same data, 3 legged ones
+    are per user. The scopes are part of it, a token lacking the ones of the endpoint must
+    not get the results of one that had them. A 3 legged token that doesn't name its user
+    only shares results with itself, refreshed or not'''
+    scopes = " ".join(sorted(token.scope.split()))
+    if token.is_three_legged:
+        return (token.client_id, token.user_id or token, scopes)
+    return (token.client_id, token.bim_account_id, scopes)
+
+def stale_while_revalidate(name):
+    '''Decorator for endpoints taking (cls or self, token, *args) whose results can be
+    served stale. Does nothing until enable_stale_while_revalidate() is called'''
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(owner, token, *args):
+            if _swr_cache is None:
+                return func(owner, token, *args)
+            owner_id = None if isinstance(owner, type) else owner.id
+            key = (name, _token_identity(token), owner_id, args)
+            return _swr_cache.call(name, key, lambda: func(owner, token, *args))
+        return wrapper
+    return decorator
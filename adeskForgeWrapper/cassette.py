@@ -0,0 +1,205 @@
+'''Record the requests of a run to a cassette file and replay them later with no network,
+to rerun production shaped workloads through new versions of the wrapper'''
+
+import io
+import gzip
+import json
+import base64
+import hashlib
+import datetime
+import threading
+import urllib.parse
+
+from collections import deque
+from time import sleep
+from time import perf_counter
+
+from . import AFWExceptions
+from .transport import Transport
+
+# Secrets in the token responses are replaced before they are written
+_REDACTED_FIELDS = ("access_token", "refresh_token")
+
+
+def _request_key(method, url, body, match_body):
+    '''Requests are matched by method, path, query (sorted) and optionally a hash of the body.
+    The host is left out so a cassette replays behind any base_url'''
+    parsed = urllib.parse.urlsplit(url)
+    query = urllib.parse.urlencode(sorted(urllib.parse.parse_qsl(parsed.query, keep_blank_values=True)))
+    url = urllib.parse.urlunsplit(("", "", parsed.path, query, ""))
+    digest = None
+    if match_body and body:
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+        digest = hashlib.sha1(body).hexdigest() if isinstance(body, bytes) else None
+    return "{m} {u} {d}".format(m=method, u=url, d=digest)
+
+def _matches_body(url):
+    # Token requests carry the client secret, they match whatever the secret is
+    return "/authentication/" not in url
+
+
+class Cassette(object):
+    '''Request/response pairs in a gzipped JSON lines file, one pair per line.<br>
+    Bodies are kept as text when they are UTF-8, base64 otherwise. Request headers are not
+    stored and tokens in the responses are redacted, so cassettes can be shared'''
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+        self._lock = threading.Lock()
+
+    def append(self, method, url, body, response, content, elapsed):
+        '''Writes a pair, content is the response body and elapsed the seconds until its headers'''
+        try:
+            text, encoded = content.decode("utf-8"), "text"
+        except UnicodeDecodeError:
+            text, encoded = base64.b64encode(content).decode("ascii"), "base64"
+        if not _matches_body(url) and encoded == "text":
+            text = self._redact(text)
+        entry = {"key": _request_key(method, url, body, _matches_body(url)),
+                 "loose": _request_key(method, url, None, False),
+                 "status": response.status_code,
+                 "reason": response.reason,
+                 "headers": {k: v for k, v in response.headers.items() if k.lower() != "set-cookie"},
+                 encoded: text,
+                 "elapsed": round(elapsed, 6)}
+        line = (json.dumps(entry, separators=(",", ":")) + "\n").encode("utf-8")
+        with self._lock:
+            if self._file is None:
+                self._file = gzip.open(self.path, "ab")
+            self._file.write(line)
+
+    @staticmethod
+    def _redact(text):
+        try:
+            raw = json.loads(text)
+        except ValueError:
+            return text
+        if isinstance(raw, dict):
+            for field in _REDACTED_FIELDS:
+                if field in raw:
+                    raw[field] = "redacted"
+        return json.dumps(raw)
+
+    def entries(self):
+        '''The recorded pairs, in the order they were recorded'''
+        self.close()
+        with gzip.open(self.path, "rb") as f:
+            return [json.loads(line) for line in f if line.strip()]
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+_adapter_classes = None
+
+def adapter_classes():
+    '''(RecordingAdapter, ReplayAdapter), requests adapters built on first use so importing
+    this module doesn't import requests'''
+    global _adapter_classes
+    if _adapter_classes is not None:
+        return _adapter_classes
+
+    from requests.adapters import BaseAdapter
+    from requests.models import Response
+    from requests.structures import CaseInsensitiveDict
+    from requests.utils import get_encoding_from_headers
+
+    class RecordingAdapter(BaseAdapter):
+        '''Sends through the adapter it wraps and writes every pair to the cassette'''
+        def __init__(self, inner, cassette):
+            super().__init__()
+            self.inner = inner
+            self.cassette = cassette
+
+        def send(self, request, stream=False, **kwargs):
+            start = perf_counter()
+            r = self.inner.send(request, stream=stream, **kwargs)
+            elapsed = perf_counter() - start
+            # Streamed bodies are read here to record them, they are then served from memory
+            self.cassette.append(request.method, request.url, request.body, r, r.content, elapsed)
+            return r
+
+        def close(self):
+            self.inner.close()
+            self.cassette.close()
+
+    class ReplayAdapter(BaseAdapter):
+        '''Answers from the cassette, nothing is sent'''
+        def __init__(self, cassette, latency_scale=0.0):
+            super().__init__()
+            self.latency_scale = latency_scale
+            self._lock = threading.Lock()
+            self._exact = {}
+            self._loose = {}
+            for entry in cassette.entries():
+                self._exact.setdefault(entry["key"], deque()).append(entry)
+                self._loose.setdefault(entry["loose"], deque()).append(entry)
+
+        def _next(self, queues, key):
+            # The same request recorded more than once (eg polling) replays in order, the
+            # last answer repeats once they run out
+            queue = queues.get(key, None)
+            if not queue:
+                return None
+            with self._lock:
+                return queue.popleft() if len(queue) > 1 else queue[0]
+
+        def send(self, request, stream=False, **kwargs):
+            url = request.url
+            entry = self._next(self._exact, _request_key(request.method, url, request.body, _matches_body(url)))
+            if entry is None: # Bodies with ids or timestamps generated at run time
+                entry = self._next(self._loose, _request_key(request.method, url, None, False))
+            if entry is None:
+                raise AFWExceptions.AFWError("No recorded response for {m} {u}".format(m=request.method, u=url))
+
+            content = entry["text"].encode("utf-8") if "text" in entry else base64.b64decode(entry["base64"])
+            if self.latency_scale:
+                sleep(entry["elapsed"] * self.latency_scale)
+
+            r = Response()
+            r.status_code = entry["status"]
+            r.reason = entry["reason"]
+            r.headers = CaseInsensitiveDict(entry["headers"])
+            r.headers.pop("Content-Encoding", None) # The body was stored decoded
+            r.encoding = get_encoding_from_headers(r.headers)
+            r.url = url
+            r.request = request
+            r.elapsed = datetime.timedelta(seconds=entry["elapsed"])
+            r.raw = io.BytesIO(content)
+            if not stream:
+                r._content = content
+            return r
+
+        def close(self):
+            pass
+
+    _adapter_classes = (RecordingAdapter, ReplayAdapter)
+    return _adapter_classes
+
+def _mount(transport, adapter):
+    transport.session.mount("https://", adapter)
+    transport.session.mount("http://", adapter)
+    return transport
+
+def record_transport(path, **kwargs):
+    '''A transport.Transport that sends requests as usual and appends every request/response
+    pair to the cassette at path. Takes the arguments of Transport.<br>
+    Streamed downloads are read into memory to record them'''
+    transport = Transport(**kwargs)
+    inner = transport.session.get_adapter("https://")
+    return _mount(transport, adapter_classes()[0](inner, Cassette(path)))
+
+def replay_transport(path, latency_scale=0.0, **kwargs):
+    '''A transport.Transport that answers from the cassette at path, without network.<br>
+    latency_scale - Sleep this fraction of each recorded response time, 1 reproduces the
+    original latencies and 0 (default) answers at once<br><br>
+
+    Requests are matched by method, path, query and body. If the body differs from the recorded one
+    (ids or timestamps made at run time) the method, path and query are enough. Unknown requests
+    raise AFWError. Caching, coalescing, retries and metrics of the transport work as usual'''
+    transport = Transport(**kwargs)
+    return _mount(transport, adapter_classes()[1](Cassette(path), latency_scale))
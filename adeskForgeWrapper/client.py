@@ -1,36 +1,69 @@
 '''Client information and token requests'''
-import requests
+import hmac
+import base64
+import json
+import hashlib
+import secrets
+import threading
 
 from time import sleep
+from time import time
 
+from . import utils
 from .utils import AUTH_API
 from .utils import INFO_AUTH
 from .utils import checkResponse
 from .utils import checkScopes
 
+from .transport import default_transport
+from .tokenstore import TokenStore
+
 from . import AFWExceptions
 
 class Client(object):
     '''A class containing information from the user's end
     client_id and client_secret from the Forge app
-    bimAcc and bim_account_name are your B360 credentials'''
+    bimAcc and bim_account_name are your B360 credentials
+    transport - A transport.Transport for the requests of this client and its tokens, 
+    the shared default one if None
+    token_store - A tokenstore.TokenStore 2 legged tokens are shared through, eg 
+    tokenstore.FileTokenStore so several processes don't all request the same token
+    region - Region of the account ("US", "EMEA"), requests are routed to its endpoints. 
+    See `detect_region`
+    http2 - Without a transport, use the shared HTTP/2 one (`default_transport(http2=True)`)'''
     
-    def __init__(self, client_id, client_secret, bim_account_id, bim_account_name):
+    def __init__(self, client_id, client_secret, bim_account_id, bim_account_name, transport=None, token_store=None,
+                 region=None, http2=False):
         self.client_id = client_id
         self.client_secret = client_secret
         self.bim_account_id = bim_account_id
         self.bim_account_name = bim_account_name
         self.hub_id = "b.{}".format(bim_account_id)
+        self._transport = transport
+        self.token_store = token_store
+        self.region = region
+        self.http2 = http2
+
+    @property
+    def transport(self):
+        transport = self._transport or default_transport(self.http2)
+        if self.region is None:
+            return transport
+        return transport.for_region(self.region)
+
+    def detect_region(self, token):
+        '''Sets region to the region of the account hub and returns it<br>
+        Scope - data:read'''
+        from .datamgt import Hub # datamgt imports this module
+        self.region = Hub.hubById(token, self.hub_id).region
+        return self.region
 
     def me(self, token):
         '''Get the profile information of an authorizing end user in a 
         three-legged context.'''
         endpoint_url = INFO_AUTH+"/users/@me"
-        r = requests.get(endpoint_url, headers=token.get_header).json()
-        checkResponse(r)
-        print(r) # TODO Maybe can return a DM.User object
+        return checkResponse(token.transport.get(endpoint_url, headers=token.get_header)).json() # TODO Maybe can return a DM.User object
 
-# TODO new defs: getExpirationTime, renew
 class Token(object):
     '''A class representing the token.<br>
     raw<br>
@@ -41,7 +74,9 @@ class Token(object):
     get_header<br>
     patchHeader<br>
     contentXUser<br>'''
-    def __init__(self, client, r, scope, flow):
+    def __init__(self, client, r, scope, flow, store=None):
+        self._client = client
+        self._store = store
         self._client_id = client.client_id
         self._client_secret = client.client_secret
         self._bim_account_id = client.bim_account_id
@@ -49,20 +84,102 @@ class Token(object):
         self._hub_id = client.hub_id
         self._is_three_legged = flow
         self._scope = scope
+        self._refresh_lock = threading.Lock()
+        self._refresh_timer = None
+        self._auto_refresh = None
+        self._user_id = None
+        self._set_raw(r)
 
+    def _set_raw(self, r):
         if type(r) == dict:
             self._raw = r
             
             self._token_type = r.get("token_type", None)
             self._expires_in = r.get("expires_in", None)
+            self._expires_at = r.get("expires_at", None)
+            if self._expires_at is None and self._expires_in is not None:
+                self._expires_at = time() + int(self._expires_in)
             self._access_token = 'Bearer {}'.format(r.get("access_token"))
 
         elif type(r) == str:
             self._raw = r
             self._token_type = None
             self._expires_in = None
+            self._expires_at = None
             self._access_token = 'Bearer {}'.format(r)
-       
+        # Kept across refreshes, the new token acts for the same user
+        self._user_id = _jwt_user_id(self._access_token) or self._user_id
+
+    def refresh(self):
+        '''Requests a new token with the same scope and swaps it in place. Requests already 
+        sent keep the old bearer, the ones sent afterwards use the new one.<br>
+        3 legged tokens are renewed with their refresh token, only the code flow gives one.<br>
+        With a token store, a token another process refreshed already is used instead'''
+        with self._refresh_lock:
+            client = self._client
+            if self._is_three_legged:
+                if type(self._raw) != dict or self._raw.get("refresh_token", None) is None:
+                    raise AFWExceptions.AFWError("Only 3 legged tokens from the code flow can be refreshed")
+                key = TokenStore.key(client.client_id, self._scope, True)
+
+                def fetch():
+                    # Refresh tokens are single use, another process may have used ours
+                    latest = (self._store.read(key) if self._store is not None else None) or self._raw
+                    return self._request_3_legged(client, "/refreshtoken",
+                                                  {"grant_type": "refresh_token",
+                                                   "refresh_token": latest["refresh_token"],
+                                                   "scope": self._scope})
+            else:
+                key = TokenStore.key(client.client_id, self._scope)
+                fetch = lambda: self._request_2_legged(self._scope, client)
+
+            if self._store is None:
+                r = fetch()
+            else:
+                r = self._store.get_or_fetch(key, fetch, newer_than=self._expires_at)
+            self._set_raw(r)
+
+    def auto_refresh(self, fraction=0.75, retry_delay=30):
+        '''Refreshes the token in a background thread once fraction of its lifetime has 
+        passed, so requests never wait on (or fail because of) an expired token.<br>
+        retry_delay - Seconds before trying again if a refresh fails<br><br>
+        
+        Call stop_auto_refresh() to stop it'''
+        if self._expires_in is None:
+            raise AFWExceptions.AFWError("This token has no expiration time")
+        self.stop_auto_refresh()
+        settings = self._auto_refresh = (fraction, retry_delay)
+        self._schedule_refresh(settings)
+
+    def _schedule_refresh(self, settings, delay=None):
+        # settings is read once, stop_auto_refresh() may clear self._auto_refresh at any time
+        fraction, retry_delay = settings
+        if delay is None:
+            delay = (self._expires_at - time()) - int(self._expires_in)*(1 - fraction)
+
+        def run():
+            try:
+                self.refresh()
+            except Exception:
+                next_delay = retry_delay
+            else:
+                next_delay = None
+            if self._auto_refresh is settings: # Neither stopped nor restarted meanwhile
+                self._schedule_refresh(settings, next_delay)
+
+        timer = threading.Timer(max(delay, 0), run)
+        timer.daemon = True
+        self._refresh_timer = timer
+        timer.start()
+        if self._auto_refresh is not settings: # Stopped while this timer was being set
+            timer.cancel()
+
+    def stop_auto_refresh(self):
+        self._auto_refresh = None
+        if self._refresh_timer is not None:
+            self._refresh_timer.cancel()
+            self._refresh_timer = None
+
     @property
     def client_id(self):
         return self._client_id
@@ -79,6 +196,9 @@ class Token(object):
     def hub_id(self):
         return self._hub_id
     @property
+    def transport(self):
+        return self._client.transport
+    @property
     def raw(self):
         return self._raw
     @property
@@ -91,9 +211,16 @@ class Token(object):
     def expires_in(self):
         return self._expires_in
     @property
+    def expires_at(self):
+        return self._expires_at
+    @property
     def access_token(self):
         return self._access_token
     @property
+    def user_id(self):
+        '''Id of the user a 3 legged token acts for, read from the token. None if it doesn't say'''
+        return self._user_id if self._is_three_legged else None
+    @property
     def get_header(self):
         header = {"Authorization":self._access_token}
         return header
@@ -124,47 +251,159 @@ class Token(object):
                   'x-user-id':self._bim_account_id}
         return header
     @property
+    def json_api(self):
+        header = {'Content-Type': 'application/vnd.api+json',
+                  'Authorization': self._access_token}
+        return header
+    @property
     def is_three_legged(self):
         return self._is_three_legged
 
     @classmethod
-    def get_2_legged_token(cls, scope, client):
+    def get_2_legged_token(cls, scope, client, store=None):
         '''Gets a 2 legged token according to the scope.<br>
         Scope - The scope you aim for. <br>
-        eg "account:read data:read". client_id and client_secret from the forge api web'''
+        eg "account:read data:read". client_id and client_secret from the forge api web<br>
+        store - A tokenstore.TokenStore, by default the client's token_store. 
+        A valid stored token is reused instead of requesting a new one'''
+        store = store or client.token_store
+        if store is None:
+            r = cls._request_2_legged(scope, client)
+        else:
+            r = store.get_or_fetch(TokenStore.key(client.client_id, scope),
+                                   lambda: cls._request_2_legged(scope, client))
+        return cls(client, r, scope, False, store)
 
+    @staticmethod
+    def _request_2_legged(scope, client):
         header = {"Content-Type":"application/x-www-form-urlencoded"}
         data = {"client_id":client.client_id,
                 "client_secret":client.client_secret,
                 "grant_type":"client_credentials",
                 "scope":"{}".format(scope)}
         endpoint_url = AUTH_API+"/authenticate"
-        r = requests.post(endpoint_url, data, header).json()
-        checkResponse(r)
-        return cls(client, r, scope, False)
+        r = checkResponse(client.transport.post(endpoint_url, data=data, headers=header)).json()
+        r["expires_at"] = time() + int(r.get("expires_in", 0))
+        return r
+
+    @staticmethod
+    def _request_3_legged(client, path, data):
+        '''Token request of the code flow, path is /gettoken or /refreshtoken'''
+        header = {"Content-Type":"application/x-www-form-urlencoded"}
+        data = dict(data, client_id=client.client_id, client_secret=client.client_secret)
+        r = checkResponse(client.transport.post(AUTH_API+path, data=data, headers=header)).json()
+        r["expires_at"] = time() + int(r.get("expires_in", 0))
+        return r
+
+    @staticmethod
+    def _receive_code(authorize_url, callback_URL, timeout, state):
+        '''Opens the authorization page and returns the code the user is redirected with.<br>
+        If callback_URL is a loopback address (localhost, 127.0.0.1, [::1]) the redirect is 
+        received by a local server, otherwise the user pastes the url they were redirected to.<br>
+        state - Sent with the authorization request, redirects that don't carry it back were
+        not started by this login (login CSRF) and are refused'''
+        import urllib.parse
+        import webbrowser
+        from http.server import BaseHTTPRequestHandler
+        from http.server import HTTPServer
+
+        callback = urllib.parse.urlparse(callback_URL)
+        if callback.hostname not in ("localhost", "127.0.0.1", "::1"):
+            print("You will be prompted to login. Do so and copy the url you were redirected to")
+            webbrowser.open(authorize_url, new = 0, autoraise=True)
+            responseUrl = input("Copy the url you were redirected to here, entirely: ")
+            query = urllib.parse.parse_qs(urllib.parse.urlparse(responseUrl).query)
+            if query.get("state", [None])[0] != state:
+                raise AFWExceptions.AFWError("Authorization failed: the state of the redirect doesn't match")
+        else:
+            query = {}
+
+            class CallbackHandler(BaseHTTPRequestHandler):
+                def do_GET(self):
+                    o = urllib.parse.urlparse(self.path)
+                    if o.path != (callback.path or "/"):
+                        self.send_response(404)
+                        self.end_headers()
+                        return
+                    received = urllib.parse.parse_qs(o.query)
+                    if not hmac.compare_digest(received.get("state", [""])[0], state):
+                        self.send_response(400) # Not this login's redirect, keep waiting for it
+                        self.end_headers()
+                        return
+                    query.update(received)
+                    self.send_response(200)
+                    self.send_header("Content-Type", "text/plain")
+                    self.end_headers()
+                    self.wfile.write(b"Authorization received, you can close this window.")
+                def log_message(self, format, *args):
+                    pass
+
+            server_class = HTTPServer
+            if ":" in callback.hostname: # ::1, HTTPServer only binds IPv4 addresses
+                import socket
+                class server_class(HTTPServer):
+                    address_family = socket.AF_INET6
+            server = server_class((callback.hostname, callback.port or 80), CallbackHandler)
+            server.timeout = 1
+            try:
+                webbrowser.open(authorize_url, new = 0, autoraise=True)
+                deadline = time() + timeout
+                while "code" not in query and "error" not in query and time() < deadline:
+                    server.handle_request()
+            finally:
+                server.server_close()
+
+        if "code" not in query:
+            error = query.get("error", ["timed out waiting for the authorization"])[0]
+            raise AFWExceptions.AFWError("Authorization failed: {}".format(error))
+        return query["code"][0]
 
     @classmethod
-    def get_3_legged_token(cls, scope, client, callback_URL, tokenType="token"):
+    def get_3_legged_token(cls, scope, client, callback_URL, tokenType="token", store=None, timeout=300):
         '''Get a 3 legged token according to the scope.<br>
         Scope - The scope you aim for. <br>
         callback_URL: The callback url the user will be taken to after authorization.<br>
         url must be the same callback url you used to register your Forge App.<br>
-        eg "account:read data:read". client_id and client_secret from the forge api web'''
+        eg "account:read data:read". client_id and client_secret from the forge api web<br>
+        tokenType - "token" (implicit flow) or "code". Code flow tokens come with a refresh 
+        token, see `refresh` and `auto_refresh`. With a loopback callback_URL 
+        (eg http://localhost:8080/callback) the redirect is received automatically<br>
+        store - A tokenstore.TokenStore for code flow tokens. After authorizing once, 
+        later calls renew the stored token with its refresh token, no browser involved<br>
+        timeout - Seconds to wait for the loopback redirect<br><br>
+
+        Each login sends a random state and refuses redirects without it, the code flow
+        also uses PKCE (S256)'''
 
         if  "http://" not in callback_URL and "https://" not in callback_URL:
             raise AFWExceptions.AFWError("Protocol missing in callback_URL (http:// or https://)")
+
+        if tokenType == "code" and store is not None:
+            raw = store.read(TokenStore.key(client.client_id, scope, True))
+            if raw is not None and raw.get("refresh_token", None) is not None:
+                token = cls(client, raw, scope, True, store)
+                if token.expires_at is None or token.expires_at - store.margin < time():
+                    token.refresh()
+                return token
         
         import urllib.parse
         import webbrowser
     
         endpoint_url = AUTH_API+"/authorize"
 
+        # state ties the redirect to this login, PKCE the code to this process
+        state = secrets.token_urlsafe()
         params = (("client_id", client.client_id), 
                   ("response_type", tokenType), 
                   ("redirect_uri", callback_URL), 
-                  ("scope", scope))
+                  ("scope", scope),
+                  ("state", state))
+        if tokenType == "code":
+            verifier = secrets.token_urlsafe(64)
+            challenge = base64.urlsafe_b64encode(hashlib.sha256(verifier.encode("ascii")).digest()).rstrip(b"=")
+            params += (("code_challenge", challenge.decode("ascii")), ("code_challenge_method", "S256"))
 
-        r = requests.post(endpoint_url, params=params)
+        r = client.transport.post(endpoint_url, params=params)
 
         checkResponse(r)
         if tokenType == "token":
@@ -174,19 +413,95 @@ class Token(object):
 
             o = urllib.parse.urlparse(responseUrl)
             query = urllib.parse.parse_qs(o.fragment)
+            if query.get("state", [None])[0] != state:
+                raise AFWExceptions.AFWError("Authorization failed: the state of the redirect doesn't match")
             r={"token_type":query["token_type"][0],
             "expires_in":query["expires_in"][0],
             "access_token":query["access_token"][0]}
 
             return cls(client, r, scope, True)
         elif tokenType == "code":
-            pass # TODO
-            
-            
+            code = cls._receive_code(r.url, callback_URL, timeout, state)
+            r = cls._request_3_legged(client, "/gettoken", 
+                                      {"grant_type": "authorization_code",
+                                       "code": code,
+                                       "redirect_uri": callback_URL,
+                                       "code_verifier": verifier})
+            if store is not None:
+                key = TokenStore.key(client.client_id, scope, True)
+                with store.lock(key):
+                    store.write(key, r)
+            return cls(client, r, scope, True, store)
         else:
             raise AFWExceptions.AFWError("Token type must be 'code' or 'token'")
 
 
+def _jwt_user_id(access_token):
+    '''The userid claim of a JWT bearer, None for opaque tokens'''
+    try:
+        payload = access_token.split(" ")[-1].split(".")[1]
+        claims = json.loads(base64.urlsafe_b64decode(payload + "="*(-len(payload) % 4)))
+        return claims.get("userid", None) if isinstance(claims, dict) else None
+    except (IndexError, ValueError):
+        return None
+
+def _warm_up_hosts():
+    return (AUTH_API, utils.AUTODESK_BASE_URL+"/hq/v1", utils.AUTODESK_BASE_URL+"/data/v1", utils.da_api())
+
+def warm_up(client, scopes, hosts=None, connections=4, prefetch=False):
+    '''Gets everything a cold process needs before its first request, all at once: 
+    pooled connections (DNS, TCP and TLS) to the hosts, the 2 legged tokens and 
+    optionally the hubs and their projects.<br>
+    client - The Client to warm up, use a transport.Transport with a pool_size of at least connections<br>
+    scopes - A scope or list of scopes, a token is requested (or loaded from the client's token_store) for each<br>
+    hosts - Urls whose hosts get connections, by default the auth, hq, data and DA apis<br>
+    connections - Connections opened to each host<br>
+    prefetch - Also get the hubs and their projects, needs a data:read token<br><br>
+
+    Connection failures are ignored, a host that can't be reached is simply not warm.<br>
+    Returns {"tokens": {scope: Token}, "hubs": [datamgt.Hub], "projects": {hub_id: [datamgt.Project]}}'''
+    import urllib.parse
+    from concurrent.futures import ThreadPoolExecutor
+
+    if isinstance(scopes, str):
+        scopes = [scopes]
+    hosts = hosts or _warm_up_hosts()
+    roots = []
+    for url in hosts:
+        o = urllib.parse.urlparse(url)
+        root = "{s}://{h}/".format(s=o.scheme, h=o.netloc)
+        if root not in roots:
+            roots.append(root)
+
+    def connect(root):
+        try:
+            # stream skips coalescing, so each call gets its own connection. Reading the
+            # (empty) body hands the connection back to the pool
+            client.transport.head(root, stream=True, timeout=10).content
+        except Exception:
+            pass
+
+    result = {"tokens": {}, "hubs": [], "projects": {}}
+    with ThreadPoolExecutor(max_workers=len(roots)*connections + len(scopes)) as pool:
+        connecting = [pool.submit(connect, root) for root in roots for _ in range(connections)]
+        tokens = [pool.submit(Token.get_2_legged_token, scope, client) for scope in scopes]
+        for scope, token in zip(scopes, tokens):
+            result["tokens"][scope] = token.result()
+
+        if prefetch:
+            from .datamgt import Hub # datamgt imports this module
+            token = next((t for t in result["tokens"].values() if "data:read" in t.scope.split()), None)
+            if token is None:
+                raise AFWExceptions.AFWError("Prefetching needs a data:read token")
+            result["hubs"] = Hub.get_hubs(token)
+            projects = [pool.submit(hub.get_projects, token) for hub in result["hubs"]]
+            for hub, p in zip(result["hubs"], projects):
+                result["projects"][hub.hub_id] = p.result()
+        for c in connecting:
+            c.result()
+    return result
+
+
 
 # pdocs stuff
 __pdoc__ = {}
@@ -4,9 +4,20 @@
 # ----------
 '''Module for the Data Management API'''
 
-import requests
+import json
+import os
+import uuid
+import heapq
+import itertools
+
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import wait
+from concurrent.futures import FIRST_COMPLETED
 
 from . import AFWExceptions
+from . import events
+from . import utils
+from .cache import IdentityMap
 from .client import Client
 from .client import Token
 from .client import checkResponse
@@ -14,6 +25,119 @@ from .client import checkScopes
 
 from .utils import AUTODESK_BASE_URL as BASE_URL
 
+# Files larger than this are uploaded in chunks of this size, see upload_object
+UPLOAD_CHUNK_SIZE = 16*1024*1024
+
+_identity_map = None
+
+def enable_identity_map(max_size=1024, ttl=300):
+    '''Keeps a single Hub, Project, Folder, Item and Version object per id.<br>
+    max_size - Past this many objects the least recently used are dropped<br>
+    ttl - Seconds an object is reused before it is requested again<br><br>
+
+    The *_by_id methods return the cached object without a request and listings 
+    refresh the cached objects in place. Objects are shared between tokens, so 
+    only enable it when every token of the process may see the same entities'''
+    global _identity_map
+    _identity_map = IdentityMap(max_size, ttl)
+    return _identity_map
+
+def disable_identity_map():
+    global _identity_map
+    _identity_map = None
+
+def _intern(obj):
+    '''Returns the cached object for obj's id (refreshed with obj) if the identity map is on'''
+    if _identity_map is None:
+        return obj
+    return _identity_map.intern((type(obj).__name__, obj.raw.get("id", None)), obj)
+
+def _cached(cls, entity_id):
+    if _identity_map is None:
+        return None
+    return _identity_map.get((cls.__name__, entity_id))
+
+def _json_api_header(token):
+    '''Header for json:api POST and PATCH requests. 2 legged tokens also need 
+    the x-user-id header in BIM 360 projects'''
+    header = token.json_api
+    if token.is_three_legged is False:
+        header["x-user-id"] = token.bim_account_id
+    return header
+
+def _tip_id(rawItem):
+    '''Id of the tip version of a raw item'''
+    tip = rawItem.get("relationships", {}).get("tip", None)
+    if tip is None:
+        return None
+    return tip["data"].get("id", None)
+
+def _included_versions(r, parent_project_id):
+    '''Indexes the versions in the included array of a response by id'''
+    return {v["id"]: _intern(Version(v, parent_project_id)) 
+            for v in r.get("included", []) if v["type"] == "versions"}
+
+def _oss_object_url(storage_id):
+    '''Storage ids look like urn:adsk.objects:os.object:wip.dm.prod/977d69b1.rvt<br>
+    Returns the OSS url of that object'''
+    bucket_key, object_name = storage_id.split(":")[-1].split("/", 1)
+    return BASE_URL+"/oss/v2/buckets/{bKey}/objects/{oName}".format(
+        bKey=bucket_key, oName=object_name)
+
+class Options(object):
+    '''Query parameters for Data Management listings, they are applied by the server 
+    so only the matching data is sent back'''
+
+    @staticmethod
+    def filter_options(**kwargs):
+        '''Filters for `Folder.get_contents`, `Item.get_versions`, `Item.get_tip_versions`, 
+        `sync.walk` and `sync.mirror_down`<br>
+        Values can be a list (any of them matches) or an (operator, value) tuple, 
+        operators are eq, ge, gt, le, lt, starts, ends and contains.<br>
+        eg filter_options(type="items", extension_type="items:autodesk.bim360:File", 
+        last_modified_time_rollup=("ge", "2020-06-01T00:00:00.000Z"))<br><br>
+
+        kwargs:<br>
+        type - folders, items or versions<br>
+        id<br>
+        extension_type<br>
+        display_name<br>
+        file_type - eg rvt<br>
+        version_number<br>
+        last_modified_time_rollup<br>
+        include_hidden - True to also list hidden items and folders<br>
+        page_number<br>
+        page_limit'''
+        allowedKwgs = ["type", "id", "extension_type", "display_name", "file_type", 
+                       "version_number", "last_modified_time_rollup", "include_hidden", 
+                       "page_number", "page_limit"]
+        utils.allowed_kwargs_check(allowedKwgs, kwargs)
+
+        filters = {"type": "filter[type]",
+                   "id": "filter[id]",
+                   "extension_type": "filter[extension.type]",
+                   "display_name": "filter[displayName]",
+                   "file_type": "filter[fileType]",
+                   "version_number": "filter[versionNumber]",
+                   "last_modified_time_rollup": "filter[lastModifiedTimeRollup]"}
+        params = {}
+        for kwg, value in kwargs.items():
+            if kwg in filters:
+                key = filters[kwg]
+                if type(value) == tuple:
+                    key = "{k}-{op}".format(k=key, op=value[0])
+                    value = value[1]
+                if type(value) == list:
+                    value = ",".join(str(v) for v in value)
+                params[key] = value
+        if kwargs.get("include_hidden", None) is not None:
+            params["includeHidden"] = "true" if kwargs["include_hidden"] else "false"
+        if kwargs.get("page_number", None) is not None:
+            params["page[number]"] = kwargs["page_number"]
+        if kwargs.get("page_limit", None) is not None:
+            params["page[limit]"] = kwargs["page_limit"]
+        return params
+
 class Hub(object):
     _apiType = "hubs"
     def __init__(self, rawDict):
@@ -43,10 +167,12 @@ class Hub(object):
         '''Returns info on the hub give<br>
         Scope - data:read'''
         checkScopes(token, "data:read")
+        cached = _cached(cls, hub_id)
+        if cached is not None:
+            return cached
         endpoint_url = BASE_URL+"/project/v1/hubs/{hId}".format(hId=hub_id)
-        r = requests.get(endpoint_url, headers=token.get_header).json()
-        checkResponse(r)
-        return cls(r)
+        r = checkResponse(token.transport.get(endpoint_url, headers=token.get_header)).json()
+        return _intern(cls(r["data"]))
 
     @classmethod
     def get_hubs(cls, token):
@@ -60,28 +186,94 @@ class Hub(object):
         (formerly known as A360 Team hubs). Personal hubs include A360 Personal hubs.'''
         checkScopes(token, "data:read")
         endpoint_url = BASE_URL+"/project/v1/hubs"
-        r = requests.get(endpoint_url, headers=token.get_header).json()
-        checkResponse(r)
-        return [cls(h) for h in r["data"]]
+        r = checkResponse(token.transport.get(endpoint_url, headers=token.get_header)).json()
+        return [_intern(cls(h)) for h in r["data"]]
 
     def get_projects(self, token):
         '''Returns a list of all projects in the hub<br>
-        Scope - data:read'''
+        Scope - data:read<br><br>
+
+        All pages are requested, following the next link of each page'''
         checkScopes(token, "data:read")
         endpoint_url = BASE_URL+"/project/v1/hubs/{hId}/projects".format(hId=self.hub_id)
-        projects = requests.get(endpoint_url,headers=token.get_header).json()
-        checkResponse(projects)
-        return [Project(p) for p in projects["data"]]
+        results = []
+        while endpoint_url is not None:
+            projects = checkResponse(token.transport.get(endpoint_url,headers=token.get_header)).json()
+            results.extend(_intern(Project(p)) for p in projects["data"])
+            endpoint_url = projects.get("links", {}).get("next", {}).get("href", None)
+        return results
 
     def project_by_id(self, token, projectId):
         '''Returns a specific project by id
         Scope data:read'''
         checkScopes(token, "data:read")
+        cached = _cached(Project, projectId)
+        if cached is not None:
+            return cached
         endpoint_url = BASE_URL+"/project/v1/hubs/{hId}/projects/{pId}".format(
             hId=self.hub_id, pId=projectId)
-        r = requests.get(endpoint_url, headers=token.get_header).json()
-        checkResponse(r)
-        return Project(r["data"])
+        r = checkResponse(token.transport.get(endpoint_url, headers=token.get_header)).json()
+        return _intern(Project(r["data"]))
+
+    def search_iter(self, token, filters=None, projects=None, max_workers=16):
+        '''Searches the top folders of many projects at once, see `Folder.search`.<br>
+        Scope - data:read<br>
+        filters - Options.filter_options()<br>
+        projects - The projects to search, all the projects in the hub by default<br>
+        max_workers - Requests in flight at the same time<br><br>
+
+        Yields the matching versions as each search answers. Stop iterating 
+        (or close the generator) to cancel the searches that have not started. 
+        A project that can't be searched is skipped with a datamgt.search.failed warning'''
+        checkScopes(token, "data:read")
+        if projects is None:
+            projects = self.get_projects(token)
+
+        executor = ThreadPoolExecutor(max_workers=max_workers)
+        top_folders = {executor.submit(p.top_folders, token): p for p in projects}
+        project_of = dict(top_folders) # Future -> the Project it searches
+        pending = set(top_folders)
+        try:
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    project = project_of.pop(future)
+                    try:
+                        result = future.result()
+                    except AFWExceptions.APIError as e:
+                        events.emit("datamgt.search.failed", events.WARNING, project_id=project.id,
+                                    project_name=project.name, error=str(e))
+                        continue
+                    if future in top_folders:
+                        for f in result:
+                            search = executor.submit(f.search, token, filters)
+                            project_of[search] = project
+                            pending.add(search)
+                    else:
+                        for version in result:
+                            yield version
+        finally:
+            for future in pending:
+                future.cancel()
+            executor.shutdown(wait=False)
+
+    def search(self, token, filters=None, projects=None, max_workers=16, limit=None, top_k=None, key=None):
+        '''Searches the top folders of many projects at once, see `search_iter`.<br>
+        Scope - data:read<br>
+        limit - Stop as soon as this many versions were found<br>
+        top_k - Only keep the k greatest versions according to key, 
+        by default the most recently modified<br>
+        key - Function taking a Version, used with top_k<br><br>
+
+        Returns a list of Version objects'''
+        stream = self.search_iter(token, filters, projects, max_workers)
+        try:
+            results = stream if limit is None else itertools.islice(stream, limit)
+            if top_k is not None:
+                return heapq.nlargest(top_k, results, key=key or (lambda v: v.lastModifiedTime or ""))
+            return list(results)
+        finally:
+            stream.close()
 
 class Project(object):
     _apiType = "projects"
@@ -110,12 +302,14 @@ class Project(object):
         '''Returns a specific project by id
         Scope data:read'''
         checkScopes(token, "data:read")
+        cached = _cached(cls, pId)
+        if cached is not None:
+            return cached
         endpoint_url = BASE_URL+"/project/v1/hubs/{hId}/projects/{pId}".format(
             hId=hub_id, pId=pId)
 
-        r = requests.get(endpoint_url, headers=token.get_header).json()
-        checkResponse(r)
-        return cls(r["data"])
+        r = checkResponse(token.transport.get(endpoint_url, headers=token.get_header)).json()
+        return _intern(cls(r["data"]))
 
     def get_hub(self, token):
         '''Returns a specific hub from current project
@@ -132,9 +326,8 @@ class Project(object):
         endpoint_url = BASE_URL+"/project/v1/hubs/{hId}/projects/{pId}/topFolders".format(
             hId=self.hub_id, pId=self.id)
 
-        r = requests.get(endpoint_url, headers=token.get_header).json()
-        checkResponse(r)
-        return [Folder(tF, self.id) for tF in r["data"]]
+        r = checkResponse(token.transport.get(endpoint_url, headers=token.get_header)).json()
+        return [_intern(Folder(tF, self.id)) for tF in r["data"]]
 
 class Folder(object):
     _apiType = "folders"
@@ -189,28 +382,34 @@ class Folder(object):
         projectId: the project id in which the folder is contained
         folderId: the folder id'''
         checkScopes(token, "data:read")
+        cached = _cached(cls, folderId)
+        if cached is not None:
+            return cached
         endpoint_url = BASE_URL+"/data/v1/projects/{p_id}/folders/{f_id}".format(
             p_id=projectId, f_id=folderId)
 
-        r = requests.get(endpoint_url, headers=token.get_header).json()
-        checkResponse(r)
-        return cls(r["data"], projectId)
+        r = checkResponse(token.transport.get(endpoint_url, headers=token.get_header)).json()
+        return _intern(cls(r["data"], projectId))
 
 
-    def create_folder(self, token: Token, project: Project, folderId):
-        '''Returns a specific folder by id
-        Scope data:read
-        p_id: the project id in which the folder is contained
-        f_id: the folder id'''
-        checkScopes(token, "data:read")
-        endpoint_url = BASE_URL+"/data/v1/projects/{p_id}/folders/{f_id}".format(
-            p_id=self.parent_project_id, f_id=self.id)
+    def create_folder(self, token: Token, name, extension_type="folders:autodesk.bim360:Folder"):
+        '''Creates a new folder inside this folder<br>
+        Scope data:create<br>
+        name: the new folder name<br>
+        extension_type: folders:autodesk.bim360:Folder for BIM 360 Docs, 
+        folders:autodesk.core:Folder for A360 and Fusion'''
+        checkScopes(token, "data:create")
+        endpoint_url = BASE_URL+"/data/v1/projects/{p_id}/folders".format(p_id=self.parent_project_id)
+        data = {"jsonapi": {"version": "1.0"},
+                "data": {"type": "folders",
+                         "attributes": {"name": name,
+                                        "extension": {"type": extension_type, "version": "1.0"}},
+                         "relationships": {"parent": {"data": {"type": "folders", "id": self.id}}}}}
 
-        r = requests.get(endpoint_url ,headers=token.get_header).json()
-        checkResponse(r)
-        return Folder(r["data"], self.parent_project_id)
+        r = checkResponse(token.transport.post(endpoint_url, headers=_json_api_header(token), data=json.dumps(data))).json()
+        return _intern(Folder(r["data"], self.parent_project_id))
 
-    def get_contents(self, token, projectId):
+    def get_contents(self, token, projectId, filters=None):
         '''Returns a collection of items and folders within a folder. 
         Items represent word documents, 
         fusion design files, drawings, spreadsheets, etc.<br>
@@ -218,28 +417,158 @@ class Folder(object):
         Notes:<br><br>
 
         The tip version for each item resource is included by default in the included 
-        array of the payload'''
+        array of the payload. It is attached to each Item, see `Item.tip`, 
+        so listing a folder with its versions is one request per page.<br>
+        All pages are requested, following the next link of each page<br>
+        filters - Options.filter_options()'''
         checkScopes(token, "data:read")
         endpoint_url = BASE_URL+"/data/v1/projects/{pId}/folders/{fId}/contents".format(pId=projectId, fId=self.id)
         if token.is_three_legged:
-            r = requests.get(endpoint_url ,headers=token.get_header).json()
+            header = token.get_header
         elif token.is_three_legged is False:
-            r = requests.get(endpoint_url ,headers=token.x_user).json()
-        checkResponse(r)
+            header = token.x_user
+
         results = []
-        for res in r["data"]:
-            if res["type"] == "folders":
-                results.append(Folder(res, self.parent_project_id))
-            elif res["type"] == "items":
-                results.append(Item(res, self.parent_project_id))
-            elif res["type"] == "versions":
-                results.append(Version(res, self.parent_project_id))
+        while endpoint_url is not None:
+            r = checkResponse(token.transport.get(endpoint_url ,headers=header, params=filters)).json()
+            filters = None # The next link already carries them
+            tips = _included_versions(r, self.parent_project_id)
+            for res in r["data"]:
+                if res["type"] == "folders":
+                    results.append(_intern(Folder(res, self.parent_project_id)))
+                elif res["type"] == "items":
+                    results.append(_intern(Item(res, self.parent_project_id, tips.get(_tip_id(res), None))))
+                elif res["type"] == "versions":
+                    results.append(_intern(Version(res, self.parent_project_id)))
+            endpoint_url = r.get("links", {}).get("next", {}).get("href", None)
         return results
 
+    def search(self, token, filters=None):
+        '''Searches this folder and all its subfolders, returns the matching versions.<br>
+        Scope - data:read<br>
+        filters - Options.filter_options(), eg display_name=("contains", "A-101")<br><br>
+
+        To search many projects at once see `Hub.search`'''
+        checkScopes(token, "data:read")
+        endpoint_url = BASE_URL+"/data/v1/projects/{pId}/folders/{fId}/search".format(
+            pId=self.parent_project_id, fId=self.id)
+        if token.is_three_legged:
+            header = token.get_header
+        elif token.is_three_legged is False:
+            header = token.x_user
+
+        results = []
+        while endpoint_url is not None:
+            r = checkResponse(token.transport.get(endpoint_url, headers=header, params=filters)).json()
+            filters = None # The next link already carries them
+            results.extend(_intern(Version(v, self.parent_project_id)) for v in r["data"])
+            endpoint_url = r.get("links", {}).get("next", {}).get("href", None)
+        return results
+
+    def create_storage(self, token, name):
+        '''Creates a storage location in the OSS where data can be uploaded to.<br>
+        Scope - data:create<br>
+        name - Name of the file the storage is for<br><br>
+
+        Returns the storage id, upload to it with `upload_object` and then 
+        commit it with `create_item` or `Item.create_version`'''
+        checkScopes(token, "data:create")
+        endpoint_url = BASE_URL+"/data/v1/projects/{pId}/storage".format(pId=self.parent_project_id)
+        data = {"jsonapi": {"version": "1.0"},
+                "data": {"type": "objects",
+                         "attributes": {"name": name},
+                         "relationships": {"target": {"data": {"type": "folders", "id": self.id}}}}}
+
+        r = checkResponse(token.transport.post(endpoint_url, headers=_json_api_header(token), data=json.dumps(data))).json()
+        return r["data"]["id"]
+
+    def create_item(self, token, name, storage_id, extension_type="items:autodesk.bim360:File"):
+        '''Creates the first version of a file (item) in this folder.<br>
+        Scope - data:create<br>
+        name - The file name shown in the folder<br>
+        storage_id - A storage the file was already uploaded to, see `create_storage`<br>
+        extension_type - items:autodesk.bim360:File for BIM 360 Docs, 
+        items:autodesk.core:File for A360 and Fusion'''
+        checkScopes(token, "data:create")
+        endpoint_url = BASE_URL+"/data/v1/projects/{pId}/items".format(pId=self.parent_project_id)
+        version_type = extension_type.replace("items:", "versions:", 1)
+        data = {"jsonapi": {"version": "1.0"},
+                "data": {"type": "items",
+                         "attributes": {"displayName": name,
+                                        "extension": {"type": extension_type, "version": "1.0"}},
+                         "relationships": {"tip": {"data": {"type": "versions", "id": "1"}},
+                                           "parent": {"data": {"type": "folders", "id": self.id}}}},
+                "included": [{"type": "versions",
+                              "id": "1",
+                              "attributes": {"name": name,
+                                             "extension": {"type": version_type, "version": "1.0"}},
+                              "relationships": {"storage": {"data": {"type": "objects", "id": storage_id}}}}]}
+
+        r = checkResponse(token.transport.post(endpoint_url, headers=_json_api_header(token), data=json.dumps(data))).json()
+        tips = _included_versions(r, self.parent_project_id)
+        return _intern(Item(r["data"], self.parent_project_id, tips.get(_tip_id(r["data"]), None)))
+
+    def upload(self, token, files, max_workers=4, chunk_size=UPLOAD_CHUNK_SIZE):
+        '''Uploads one or more files to this folder.<br>
+        Scope - data:read data:create data:write<br>
+        files - A path (str or path-like), a file opened in binary mode or a (name, stream) 
+        tuple, for streams without a file name like BytesIO. Or a list of them<br>
+        max_workers - How many files go through the pipeline at the same time<br>
+        chunk_size - Files larger than this are uploaded in chunks, see `upload_object`<br><br>
+
+        Each file goes through storage creation, the OSS upload and the item creation. 
+        If the folder already has an item with the same name a new version is 
+        created instead. Files are streamed from disk and run concurrently, so the 
+        network waits of one file overlap with the others.<br>
+        Returns a list of Item or Version objects, in the same order as files'''
+        checkScopes(token, "data:read data:create data:write")
+        if isinstance(files, (str, bytes, tuple, os.PathLike)) or hasattr(files, "read"):
+            files = [files]
+        for f in files: # Bad inputs fail before anything is sent
+            _upload_source(f)
+
+        existing = {i.displayName: i for i in self.get_contents(token, self.parent_project_id)
+                    if isinstance(i, Item)}
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [executor.submit(self._upload_file, token, f, existing, chunk_size) for f in files]
+            return [f.result() for f in futures]
+
+    def _upload_file(self, token, path_or_stream, existing, chunk_size=UPLOAD_CHUNK_SIZE):
+        '''One file through the upload pipeline, see `upload`'''
+        name, stream, path = _upload_source(path_or_stream)
+
+        storage_id = self.create_storage(token, name)
+        if stream is None:
+            with open(path, "rb") as stream:
+                upload_object(token, storage_id, stream, chunk_size)
+        else:
+            upload_object(token, storage_id, stream, chunk_size)
+
+        if name in existing:
+            return existing[name].create_version(token, name, storage_id)
+        return self.create_item(token, name, storage_id)
+
+def _upload_source(path_or_stream):
+    '''(name, stream, path) of a file given to Folder.upload, stream or path is None'''
+    if isinstance(path_or_stream, tuple):
+        if len(path_or_stream) != 2 or not hasattr(path_or_stream[1], "read"):
+            raise AFWExceptions.AFWError("A tuple is a (name, stream) pair, pass a list for several files")
+        name, stream = path_or_stream
+        return name, stream, None
+    if hasattr(path_or_stream, "read"):
+        name = getattr(path_or_stream, "name", None)
+        if not isinstance(name, (str, bytes, os.PathLike)): # BytesIO, or a file opened from a descriptor
+            raise AFWExceptions.AFWError("The stream has no file name, pass a (name, stream) tuple instead")
+        return os.path.basename(os.fsdecode(name)), path_or_stream, None
+    path = os.fsdecode(os.fspath(path_or_stream))
+    return os.path.basename(path), None, path
+
 class Item(object):
-    def __init__(self, rawDict, parent_project_id):
+    def __init__(self, rawDict, parent_project_id, tip=None):
         self._raw = rawDict
         self._parent_project_id = parent_project_id
+        self._tip = tip
     @property
     def raw(self):
         return self._raw
@@ -274,6 +603,11 @@ class Item(object):
     def parentFolderId(self):
         return self._raw["relationships"]["parent"]["data"].get("id", None)
     @property
+    def tip(self):
+        '''The tip Version when the item came with it (eg from Folder.get_contents), 
+        otherwise None. Use get_tip_versions to request it'''
+        return self._tip
+    @property
     def parent_project_id(self):
         return self._parent_project_id
 
@@ -284,37 +618,62 @@ class Item(object):
         spreadsheets, etc.<br>
         Scope - data:read'''
         checkScopes(token, "data:read")
+        cached = _cached(cls, itemId)
+        if cached is not None:
+            return cached
         endpoint_url = BASE_URL+"/data/v1/projects/{pId}/items/{itemId}".format(pId=projectId, itemId=itemId)
-        r = requests.get(endpoint_url, headers=token.x_user).json()
-        checkResponse(r)
-        return cls(r, projectId)
+        r = checkResponse(token.transport.get(endpoint_url, headers=token.x_user)).json()
+        return _intern(cls(r["data"], projectId))
     
-    def get_versions(self, token):
-        '''Retrieves metadata for a specified item. 
+    def get_versions(self, token, filters=None):
+        '''Returns the versions of this item, all pages.<br>
         Items represent word documents, fusion design files, drawings, spreadsheets, etc.<br>
-        Scope - data:read'''
+        Scope - data:read<br>
+        filters - Options.filter_options()'''
         checkScopes(token, "data:read")
         endpoint_url = BASE_URL+"/data/v1/projects/{pId}/items/{itemId}/versions".format(
             pId=self.parent_project_id, itemId=self.id)
 
-        r = requests.get(endpoint_url, headers=token.x_user).json()
-        checkResponse(r)
-        return [Version(v, self.parent_project_id) for v in r["data"]]
+        versions = []
+        while endpoint_url is not None:
+            r = checkResponse(token.transport.get(endpoint_url, headers=token.x_user, params=filters)).json()
+            filters = None # The next link already carries them
+            versions.extend(_intern(Version(v, self.parent_project_id)) for v in r["data"])
+            endpoint_url = r.get("links", {}).get("next", {}).get("href", None)
+        return versions
 
 
-    def get_tip_versions(self, token):
+    def get_tip_versions(self, token, filters=None):
         '''Returns the “tip” version for the given item.<br>
         Multiple versions of a resource item can be uploaded in a project. 
         The tip version is the most recent one.<br>
-        Scope - data:read'''
-        # TODO Optional filter parameters
+        Scope - data:read<br>
+        filters - Options.filter_options()'''
         checkScopes(token, "data:read")
         endpoint_url = BASE_URL+"/data/v1/projects/{pId}/items/{itemId}/tip".format(
             pId=self.parent_project_id, itemId=self.id)
 
-        r = requests.get(endpoint_url, headers=token.x_user).json()
-        checkResponse(r)
-        return Version(r, self.parent_project_id)
+        r = checkResponse(token.transport.get(endpoint_url, headers=token.x_user, params=filters)).json()
+        return _intern(Version(r["data"], self.parent_project_id))
+
+    def create_version(self, token, name, storage_id, extension_type="versions:autodesk.bim360:File"):
+        '''Creates a new version of this item.<br>
+        Scope - data:create<br>
+        name - The file name of the new version<br>
+        storage_id - A storage the file was already uploaded to, see `Folder.create_storage`<br>
+        extension_type - versions:autodesk.bim360:File for BIM 360 Docs, 
+        versions:autodesk.core:File for A360 and Fusion'''
+        checkScopes(token, "data:create")
+        endpoint_url = BASE_URL+"/data/v1/projects/{pId}/versions".format(pId=self.parent_project_id)
+        data = {"jsonapi": {"version": "1.0"},
+                "data": {"type": "versions",
+                         "attributes": {"name": name,
+                                        "extension": {"type": extension_type, "version": "1.0"}},
+                         "relationships": {"item": {"data": {"type": "items", "id": self.id}},
+                                           "storage": {"data": {"type": "objects", "id": storage_id}}}}}
+
+        r = checkResponse(token.transport.post(endpoint_url, headers=_json_api_header(token), data=json.dumps(data))).json()
+        return _intern(Version(r["data"], self.parent_project_id))
 
 class Version(object):
     def __init__(self, rawDict, parent_project_id):
@@ -358,6 +717,15 @@ class Version(object):
     def mimeType(self):
         return self._raw["attributes"].get("mimeType", None)
     @property
+    def storageSize(self):
+        return self._raw["attributes"].get("storageSize", None)
+    @property
+    def storage_id(self):
+        storage = self._raw.get("relationships", {}).get("storage", None)
+        if storage is None:
+            return None
+        return storage["data"].get("id", None)
+    @property
     def parent_project_id(self):
         return self._parent_project_id
 
@@ -366,27 +734,124 @@ class Version(object):
         '''Returns the version with the given version_id<br>
         Scope - data:read'''
         checkScopes(token, "data:read")
+        cached = _cached(cls, versionId)
+        if cached is not None:
+            return cached
         endpoint_url = BASE_URL+"/data/v1/projects/{pId}/versions/{verId}".format(
             pId=projectId, verId=versionId)
 
-        r = requests.get(endpoint_url, headers=token.x_user).json()
-        checkResponse(r)
-        return cls(r, projectId)
+        r = checkResponse(token.transport.get(endpoint_url, headers=token.x_user)).json()
+        return _intern(cls(r["data"], projectId))
+
+    def download(self, token, path, chunk_size=1024*1024):
+        '''Downloads the file of this version to path.<br>
+        Scope - data:read<br><br>
+
+        The file is streamed to disk in chunks and only renamed to path once complete'''
+        checkScopes(token, "data:read")
+        if self.storage_id is None:
+            raise AFWExceptions.AFWError("This version has no storage to download from")
+
+        part_path = path+".part"
+        with token.transport.get(_oss_object_url(self.storage_id), headers=token.get_header, stream=True) as r:
+            checkResponse(r)
+            with open(part_path, "wb") as f:
+                for chunk in r.iter_content(chunk_size):
+                    f.write(chunk)
+        os.replace(part_path, path)
+        return path
+
+def upload_object(token, storage_id, stream, chunk_size=None, session_id=None, attempts=3):
+    '''Uploads the stream to the OSS object of a storage.<br>
+    Scope - data:write<br>
+    storage_id - From `Folder.create_storage`<br>
+    stream - An open binary file, it is sent as it is read<br>
+    chunk_size - Seekable streams larger than this are sent in chunks of this size through a 
+    resumable upload, None sends any stream in one request<br>
+    session_id - Resumes the resumable upload of this session, the bytes the server already 
+    has are not sent again<br>
+    attempts - Times a chunk is sent before giving up<br><br>
+
+    A chunk that fails is sent again, a chunked upload that still fails raises an 
+    AFWError with the session_id to resume it with. 
+    Emits a datamgt.upload.chunk event (DEBUG) after each chunk.<br>
+    Returns the object details'''
+    checkScopes(token, "data:write")
+    url = _oss_object_url(storage_id)
+    size = _stream_size(stream)
+    if session_id is None and (chunk_size is None or size is None or size <= chunk_size):
+        return checkResponse(token.transport.put(url, headers=token.get_header, data=stream)).json()
+
+    start = stream.tell()
+    if session_id is None:
+        session_id = uuid.uuid4().hex
+        offset = 0
+    else:
+        offset = _uploaded_bytes(token, url, session_id)
+    chunk_size = chunk_size or size
+    r = None
+    while offset < size:
+        stream.seek(start+offset)
+        chunk = stream.read(min(chunk_size, size-offset))
+        headers = dict(token.get_header, **{
+            "Content-Type": "application/octet-stream", "Session-Id": session_id,
+            "Content-Range": "bytes {s}-{e}/{t}".format(s=offset, e=offset+len(chunk)-1, t=size)})
+        for attempt in range(attempts):
+            try:
+                r = checkResponse(token.transport.put(url+"/resumable", headers=headers, data=chunk))
+                break
+            except AFWExceptions.DeadlineExceeded: # A TimeoutError, the deadline is not retried
+                raise
+            except (AFWExceptions.APIError, OSError) as e: # requests' errors are OSErrors
+                if attempt+1 >= attempts or not getattr(e, "retryable", True):
+                    raise AFWExceptions.AFWError(
+                        "Upload to {s} stopped at byte {o} of {t}, resume it with session_id={i}: {e}".format(
+                            s=storage_id, o=offset, t=size, i=session_id, e=e)) from e
+        offset += len(chunk)
+        events.emit("datamgt.upload.chunk", events.DEBUG, storage_id=storage_id, session_id=session_id,
+                    uploaded=offset, total=size)
+    if r is None: # The resumed session had every byte already
+        return object_details(token, storage_id)
+    return r.json()
+
+def _stream_size(stream):
+    '''Bytes left to read in stream, None if it can't seek'''
+    try:
+        start = stream.tell()
+        end = stream.seek(0, os.SEEK_END)
+        stream.seek(start)
+    except (AttributeError, OSError):
+        return None
+    return end - start
+
+def _uploaded_bytes(token, url, session_id):
+    '''Bytes of a resumable upload the server has, from the first one'''
+    r = checkResponse(token.transport.get(url+"/status/"+session_id, headers=token.get_header))
+    ranges = r.headers.get("Range", "").replace("bytes=", "")
+    for received in ranges.split(","):
+        first, _, last = received.strip().partition("-")
+        if first == "0" and last:
+            return int(last)+1
+    return 0
+
+def object_details(token, storage_id):
+    '''Returns the OSS details (size, sha1, content type...) of the object of a storage.<br>
+    Scope - data:read'''
+    checkScopes(token, "data:read")
+    r = checkResponse(token.transport.get(_oss_object_url(storage_id)+"/details", headers=token.get_header)).json()
+    return r
 
 # TODO LEFT
 # Projects
 # GET projects/:project_id/downloads/:download_id
 # GET projects/:project_id/jobs/:job_id
 # POST projects/:project_id/downloads
-# POST projects/:project_id/storage
 
 # Folders
 # GET projects/:project_id/folders/:folder_id/parent
 # GET projects/:project_id/folders/:folder_id/refs
 # GET projects/:project_id/folders/:folder_id/relationships/links
 # GET projects/:project_id/folders/:folder_id/relationships/refs
-# GET projects/:project_id/folders/:folder_id/search
-# POST projects/:project_id/folders
 # POST projects/:project_id/folders/:folder_id/relationships/refs
 # PATCH projects/:project_id/folders/:folder_id
 
@@ -395,7 +860,6 @@ class Version(object):
 # GET projects/:project_id/items/:item_id/refs
 # GET projects/:project_id/items/:item_id/relationships/links
 # GET projects/:project_id/items/:item_id/relationships/refs
-# POST projects/:project_id/items
 # POST projects/:project_id/items/:item_id/relationships/refs
 # PATCH projects/:project_id/items/:item_id
 
@@ -406,7 +870,6 @@ class Version(object):
 # GET projects/:project_id/versions/:version_id/refs
 # GET projects/:project_id/versions/:version_id/relationships/links
 # GET projects/:project_id/versions/:version_id/relationships/refs
-# POST projects/:project_id/versions
 # POST projects/:project_id/versions/:version_id/relationships/refs
 # PATCH projects/:project_id/versions/:version_id
 
@@ -426,12 +889,7 @@ class Version(object):
 # DELETE buckets/:bucketKey
 
 # Objects
-# PUT buckets/:bucketKey/objects/:objectName
-# PUT buckets/:bucketKey/objects/:objectName/resumable
-# GET buckets/:bucketKey/objects/:objectName/status/:sessionId
 # GET buckets/:bucketKey/objects
-# GET buckets/:bucketKey/objects/:objectName/details
-# GET buckets/:bucketKey/objects/:objectName
 # POST buckets/:bucketKey/objects/:objectName/signed
 # PUT signedresources/:id
 # PUT signedresources/:id/resumable
@@ -3,16 +3,50 @@
 # https://forge.autodesk.com/en/docs/design-automation/v3/reference/http/
 # ----------
 '''Module for the Design Automation API'''
-import requests
-
 from . import AFWExceptions
 from . import client
+from . import events
 from .utils import checkScopes
 from .utils import checkResponse
 from . import utils
-from .utils import DA_API
+from .transport import default_transport
 import json
 
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+
+
+def probe_region(regions=None, transport=None, attempts=3, timeout=5):
+    '''Measures the round trip to each Design Automation region and sends the
+    DA requests to the fastest one, call it once at startup.<br>
+    regions - Regions to try, utils.DA_REGIONS by default<br>
+    transport - transport.Transport to probe with, the default one if None<br>
+    attempts - Requests per region, the fastest one counts so the first connection is not measured<br><br>
+
+    The probe is unauthenticated, any HTTP answer counts. Regions that don't answer are skipped.<br>
+    Returns the chosen region, the current one is kept if none answered'''
+    regions = regions or utils.DA_REGIONS
+    transport = transport or default_transport()
+
+    def rtt(region):
+        url = utils.AUTODESK_BASE_URL+"/da/{r}/v3/engines".format(r=region)
+        best = None
+        for _ in range(attempts):
+            start = perf_counter()
+            try:
+                transport.head(url, timeout=timeout)
+            except Exception:
+                continue
+            elapsed = perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        return best
+
+    with ThreadPoolExecutor(max_workers=len(regions)) as pool:
+        timings = [(t, r) for r, t in zip(regions, pool.map(rtt, regions)) if t is not None]
+    if timings:
+        utils.set_da_region(min(timings)[1])
+    return utils.DA_REGION
+
 class Options(object):
     def __init__(self):
         pass
@@ -41,10 +75,9 @@ class ForgeApps(object):
         '''Return the given Forge app’s nickname.<br><br>
 
         If the app has no nickname, this route will return its id.'''
-        endpoint_url = DA_API+"/forgeapps/{id}".format(id=id)
+        endpoint_url = utils.da_api()+"/forgeapps/{id}".format(id=id)
         checkScopes(token, "code:all")
-        r = requests.get(endpoint_url, headers=token.get_header).json()
-        checkResponse(r)
+        r = checkResponse(token.transport.get(endpoint_url, headers=token.get_header)).json()
         return [cls()]
 
     @classmethod
@@ -62,13 +95,13 @@ class ForgeApps(object):
         the nickname.'''
 
         #From docs: id must be “me” for the call to succeed.
-        endpoint_url = DA_API+"/forgeapps/me"
+        endpoint_url = utils.da_api()+"/forgeapps/me"
         checkScopes(token, "code:all")
 
         data = { "nickname":nickname }
         data = json.dumps(data, ensure_ascii=True)
 
-        r = requests.patch(endpoint_url, headers=token.patch_header, data=data)
+        r = token.transport.patch(endpoint_url, headers=token.patch_header, data=data)
         checkResponse(r)
         if r.status_code == 200:
             return True
@@ -84,11 +117,10 @@ class ForgeApps(object):
         to make successful requests.'''
 
         #From docs: id must be “me” for the call to succeed.
-        endpoint_url = DA_API+"/forgeapps/me"
+        endpoint_url = utils.da_api()+"/forgeapps/me"
         checkScopes(token, "code:all")
 
-        r = requests.delete(endpoint_url, headers=token.get_header).json()
-        checkResponse(r)
+        checkResponse(token.transport.delete(endpoint_url, headers=token.get_header))
         return True
 
 class AppBundles(object):
@@ -96,17 +128,17 @@ class AppBundles(object):
         pass
 
     def register_appbundle(self, token, register_appbundle_options):
-        endpoint_url = DA_API+"/appbundles"
+        '''Registers an AppBundle, returns its uploadParameters (endpointURL and formData) to
+        upload the bundle with'''
+        endpoint_url = utils.da_api()+"/appbundles"
         checkScopes(token, "code:all")
 
-        r = requests.post(endpoint_url,
-                          headers=token.patch_header, 
-                          data=register_appbundle_options)
-                          
-        checkResponse(r)
-        print(r["uploadParameters"]["endpointURL"])
-
-        return True
+        r = checkResponse(token.transport.post(endpoint_url,
+                                               headers=token.patch_header,
+                                               data=register_appbundle_options)).json()
+        events.emit("da.appbundle.registered", appbundle_id=r.get("id", None),
+                    upload_url=r["uploadParameters"]["endpointURL"])
+        return r["uploadParameters"]
 
 
 class Engine(object):
@@ -139,19 +171,17 @@ class Engine(object):
     @staticmethod
     def get_engine_health(token, engine):
         '''Gets the health status by Engine or for all Engines (Inventor, AutoCAD ...).'''
-        endpoint_url = DA_API + "/health/{eng}".format(eng=engine)
+        endpoint_url = utils.da_api()+"/health/{eng}".format(eng=engine)
         checkScopes(token, "code:all")
-        r = requests.get(endpoint_url, headers=token.get_header).json()
-        checkResponse(r)
+        r = checkResponse(token.transport.get(endpoint_url, headers=token.get_header)).json()
         return r["Status"]
 
     @staticmethod
     def get_engines(token):
         '''Lists all available Engines.'''
-        endpoint_url = DA_API+"/engines"
+        endpoint_url = utils.da_api()+"/engines"
         checkScopes(token, "code:all")
-        r = requests.get(endpoint_url, headers=token.get_header).json()
-        checkResponse(r)
+        r = checkResponse(token.transport.get(endpoint_url, headers=token.get_header)).json()
         
         return r["data"]
 
@@ -160,11 +190,10 @@ class Engine(object):
         '''Gets the details of the specified Engine. Note that the {id} parameter must be 
         a QualifiedId (owner.name+label).'''
 
-        endpoint_url = DA_API+"/engines/{id}".format(id = id)
+        endpoint_url = utils.da_api()+"/engines/{id}".format(id = id)
         checkScopes(token, "code:all")
 
-        r = requests.get(endpoint_url, headers=token.get_header).json()
-        checkResponse(r)
+        r = checkResponse(token.transport.get(endpoint_url, headers=token.get_header)).json()
         return cls(r)
 
     def health(self, token):
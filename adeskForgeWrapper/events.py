@@ -0,0 +1,81 @@
+'''Events of the wrapper (entities created, upload progress, partial failures...) instead of
+prints. They are logged to the "adeskForgeWrapper" logger, which has no handler unless you
+add one, and passed to the listeners added with `subscribe`:
+
+    logging.getLogger("adeskForgeWrapper").setLevel(logging.INFO)
+    afw.events.subscribe(lambda e: progress_bar.update(e.fields["uploaded"])
+                         if e.name == "recap.upload.batch" else None)
+    afw.events.set_sampling("recap.progress", 0.1) # Keep one in ten
+
+Events nobody listens to cost a level check'''
+
+import logging
+import random
+import threading
+
+from collections import namedtuple
+from time import time
+
+# Levels, the ones of logging
+DEBUG = logging.DEBUG
+INFO = logging.INFO
+WARNING = logging.WARNING
+
+logger = logging.getLogger("adeskForgeWrapper")
+logger.addHandler(logging.NullHandler())
+
+# name - Dotted, "<module>.<entity>.<what happened>"<br>
+# level - A logging level<br>
+# fields - Data of the event, JSON serializable<br>
+# time - Unix time
+Event = namedtuple("Event", ["name", "level", "fields", "time"])
+
+_listeners = []
+_listeners_lock = threading.Lock()
+_sampling = {}
+
+
+class _Message(object):
+    '''Formatted only if a handler writes the record'''
+    __slots__ = ("name", "fields")
+
+    def __init__(self, name, fields):
+        self.name = name
+        self.fields = fields
+
+    def __str__(self):
+        return " ".join([self.name]+["{k}={v!r}".format(k=k, v=v) for k, v in self.fields.items()])
+
+
+def subscribe(listener):
+    '''Calls listener(Event) for every event emitted from now on, whatever the log level.
+    Listeners run in the thread that emitted the event and must be quick'''
+    with _listeners_lock:
+        _listeners.append(listener)
+
+def unsubscribe(listener):
+    with _listeners_lock:
+        if listener in _listeners:
+            _listeners.remove(listener)
+
+def set_sampling(name, rate):
+    '''Emits only this fraction of the events called name, 1 emits all of them, 0 none'''
+    if rate >= 1:
+        _sampling.pop(name, None)
+    else:
+        _sampling[name] = rate
+
+def emit(event, level=logging.INFO, **fields):
+    '''Logs the event called event and passes it to the listeners'''
+    listeners = _listeners
+    if not listeners and not logger.isEnabledFor(level):
+        return
+    rate = _sampling.get(event, None)
+    if rate is not None and random.random() >= rate:
+        return
+    if logger.isEnabledFor(level):
+        logger.log(level, "%s", _Message(event, fields), extra={"event": event, "fields": fields})
+    if listeners:
+        e = Event(event, level, fields, time())
+        for listener in list(listeners):
+            listener(e)
@@ -0,0 +1,211 @@
+'''HTTP/2 for transport.Transport(http2=True): a requests adapter that sends through httpx,
+so many concurrent requests share a few multiplexed connections instead of one socket each.
+Needs httpx with h2, `pip install adeskForgeWrapper[http2]`'''
+
+import os
+import threading
+
+from . import AFWExceptions
+
+# Connection specific headers, HTTP/2 forbids them
+_HOP_HEADERS = ("connection", "keep-alive", "proxy-connection", "transfer-encoding", "upgrade")
+
+_adapter_class = None
+
+
+class _Loop(object):
+    '''An asyncio loop in a daemon thread. httpx's sync HTTP/2 connections are not safe to
+    share between threads, its async ones are driven from this thread only'''
+    def __init__(self):
+        import asyncio
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self.loop.run_forever, name="afw-http2", daemon=True)
+        self._thread.start()
+
+    def run(self, coroutine):
+        '''Runs coroutine in the loop, blocks this thread until it is done'''
+        import asyncio
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    def close(self):
+        '''Stops the loop and its thread'''
+        if self.loop.is_closed():
+            return
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+        self.loop.close()
+
+
+class _Body(object):
+    '''The raw body of a streamed response, read like urllib3's so iter_content works'''
+    def __init__(self, loop, response):
+        self._loop = loop
+        self._response = response
+        self._chunks = response.aiter_bytes()
+        self._buffer = b""
+
+    async def _next(self):
+        try:
+            return await self._chunks.__anext__()
+        except StopAsyncIteration:
+            return None
+
+    def read(self, amt=None, decode_content=None):
+        while amt is None or len(self._buffer) < amt:
+            chunk = self._loop.run(self._next())
+            if chunk is None:
+                break
+            self._buffer += chunk
+        if amt is None:
+            data, self._buffer = self._buffer, b""
+        else:
+            data, self._buffer = self._buffer[:amt], self._buffer[amt:]
+        return data
+
+    def stream(self, amt=65536, decode_content=None):
+        while True:
+            data = self.read(amt)
+            if not data:
+                break
+            yield data
+
+    def close(self):
+        self._loop.run(self._response.aclose())
+
+    def release_conn(self):
+        self.close()
+
+
+def _ssl_context(verify, cert):
+    '''What httpx takes as verify for requests' verify (bool or CA bundle path) and cert
+    (client certificate path or (certificate, key) paths)'''
+    if cert is None and isinstance(verify, bool):
+        return verify
+    import ssl
+    if verify is False:
+        context = ssl.create_default_context()
+        context.check_hostname = False
+        context.verify_mode = ssl.CERT_NONE
+    elif isinstance(verify, str):
+        if os.path.isdir(verify):
+            context = ssl.create_default_context(capath=verify)
+        else:
+            context = ssl.create_default_context(cafile=verify)
+    else:
+        context = ssl.create_default_context()
+    if cert is not None:
+        if isinstance(cert, str):
+            context.load_cert_chain(cert)
+        else:
+            context.load_cert_chain(*cert)
+    return context
+
+async def _file_chunks(body):
+    # Files and MultipartEncoders, read in the loop thread a chunk at a time
+    while True:
+        chunk = body.read(65536)
+        if not chunk:
+            break
+        yield chunk.encode("utf-8") if isinstance(chunk, str) else chunk
+
+
+def http2_adapter_class():
+    '''A requests adapter that sends through httpx over HTTP/2. Built on first use so
+    importing this module doesn't import requests nor httpx'''
+    global _adapter_class
+    if _adapter_class is not None:
+        return _adapter_class
+
+    try:
+        import httpx
+        import h2 # noqa: F401, httpx only speaks HTTP/2 with it
+    except ImportError:
+        raise AFWExceptions.AFWError("HTTP/2 needs httpx with h2: pip install adeskForgeWrapper[http2]")
+    from requests import exceptions
+    from requests.adapters import BaseAdapter
+    from requests.models import Response
+    from requests.structures import CaseInsensitiveDict
+    from requests.utils import get_encoding_from_headers
+    from requests.utils import select_proxy
+
+    def httpx_timeout(timeout):
+        if isinstance(timeout, tuple):
+            connect, read = timeout
+            return httpx.Timeout(read, connect=connect)
+        return httpx.Timeout(timeout)
+
+    class HTTP2Adapter(BaseAdapter):
+        '''https urls negotiate HTTP/2 (ALPN) and fall back to HTTP/1.1. Plain http urls, a
+        local gateway or the mock server, speak HTTP/2 with prior knowledge. verify, cert and
+        proxies are the ones of requests, a client is kept for each combination used'''
+        def __init__(self, pool_size=10):
+            super().__init__()
+            self._loop = _Loop()
+            # Connections are only opened once the ones open carry as many requests as the
+            # server allows at once (usually 100), pool_size is rarely reached
+            self._limits = httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size)
+            self._clients = {}
+            self._clients_lock = threading.Lock()
+
+        def _client(self, scheme, verify, cert, proxy):
+            key = (scheme, verify, cert if not isinstance(cert, list) else tuple(cert), proxy)
+            client = self._clients.get(key, None)
+            if client is None:
+                with self._clients_lock:
+                    client = self._clients.get(key, None)
+                    if client is None:
+                        async def new_client():
+                            return httpx.AsyncClient(http1=scheme == "https", http2=True, limits=self._limits,
+                                                     timeout=None, verify=_ssl_context(verify, cert), proxy=proxy)
+                        client = self._clients[key] = self._loop.run(new_client())
+            return client
+
+        async def _send(self, client, request, headers, timeout, stream):
+            body = request.body
+            if hasattr(body, "read"):
+                body = _file_chunks(body)
+            r = await client.send(client.build_request(request.method, request.url, headers=headers,
+                                                       content=body, timeout=httpx_timeout(timeout)),
+                                  stream=True)
+            if not stream:
+                await r.aread()
+            return r
+
+        def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+            scheme = "http" if request.url.startswith("http:") else "https"
+            client = self._client(scheme, verify, cert, select_proxy(request.url, proxies))
+            headers = {k: v for k, v in request.headers.items() if k.lower() not in _HOP_HEADERS}
+            try:
+                r = self._loop.run(self._send(client, request, headers, timeout, stream))
+            except httpx.ConnectTimeout as e:
+                raise exceptions.ConnectTimeout(e, request=request)
+            except httpx.TimeoutException as e:
+                raise exceptions.ReadTimeout(e, request=request)
+            except httpx.TransportError as e:
+                raise exceptions.ConnectionError(e, request=request)
+
+            response = Response()
+            response.status_code = r.status_code
+            response.reason = r.reason_phrase
+            response.headers = CaseInsensitiveDict(r.headers.items())
+            response.headers.pop("Content-Encoding", None) # httpx decodes the body
+            response.encoding = get_encoding_from_headers(response.headers)
+            response.url = request.url
+            response.request = request
+            response.connection = self
+            response.raw = _Body(self._loop, r)
+            if not stream:
+                response._content = r.content
+            return response
+
+        def close(self):
+            with self._clients_lock:
+                clients, self._clients = list(self._clients.values()), {}
+            if self._loop.loop.is_closed():
+                return
+            for client in clients:
+                self._loop.run(client.aclose())
+            self._loop.close()
+
+    _adapter_class = HTTP2Adapter
+    return _adapter_class
@@ -0,0 +1,242 @@
+'''Per operation request metrics. Give a transport.Transport a sink and every request
+it sends is recorded under the wrapper call that made it, eg "datamgt.Folder.get_contents".
+Calls that got the answer of an identical request already in flight (coalesced) sent
+nothing and are not recorded'''
+
+import sys
+import socket
+import threading
+
+from collections import namedtuple
+
+# Upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, float("inf"))
+
+Sample = namedtuple("Sample", ["operation", "method", "status", "seconds", "request_bytes",
+                               "response_bytes", "retries", "throttle_wait"])
+Sample.__doc__ = '''One request. status is None if it failed without a response,
+throttle_wait is the seconds spent waiting before retries'''
+
+# Sinks that get the requests of every transport, see add_global_sink
+global_sinks = []
+
+_PACKAGE = __name__.rsplit(".", 1)[0]
+# Modules requests go through, never the operation
+_INTERNAL = tuple(_PACKAGE+"."+m for m in ("transport", "cache", "metrics", "tracing", "profiling"))
+# Code objects to qualified names, for pythons without co_qualname
+_qualnames = {}
+
+
+def current_operation(depth=1):
+    '''Name of the wrapper call the current request comes from (module.qualname), the
+    first frame outside the transport that belongs to the package. "other" for requests
+    made from outside the package'''
+    f = sys._getframe(depth)
+    while f is not None:
+        module = f.f_globals.get("__name__", "")
+        if module.startswith(_PACKAGE+".") and not module.startswith(_INTERNAL):
+            code = f.f_code
+            name = getattr(code, "co_qualname", None) or _qualname(code, f.f_globals)
+            name = name.split(".<locals>", 1)[0]
+            return module[len(_PACKAGE)+1:]+"."+name
+        f = f.f_back
+    return "other"
+
+def _qualname(code, module_globals):
+    '''co_qualname before python 3.11, found among the methods of the classes of the module'''
+    name = _qualnames.get(code, None)
+    if name is None:
+        name = code.co_name
+        for value in list(module_globals.values()):
+            if not isinstance(value, type):
+                continue
+            attr = value.__dict__.get(code.co_name, None)
+            func = getattr(attr, "fget", None) or getattr(attr, "__func__", attr) # property, static/classmethod
+            while getattr(func, "__code__", None) is not code and hasattr(func, "__wrapped__"): # decorators
+                func = func.__wrapped__
+            if getattr(func, "__code__", None) is code:
+                name = func.__qualname__
+                break
+        _qualnames[code] = name
+    return name
+
+def add_global_sink(sink):
+    '''Records the requests of every transport in sink, on top of their own metrics'''
+    global_sinks.append(sink)
+
+def remove_global_sink(sink):
+    if sink in global_sinks:
+        global_sinks.remove(sink)
+
+def request_size(r):
+    '''Bytes of the body sent with the request of response r'''
+    request = getattr(r, "request", None)
+    if request is None:
+        return 0
+    length = request.headers.get("Content-Length", None)
+    if length is not None:
+        return int(length)
+    body = request.body
+    return len(body) if isinstance(body, (bytes, str)) else 0
+
+def response_size(r, stream=False):
+    '''Bytes of the response body, for streamed responses the Content-Length'''
+    if stream:
+        return int(r.headers.get("Content-Length", 0))
+    return len(r.content)
+
+
+class _Stats(object):
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.statuses = {}
+        self.buckets = [0]*len(LATENCY_BUCKETS)
+        self.seconds = 0.0
+        self.request_bytes = 0
+        self.response_bytes = 0
+        self.retries = 0
+        self.throttle_wait = 0.0
+
+    def add(self, sample):
+        self.calls += 1
+        if sample.status is None or sample.status >= 400:
+            self.errors += 1
+        status = str(sample.status) if sample.status is not None else "error"
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if sample.seconds <= bound:
+                self.buckets[i] += 1
+                break
+        self.seconds += sample.seconds
+        self.request_bytes += sample.request_bytes
+        self.response_bytes += sample.response_bytes
+        self.retries += sample.retries
+        self.throttle_wait += sample.throttle_wait
+
+    def as_dict(self):
+        return {"calls": self.calls,
+                "errors": self.errors,
+                "statuses": dict(self.statuses),
+                "latency_buckets": dict(zip(LATENCY_BUCKETS, self.buckets)),
+                "seconds": self.seconds,
+                "request_bytes": self.request_bytes,
+                "response_bytes": self.response_bytes,
+                "retries": self.retries,
+                "throttle_wait": self.throttle_wait}
+
+
+class InMemorySink(object):
+    '''Aggregates the requests per operation in memory'''
+    def __init__(self):
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def record(self, sample):
+        with self._lock:
+            stats = self._stats.get(sample.operation, None)
+            if stats is None:
+                stats = self._stats[sample.operation] = _Stats()
+            stats.add(sample)
+
+    def snapshot(self):
+        '''{operation: {calls, errors, statuses, latency_buckets, seconds, request_bytes,
+        response_bytes, retries, throttle_wait}}'''
+        with self._lock:
+            return {op: stats.as_dict() for op, stats in self._stats.items()}
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+
+    def report(self):
+        '''A table of the operations, the ones that took longest first'''
+        return report(self.snapshot())
+
+
+def report(snapshot):
+    '''A table of the operations of an InMemorySink.snapshot(), the ones that took longest first'''
+    rows = sorted(snapshot.items(), key=lambda i: i[1]["seconds"], reverse=True)
+    lines = ["{:<50} {:>7} {:>6} {:>10} {:>10} {:>12} {:>12} {:>7}".format(
+        "operation", "calls", "errors", "total s", "mean ms", "sent B", "received B", "retries")]
+    for op, s in rows:
+        lines.append("{:<50} {:>7} {:>6} {:>10.3f} {:>10.1f} {:>12} {:>12} {:>7}".format(
+            op, s["calls"], s["errors"], s["seconds"], 1000*s["seconds"]/s["calls"],
+            s["request_bytes"], s["response_bytes"], s["retries"]))
+    return "\n".join(lines)
+
+
+def _label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+class PrometheusSink(InMemorySink):
+    '''Aggregates in memory like InMemorySink, `render()` returns the Prometheus text
+    exposition format to serve from your metrics endpoint<br>
+    prefix - Prefix of the metric names'''
+    def __init__(self, prefix="afw"):
+        super().__init__()
+        self.prefix = prefix
+
+    def render(self):
+        p = self.prefix
+        out = []
+        def metric(name, kind, help_text):
+            out.append("# HELP {p}_{n} {h}".format(p=p, n=name, h=help_text))
+            out.append("# TYPE {p}_{n} {k}".format(p=p, n=name, k=kind))
+
+        snapshot = sorted(self.snapshot().items())
+        metric("requests_total", "counter", "Requests sent by operation and status")
+        for op, s in snapshot:
+            for status, n in sorted(s["statuses"].items()):
+                out.append('{p}_requests_total{{operation="{o}",status="{s}"}} {n}'.format(
+                    p=p, o=_label(op), s=status, n=n))
+
+        metric("request_duration_seconds", "histogram", "Request latency by operation")
+        for op, s in snapshot:
+            cumulative = 0
+            for bound, n in s["latency_buckets"].items():
+                cumulative += n
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                out.append('{p}_request_duration_seconds_bucket{{operation="{o}",le="{le}"}} {n}'.format(
+                    p=p, o=_label(op), le=le, n=cumulative))
+            out.append('{p}_request_duration_seconds_sum{{operation="{o}"}} {v}'.format(p=p, o=_label(op), v=s["seconds"]))
+            out.append('{p}_request_duration_seconds_count{{operation="{o}"}} {v}'.format(p=p, o=_label(op), v=s["calls"]))
+
+        for name, key, kind, help_text in (("request_bytes_total", "request_bytes", "counter", "Request body bytes sent"),
+                                           ("response_bytes_total", "response_bytes", "counter", "Response body bytes received"),
+                                           ("retries_total", "retries", "counter", "Requests sent again after a 429 or 503"),
+                                           ("throttle_wait_seconds_total", "throttle_wait", "counter", "Seconds waited before retries")):
+            metric(name, kind, help_text)
+            for op, s in snapshot:
+                out.append('{p}_{n}{{operation="{o}"}} {v}'.format(p=p, n=name, o=_label(op), v=s[key]))
+        return "\n".join(out)+"\n"
+
+
+class StatsDSink(object):
+    '''Sends every request to a StatsD (or DogStatsD, Telegraf...) server over UDP.
+    Sending never blocks nor raises, lost packets are lost metrics<br>
+    prefix - Prefix of the metric names, eg afw.datamgt.Folder.get_contents.latency'''
+    def __init__(self, host="127.0.0.1", port=8125, prefix="afw"):
+        self.address = (host, port)
+        self.prefix = prefix
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._socket.setblocking(False)
+
+    def record(self, sample):
+        name = "{p}.{o}".format(p=self.prefix, o=sample.operation)
+        status = sample.status if sample.status is not None else "error"
+        lines = ["{n}.calls:1|c".format(n=name),
+                 "{n}.status.{s}:1|c".format(n=name, s=status),
+                 "{n}.latency:{v:.3f}|ms".format(n=name, v=sample.seconds*1000),
+                 "{n}.request_bytes:{v}|c".format(n=name, v=sample.request_bytes),
+                 "{n}.response_bytes:{v}|c".format(n=name, v=sample.response_bytes)]
+        if sample.retries:
+            lines.append("{n}.retries:{v}|c".format(n=name, v=sample.retries))
+            lines.append("{n}.throttle_wait:{v:.3f}|ms".format(n=name, v=sample.throttle_wait*1000))
+        try:
+            self._socket.sendto("\n".join(lines).encode("utf-8"), self.address)
+        except OSError:
+            pass
+
+    def close(self):
+        self._socket.close()
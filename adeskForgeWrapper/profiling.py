@@ -0,0 +1,154 @@
+'''Profile a chain of wrapper calls: CPU (cProfile), memory (tracemalloc), the HTTP requests
+sent and wall clock stack samples of every thread involved, ready for flamegraphs'''
+
+import io
+import sys
+import pstats
+import cProfile
+import threading
+import functools
+import tracemalloc
+
+from time import perf_counter
+
+from . import metrics
+
+
+def _frame_name(frame):
+    code = frame.f_code
+    return "{m}:{f}".format(m=frame.f_globals.get("__name__", "?"), f=getattr(code, "co_qualname", code.co_name))
+
+
+class Profile(object):
+    '''Context manager and decorator, see `profile`'''
+    def __init__(self, collapsed_path=None, report_path=None, interval=0.005, memory=True, top=25):
+        self.collapsed_path = collapsed_path
+        self.report_path = report_path
+        self.interval = interval
+        self.memory = memory
+        self.top = top
+
+        self.seconds = None
+        self.stats = None
+        self.snapshot = None
+        self.peak_memory = None
+        self.http = None
+        self.samples = {}
+
+    def __enter__(self):
+        self.samples = {}
+        self._sink = metrics.InMemorySink()
+        self._thread = threading.get_ident()
+        self._existing_threads = set(sys._current_frames()) - {self._thread}
+
+        self._started_tracemalloc = self.memory and not tracemalloc.is_tracing()
+        if self._started_tracemalloc:
+            tracemalloc.start()
+        if self.memory and hasattr(tracemalloc, "reset_peak"): # Python 3.9+
+            tracemalloc.reset_peak()
+        metrics.add_global_sink(self._sink)
+
+        self._stop = threading.Event()
+        self._sampler = threading.Thread(target=self._sample, name="afw-profiler", daemon=True)
+        self._sampler.start()
+        self._profiler = cProfile.Profile()
+        self._start = perf_counter()
+        self._profiler.enable()
+        return self
+
+    def __exit__(self, *exc):
+        self._profiler.disable()
+        self.seconds = perf_counter() - self._start
+        self._stop.set()
+        self._sampler.join()
+        metrics.remove_global_sink(self._sink)
+
+        self.stats = pstats.Stats(self._profiler)
+        self.http = self._sink.snapshot()
+        if self.memory:
+            self.snapshot = tracemalloc.take_snapshot()
+            self.peak_memory = tracemalloc.get_traced_memory()[1]
+            if self._started_tracemalloc:
+                tracemalloc.stop()
+
+        if self.collapsed_path is not None:
+            self.write_collapsed(self.collapsed_path)
+        if self.report_path is not None:
+            with open(self.report_path, "w") as f:
+                f.write(self.report())
+        return False
+
+    def __call__(self, func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with self:
+                return func(*args, **kwargs)
+        return wrapper
+
+    def _sample(self):
+        sampler = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for thread, frame in sys._current_frames().items():
+                # The profiled thread and the ones it started (eg the pools of a crawl)
+                if thread == sampler or thread in self._existing_threads:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_name(frame))
+                    frame = frame.f_back
+                key = ";".join(reversed(stack))
+                self.samples[key] = self.samples.get(key, 0) + 1
+
+    def write_collapsed(self, path):
+        '''Writes the stack samples in the collapsed format of flamegraph.pl, speedscope...'''
+        with open(path, "w") as f:
+            for stack, count in sorted(self.samples.items()):
+                f.write("{s} {c}\n".format(s=stack, c=count))
+
+    def http_totals(self):
+        '''{calls, request_bytes, response_bytes, seconds} of every request sent'''
+        totals = {"calls": 0, "request_bytes": 0, "response_bytes": 0, "seconds": 0.0}
+        for op in (self.http or {}).values():
+            for key in totals:
+                totals[key] += op[key]
+        return totals
+
+    def report(self):
+        '''Wall time, HTTP requests per operation, the top functions by cumulative time and
+        the lines that allocated the most memory'''
+        out = io.StringIO()
+        totals = self.http_totals()
+        out.write("Wall time {s:.3f} s\n\n".format(s=self.seconds))
+        out.write("HTTP: {c} requests, {t:.3f} s, {sent} bytes sent, {received} bytes received\n".format(
+            c=totals["calls"], t=totals["seconds"], sent=totals["request_bytes"], received=totals["response_bytes"]))
+        if self.http:
+            out.write(metrics.report(self.http)+"\n")
+
+        out.write("\nCPU, calling thread, top {n} by cumulative time\n".format(n=self.top))
+        pstats.Stats(self._profiler, stream=out).sort_stats("cumulative").print_stats(self.top)
+
+        if self.snapshot is not None:
+            out.write("Memory, peak {p:.1f} KiB, top {n} allocating lines still alive\n".format(
+                p=self.peak_memory/1024, n=self.top))
+            snapshot = self.snapshot.filter_traces([tracemalloc.Filter(False, tracemalloc.__file__)])
+            for stat in snapshot.statistics("lineno")[:self.top]:
+                out.write("{s}\n".format(s=stat))
+        return out.getvalue()
+
+
+def profile(collapsed_path=None, report_path=None, interval=0.005, memory=True, top=25):
+    '''Profiles the wrapper calls made inside it, as a context manager or a decorator:<br>
+
+        with profile("crawl.folded") as p:
+            project.top_folders(token)
+        print(p.report())
+
+    collapsed_path - Writes the stack samples here, `flamegraph.pl crawl.folded > crawl.svg`<br>
+    report_path - Writes the report here<br>
+    interval - Seconds between stack samples of the calling thread and the threads it starts<br>
+    memory - Trace allocations with tracemalloc, it slows Python down noticeably<br>
+    top - Rows of the CPU and memory tables<br><br>
+
+    cProfile only sees the calling thread, work done in pools shows up in the stack samples
+    and the HTTP counts. As a decorator the results are those of the last call'''
+    return Profile(collapsed_path, report_path, interval, memory, top)
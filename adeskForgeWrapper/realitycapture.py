@@ -8,13 +8,10 @@ from .utils import checkResponse
 from .utils import RECAP_API
 from .utils import batch
 from . import client
+from . import events
 from . import AFWExceptions
 import json
 
-from requests_toolbelt import MultipartEncoder
-from webbrowser import open as web_open
-import requests
-
 class Options(object):
     '''Class used to organize request options for this module'''
     @staticmethod
@@ -110,9 +107,9 @@ class Photoscene(object):
         psOptions - Options.PhotosceneCreationOptions'''
         checkScopes(token, "data:write")
         endpoint_url = RECAP_API+"/photoscene"
-        r = requests.post(endpoint_url, headers=token.url_encoded, data=create_scene_options).json()
+        r = checkResponse(token.transport.post(endpoint_url, headers=token.url_encoded, data=create_scene_options)).json()
         checkResponse(r)
-        print("Photoscene ID:", '{}'.format(r['Photoscene'].get("photosceneid")))
+        events.emit("recap.photoscene.created", photoscene_id=r["Photoscene"].get("photosceneid", None))
         return cls(r)
     
     def upload_files(self, token: client.Token, files: list, batchSize=3):
@@ -122,12 +119,15 @@ class Photoscene(object):
         batchSize - Number of files per request must be limited to avoid timeouts<br>
         Recommended batch size 3 (default)<br><br>
 
+        Emits a recap.upload.batch event (DEBUG) after each batch with the files uploaded so far.<br>
+
         Files can be added to photoscene either by uploading them directly or by providing public HTTP/HTTPS links.
         Although uploading multiple files at the same time might be more efficient, you should limit the number 
         of files per request depending on your available bandwidth to avoid timeouts.<br>
         Note: Uploaded files will be deleted after 30 days.'''
         checkScopes(token, "data:write")
         filesUploaded=[]
+        uploaded = 0
 
         for x in batch(files, batchSize):
             n=-1
@@ -137,18 +137,21 @@ class Photoscene(object):
                 a = a.replace("/", "\\")
                 fields["file[{x}]".format(x=n)] = (a, open(a,'rb'), 'image/jpg')
 
+            from requests_toolbelt import MultipartEncoder # Slow to import, only needed here
             payload = MultipartEncoder(fields)
             headers = {'Content-Type': payload.content_type, 'Authorization': 'Bearer {}'.format(token.access_token)}
 
             endpoint_url = RECAP_API+"/file"
-            r = requests.post(endpoint_url, headers=headers, data=payload).json()
+            r = checkResponse(token.transport.post(endpoint_url, headers=headers, data=payload)).json()
             if "Error" in r:
                 checkResponse(r["Error"])
             else:
-                print(len(x), "uploaded")
+                uploaded += len(x)
+                events.emit("recap.upload.batch", events.DEBUG, photoscene_id=self.id, batch=len(x),
+                            uploaded=uploaded, total=len(files))
                 for raw in r["Files"]["file"]:
                     filesUploaded.append(File(raw, self.id))
-        print("Success")
+        events.emit("recap.upload.done", photoscene_id=self.id, files=len(filesUploaded))
         return filesUploaded
         
 
@@ -162,26 +165,27 @@ class Photoscene(object):
         Returns True if request was successful'''
         checkScopes(token, "data:write")
         endpoint_url = RECAP_API+"/photoscene/{phId}".format(phId = self.id)
-        r = requests.post(endpoint_url, headers=token.url_encoded).json()
+        r = checkResponse(token.transport.post(endpoint_url, headers=token.url_encoded)).json()
         checkResponse(r)
         if "Error" in r:
             checkResponse(r["Error"])
         else:
-            print("Processing started")
+            events.emit("recap.processing.started", photoscene_id=self.id)
             return True
 
     def get_progress(self, token: client.Token):
-        '''Returns the processing progress and status of a photoscene.<br>
+        '''Returns the processing progress and status of a photoscene, {"progress", "progressmsg"...}.<br>
         Scope - data:read'''
         checkScopes(token, "data:read")
         endpoint_url = RECAP_API+"/photoscene/{phId}/progress".format(phId = self.id)
-        r = requests.get(endpoint_url, headers=token.get_header).json()
+        r = checkResponse(token.transport.get(endpoint_url, headers=token.get_header)).json()
         checkResponse(r)
         if "Error" in r:
             checkResponse(r["Error"])
         else:
-            print("{}%".format(r["Photoscene"]["progress"]))
-            print(r["Photoscene"]["progressmsg"])
+            events.emit("recap.progress", events.DEBUG, photoscene_id=self.id,
+                        progress=r["Photoscene"]["progress"], message=r["Photoscene"]["progressmsg"])
+            return r["Photoscene"]
 
     def delete_scene(self, token: client.Token):
         '''Deletes a photoscene and its associated assets (images, output files, ...).<br>
@@ -190,11 +194,12 @@ class Photoscene(object):
         Returns True if deletion was successful'''
         checkScopes(token, "data:write")
         endpoint_url = RECAP_API+"/photoscene/{phId}".format(phId = self.id)
-        r = requests.delete(endpoint_url,headers=token.url_encoded).json()
+        r = checkResponse(token.transport.delete(endpoint_url,headers=token.url_encoded)).json()
         if "Error" in r:
             checkResponse(r["Error"])
         elif r["msg"] == "No error":
-            print("Photoscene successfully deleted")
+            events.emit("recap.photoscene.deleted", photoscene_id=self.id)
+            return True
 
     @staticmethod
     def delete_scene_by_id(token: client.Token, Id: str):
@@ -204,11 +209,11 @@ class Photoscene(object):
         Returns True if deletion was successful'''
         checkScopes(token, "data:write")
         endpoint_url = RECAP_API+"/photoscene/{phId}".format(phId = Id)
-        r = requests.delete(endpoint_url,headers=token.url_encoded).json()
+        r = checkResponse(token.transport.delete(endpoint_url,headers=token.url_encoded)).json()
         if "Error" in r:
             checkResponse(r["Error"])
         elif r["msg"] == "No error":
-            print("Photoscene successfully deleted")
+            events.emit("recap.photoscene.deleted", photoscene_id=Id)
             return True
 
     def get_download_url(self, token: client.Token, Format, autoraise=False):
@@ -218,10 +223,13 @@ class Photoscene(object):
         checkScopes(token, "data:read")
         params = {"format":Format}
         endpoint_url = RECAP_API+"/photoscene/{phId}".format(phId = self.id)
-        r = requests.get(endpoint_url,headers=token.get_header, params=params).json()
+        r = checkResponse(token.transport.get(endpoint_url,headers=token.get_header, params=params)).json()
+        if "Error" in r:
+            checkResponse(r["Error"])
         if autoraise:
-            web_open(r["Photoscene"]["scenelink"], new = 0, autoraise=autoraise)
-        print(r["Photoscene"]["scenelink"])
+            import webbrowser
+            webbrowser.open(r["Photoscene"]["scenelink"], new = 0, autoraise=autoraise)
+        return r["Photoscene"]["scenelink"]
 
     def cancel_progress(self, token: client.Token):
         '''Aborts the processing of a photoscene and marks it as cancelled.<br>
@@ -230,11 +238,11 @@ class Photoscene(object):
         Returns True if cancel was successful'''
         checkScopes(token, "data:write")
         endpoint_url = RECAP_API+"/photoscene/{phId}/cancel".format(phId = self.id)
-        r = requests.post(endpoint_url, headers=token.url_encoded).json()
+        r = checkResponse(token.transport.post(endpoint_url, headers=token.url_encoded)).json()
         if "Error" in r:
             checkResponse(r["Error"])
         elif r["msg"] == "No error":
-            print("Cancel successful")
+            events.emit("recap.processing.cancelled", photoscene_id=self.id)
             return True
 
 
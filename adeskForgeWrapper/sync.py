@@ -0,0 +1,193 @@
+'''Keep local directories and Data Management folders in sync'''
+
+import os
+import json
+import hashlib
+
+from concurrent.futures import ThreadPoolExecutor
+
+from .utils import checkScopes
+from . import datamgt
+from . import events
+
+
+def _sha1(path, chunk_size=1024*1024):
+    '''sha1 of a local file, read in chunks'''
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+def _safe_name(name):
+    '''True if a name from the server can be used as a single local path component'''
+    return (bool(name) and name not in (".", "..") and not any(c in name for c in ("/", "\\", "\0"))
+            and not os.path.splitdrive(name)[0])
+
+def _inside(root, path):
+    '''True if path resolves to somewhere under root, symlinks followed'''
+    root = os.path.realpath(root)
+    return os.path.commonpath([root, os.path.realpath(path)]) == root
+
+def _unsafe(kind, entity, name):
+    events.emit("sync.unsafe_name", events.WARNING, kind=kind, id=entity.id, name=name)
+
+def _is_same_file(token, path, item, checksum):
+    '''True if the tip version of item has the same size (and sha1 if checksum)
+    as the local file'''
+    tip = item.tip or item.get_tip_versions(token)
+    if tip.storageSize is None or tip.storageSize != os.path.getsize(path):
+        return False
+    if checksum:
+        if tip.storage_id is None:
+            return False
+        return datamgt.object_details(token, tip.storage_id).get("sha1", None) == _sha1(path)
+    return True
+
+def _split_contents(token, folder, filters=None):
+    '''Returns the subfolders and items of folder by name'''
+    folders, items = {}, {}
+    for c in folder.get_contents(token, folder.parent_project_id, filters):
+        if isinstance(c, datamgt.Folder):
+            folders[c.name] = c
+        elif isinstance(c, datamgt.Item):
+            items[c.displayName] = c
+    return folders, items
+
+def sync_up(token, folder, local_dir, max_workers=8, checksum=False):
+    '''Copies a local directory tree into a Data Management folder.<br>
+    Scope - data:read data:create data:write<br>
+    folder - The datamgt.Folder that mirrors local_dir<br>
+    local_dir - Path to the local directory<br>
+    max_workers - Requests in flight at the same time<br>
+    checksum - Also compare sha1 before skipping a file, by default only the size is compared<br><br>
+
+    Folders are created level by level, all the missing folders of a level at once.
+    Files are uploaded concurrently while the next level is created. Files whose
+    size (and sha1) match the tip version in the remote folder are skipped. Symlinked
+    directories are followed once, a link back to a directory already synced (a loop)
+    is skipped with a sync.link_skipped event (WARNING).<br>
+    Returns a list with the new Item and Version objects'''
+    checkScopes(token, "data:read data:create data:write")
+    uploads = []
+    level = [(local_dir, folder, None)] # path, remote folder, its contents if known
+    visited = {os.path.realpath(local_dir)} # Directories reached twice through symlinks are skipped
+
+    with ThreadPoolExecutor(max_workers=max_workers) as folder_pool, \
+         ThreadPoolExecutor(max_workers=max_workers) as upload_pool:
+
+        while level:
+            contents = list(folder_pool.map(
+                lambda job: job[2] if job[2] is not None else _split_contents(token, job[1]), level))
+
+            to_create = []
+            next_level = []
+            to_compare = []
+            for (path, remote, _), (remote_folders, remote_items) in zip(level, contents):
+                for entry in sorted(os.scandir(path), key=lambda e: e.name):
+                    if entry.is_dir():
+                        real = os.path.realpath(entry.path)
+                        if real in visited:
+                            events.emit("sync.link_skipped", events.WARNING, path=entry.path, target=real)
+                            continue
+                        visited.add(real)
+                        if entry.name in remote_folders:
+                            next_level.append((entry.path, remote_folders[entry.name], None))
+                        else:
+                            to_create.append((entry.path, remote, entry.name))
+                    elif entry.is_file():
+                        to_compare.append((entry.path, remote, remote_items, remote_items.get(entry.name, None)))
+
+            # Comparing tip versions is one request per existing file, do it in parallel too
+            same = folder_pool.map(
+                lambda job: job[3] is not None and _is_same_file(token, job[0], job[3], checksum),
+                to_compare)
+            for (path, remote, remote_items, item), skip in zip(to_compare, list(same)):
+                if not skip:
+                    uploads.append(upload_pool.submit(remote._upload_file, token, path, remote_items))
+
+            created = folder_pool.map(lambda job: job[1].create_folder(token, job[2]), to_create)
+            # New folders are empty, no need to list them
+            next_level.extend((job[0], new, ({}, {})) for job, new in zip(to_create, created))
+            level = next_level
+
+        return [u.result() for u in uploads]
+
+
+def walk(token, folder, max_workers=8, filters=None):
+    '''Crawls a Data Management folder tree, listing every folder of a level at once.<br>
+    Scope - data:read<br>
+    filters - datamgt.Options.filter_options(), applied to every listing. The crawl only 
+    descends into folders that pass them, so keep folders in type and extension_type filters<br><br>
+
+    Yields (relative_path, folder, subfolders, items) for each folder, 
+    relative_path is "" for folder itself. Folders whose name can't be a local directory 
+    name (empty, "..", with a path separator) are not descended into, a sync.unsafe_name 
+    event (WARNING) is emitted for each'''
+    checkScopes(token, "data:read")
+    level = [("", folder)]
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        while level:
+            contents = pool.map(lambda pair: _split_contents(token, pair[1], filters), level)
+            next_level = []
+            for (path, remote), (remote_folders, remote_items) in zip(level, contents):
+                yield path, remote, list(remote_folders.values()), list(remote_items.values())
+                for name, f in remote_folders.items():
+                    if _safe_name(name):
+                        next_level.append((os.path.join(path, name), f))
+                    else:
+                        _unsafe("folder", f, name)
+            level = next_level
+
+def mirror_down(token, folder, local_dir, max_workers=8, manifest_name=".afw_manifest.json", filters=None):
+    '''Mirrors a Data Management folder tree to a local directory.<br>
+    Scope - data:read<br>
+    folder - The datamgt.Folder to mirror<br>
+    local_dir - Path to the local directory, created if missing<br>
+    max_workers - Downloads (and listings) in flight at the same time<br>
+    manifest_name - File in local_dir where the mirrored versions are kept<br>
+    filters - datamgt.Options.filter_options(), see `walk`<br><br>
+
+    Only tip versions whose versionNumber changed since the last mirror (or whose
+    local file is missing) are downloaded. The manifest is saved even if a download
+    fails, so the next run resumes from there. Files and folders whose name would write 
+    outside local_dir are skipped, see `walk`.<br>
+    Returns a list with the paths of the downloaded files'''
+    checkScopes(token, "data:read")
+    manifest_path = os.path.join(local_dir, manifest_name)
+    manifest = {}
+    if os.path.isfile(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+
+    def mirror_item(path, item):
+        file_path = os.path.join(local_dir, path, item.displayName or "")
+        if not _safe_name(item.displayName) or not _inside(local_dir, file_path):
+            _unsafe("item", item, item.displayName)
+            return None
+        tip = item.tip or item.get_tip_versions(token)
+        entry = manifest.get(item.id, None)
+        if entry is not None and entry["versionNumber"] == tip.versionNumber and os.path.isfile(file_path):
+            return None
+        tip.download(token, file_path)
+        manifest[item.id] = {"path": os.path.join(path, item.displayName),
+                             "versionId": tip.id,
+                             "versionNumber": tip.versionNumber}
+        return file_path
+
+    os.makedirs(local_dir, exist_ok=True)
+    downloads = []
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            for path, remote, _, items in walk(token, folder, max_workers, filters):
+                if not _inside(local_dir, os.path.join(local_dir, path)): # A symlink out of local_dir
+                    _unsafe("folder", remote, path)
+                    continue
+                os.makedirs(os.path.join(local_dir, path), exist_ok=True)
+                downloads.extend(pool.submit(mirror_item, path, i) for i in items)
+            downloaded = [d.result() for d in downloads]
+            return [p for p in downloaded if p is not None]
+    finally:
+        with open(manifest_path+".tmp", "w") as f:
+            json.dump(manifest, f, indent=1)
+        os.replace(manifest_path+".tmp", manifest_path)
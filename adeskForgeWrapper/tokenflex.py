@@ -5,11 +5,10 @@
 '''Module for the Token Flex API<br>
 Tokens in this module must be 3 legged. Check client.get3LeggedToken()'''
 
-import requests
-
 from .utils import TOKENFLEX_API
 from .utils import checkScopes
 from .utils import checkResponse
+from .cache import stale_while_revalidate
 from . import client
 
 
@@ -47,14 +46,14 @@ class Contract(object):
 #endRegion
 
     @classmethod
+    @stale_while_revalidate("tokenflex.Contract.get_contracts")
     def get_contracts(cls, token):
         '''List all the accessible contracts and high level information for each contract.<br>
         Token - Must be obtained via 3-legged workflow. client.get3LeggedToken()<br>
         Scope data:read'''
         checkScopes(token, "data:read")
         endpoint_url = TOKENFLEX_API+"/contract"
-        r = requests.get(endpoint_url, headers=token.get_header).json()
-        checkResponse(r)
+        r = checkResponse(token.transport.get(endpoint_url, headers=token.get_header)).json()
         return [cls(c) for c in r]
     
     @classmethod
@@ -65,8 +64,7 @@ class Contract(object):
         Scope data:read'''
         checkScopes(token, "data:read")
         endpoint_url = TOKENFLEX_API+"/contract/{conId}".format(contractId)
-        r = requests.get(endpoint_url, headers=token.get_header).json()
-        checkResponse(r)
+        r = checkResponse(token.transport.get(endpoint_url, headers=token.get_header)).json()
         return cls(r)
 
     def get_enrichment_categories(self, token):
@@ -74,8 +72,7 @@ class Contract(object):
         Returns a list with all enrichment categories of a contract.'''
         checkScopes(token, "data:read")
         endpoint_url = TOKENFLEX_API+"/contract/{conId}/enrichment".format(self.contractNumber)
-        r = requests.get(endpoint_url, headers=token.get_header).json()
-        checkResponse(r)
+        r = checkResponse(token.transport.get(endpoint_url, headers=token.get_header)).json()
         return r
 
     def get_enrichment_values(self, token, category):
@@ -83,8 +80,7 @@ class Contract(object):
         Returns a list with all possible values for an enrichment category.'''
         checkScopes(token, "data:read")
         endpoint_url = TOKENFLEX_API+"/contract/{conId}/enrichment/{enrCat}".format(conId=self.contractNumber, enrCat=category)
-        r = requests.get(endpoint_url, headers=token.get_header).json()
-        checkResponse(r)
+        r = checkResponse(token.transport.get(endpoint_url, headers=token.get_header)).json()
         return r
 
     def contract_summary(self, token, filters = None):
@@ -93,8 +89,7 @@ class Contract(object):
         Returns a list of attributes'''
         checkScopes(token, "data:read")
         endpoint_url = TOKENFLEX_API+"/usage/{conId}/summary".format(conId = self.contractNumber)
-        r = requests.get(endpoint_url, headers=token.get_header).json()
-        checkResponse(r)
+        r = checkResponse(token.transport.get(endpoint_url, headers=token.get_header)).json()
         return r
 
 __pdoc__ = {}
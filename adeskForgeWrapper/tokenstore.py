@@ -0,0 +1,140 @@
+'''Token stores, tokens are shared so only one process or thread requests each of them'''
+
+import os
+import abc
+import json
+import hashlib
+import threading
+
+from contextlib import contextmanager
+from time import time
+
+if os.name == "nt":
+    import msvcrt
+
+    def _lock_file(f):
+        f.seek(0)
+        while True:
+            try:
+                msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                return
+            except OSError: # LK_LOCK gives up after 10 seconds, keep waiting
+                continue
+
+    def _unlock_file(f):
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+else:
+    import fcntl
+
+    def _lock_file(f):
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+
+    def _unlock_file(f):
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+class TokenStore(abc.ABC):
+    '''Base class for token stores. Subclasses implement lock(key), read(key) and write(key, raw),
+    one missing fails when the store is created.<br>
+    margin - Seconds before expiring a stored token stops being handed out'''
+    def __init__(self, margin=60):
+        self.margin = margin
+
+    @staticmethod
+    def key(client_id, scope, three_legged=False):
+        '''One token per app, flow and scope, the scope order doesn't matter'''
+        raw = "{c} {f} {s}".format(c=client_id, f=3 if three_legged else 2, s=" ".join(sorted(scope.split())))
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _is_valid(self, raw, newer_than):
+        if raw is None or raw.get("expires_at", 0) - self.margin < time():
+            return False
+        return newer_than is None or raw["expires_at"] > newer_than
+
+    def get_or_fetch(self, key, fetch, newer_than=None):
+        '''Returns the stored token response for key. If it is missing or about to expire,
+        fetch() is called to request a new one while every other caller waits for it.<br>
+        newer_than - Also request a new one if the stored token expires before this timestamp'''
+        raw = self.read(key)
+        if self._is_valid(raw, newer_than):
+            return raw
+        with self.lock(key):
+            raw = self.read(key) # Someone may have refreshed it while we waited
+            if self._is_valid(raw, newer_than):
+                return raw
+            raw = fetch()
+            self.write(key, raw)
+            return raw
+
+    @abc.abstractmethod
+    def lock(self, key):
+        '''A context manager held while the token of key is requested, across every
+        process and thread sharing the store'''
+
+    @abc.abstractmethod
+    def read(self, key):
+        '''The stored token response of key, None if there is none'''
+
+    @abc.abstractmethod
+    def write(self, key, raw):
+        '''Stores the token response raw under key'''
+
+
+class MemoryTokenStore(TokenStore):
+    '''Shares tokens between the threads of a process'''
+    def __init__(self, margin=60):
+        super().__init__(margin)
+        self._tokens = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def lock(self, key):
+        with self._lock:
+            return self._locks.setdefault(key, threading.Lock())
+
+    def read(self, key):
+        return self._tokens.get(key, None)
+
+    def write(self, key, raw):
+        self._tokens[key] = raw
+
+
+class FileTokenStore(TokenStore):
+    '''Shares tokens between processes through files in a directory. An advisory lock
+    on a file per token makes sure only one process requests it.<br>
+    directory - Created if missing, tokens are only readable by the current user'''
+    def __init__(self, directory, margin=60):
+        super().__init__(margin)
+        self.directory = directory
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+
+    def _path(self, key, ext):
+        return os.path.join(self.directory, key+ext)
+
+    @contextmanager
+    def lock(self, key):
+        fd = os.open(self._path(key, ".lock"), os.O_RDWR | os.O_CREAT, 0o600)
+        with os.fdopen(fd, "r+b") as f:
+            if os.name == "nt" and os.fstat(fd).st_size == 0:
+                f.write(b"\0") # msvcrt locks a byte range that must exist
+                f.flush()
+            _lock_file(f)
+            try:
+                yield
+            finally:
+                _unlock_file(f)
+
+    def read(self, key):
+        try:
+            with open(self._path(key, ".json")) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def write(self, key, raw):
+        tmp_path = self._path(key, ".json.{pid}.tmp".format(pid=os.getpid()))
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w") as f:
+            json.dump(raw, f)
+        os.replace(tmp_path, self._path(key, ".json"))
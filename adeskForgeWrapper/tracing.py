@@ -0,0 +1,273 @@
+'''Opt-in tracing of the connection phases of each request. Give a transport.Transport a
+Tracer and every request becomes a span with the time spent waiting for a pooled connection,
+resolving the host, connecting, in the TLS handshake, sending, waiting for the first byte
+and reading the body'''
+
+import os
+import json
+import socket
+import threading
+
+from collections import deque
+from time import time_ns
+from time import perf_counter_ns
+
+# Phases in the order they happen
+PHASES = ("pool_wait", "dns", "connect", "tls", "send", "ttfb", "body")
+
+_local = threading.local()
+
+
+class Span(object):
+    '''One request as seen by the caller (retries included).<br>
+    phases - [(phase, start_ns, end_ns)], unix time in nanoseconds. A request that reused a
+    pooled connection has no dns, connect nor tls phases, a coalesced one has none at all and
+    a hedged one has the phases of both its requests, overlapping'''
+    def __init__(self, name, method, url):
+        self.trace_id = os.urandom(16).hex()
+        self.span_id = os.urandom(8).hex()
+        self.name = name
+        self.method = method
+        self.url = url
+        self.status = None
+        self.error = None
+        self.phases = []
+        self.start_ns = time_ns()
+        self.end_ns = None
+        self._perf_start = perf_counter_ns()
+        self._headers_at = None
+
+    def _epoch(self, perf_ns):
+        return self.start_ns + (perf_ns - self._perf_start)
+
+    def add_phase(self, phase, start, end):
+        '''start and end from time.perf_counter_ns()'''
+        self.phases.append((phase, self._epoch(start), self._epoch(end)))
+
+    @property
+    def duration(self):
+        return (self.end_ns - self.start_ns) / 1e9 if self.end_ns is not None else None
+
+    def phase_totals(self):
+        '''{phase: seconds}, phases that happened more than once (retries) are added up'''
+        totals = {}
+        for phase, start, end in self.phases:
+            totals[phase] = totals.get(phase, 0) + (end - start) / 1e9
+        return totals
+
+    def as_dict(self):
+        return {"trace_id": self.trace_id,
+                "span_id": self.span_id,
+                "name": self.name,
+                "method": self.method,
+                "url": self.url,
+                "status": self.status,
+                "error": self.error,
+                "start_ns": self.start_ns,
+                "end_ns": self.end_ns,
+                "duration": self.duration,
+                "phases": [{"phase": p, "start_ns": s, "end_ns": e} for p, s, e in self.phases],
+                "totals": self.phase_totals()}
+
+
+def _otel_value(value):
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+def _otel_attributes(attributes):
+    return [{"key": k, "value": _otel_value(v)} for k, v in attributes.items() if v is not None]
+
+
+class Tracer(object):
+    '''Collects the spans of the requests sent through the transports it is given to.<br>
+    max_spans - Only the latest spans are kept<br>
+    exporter - Called with each finished Span, eg to write them somewhere as they happen'''
+    def __init__(self, max_spans=10000, exporter=None):
+        self.exporter = exporter
+        self._spans = deque(maxlen=max_spans)
+
+    def start(self, name, method, url):
+        '''Starts the span of a request sent from this thread'''
+        span = Span(name, method, url.split("?", 1)[0])
+        _local.span = span
+        return span
+
+    def finish(self, span, status=None, error=None):
+        _local.span = None
+        span.end_ns = span._epoch(perf_counter_ns())
+        span.status = status
+        span.error = None if error is None else "{t}: {e}".format(t=type(error).__name__, e=error)
+        self._spans.append(span)
+        if self.exporter is not None:
+            self.exporter(span)
+
+    @property
+    def spans(self):
+        return list(self._spans)
+
+    def clear(self):
+        self._spans.clear()
+
+    def to_json(self, indent=None):
+        '''The spans as a JSON list, see Span.as_dict'''
+        return json.dumps([s.as_dict() for s in self.spans], indent=indent)
+
+    def to_otel(self, service_name="adeskForgeWrapper"):
+        '''The spans in the OTLP/JSON format (ExportTraceServiceRequest), post it to an
+        OpenTelemetry collector at /v1/traces. Each phase is a child span of its request'''
+        otel_spans = []
+        for s in self.spans:
+            attributes = {"http.request.method": s.method,
+                          "url.full": s.url,
+                          "http.response.status_code": s.status,
+                          "error.type": s.error}
+            for phase, seconds in s.phase_totals().items():
+                attributes["afw.{p}_ms".format(p=phase)] = seconds * 1000
+            failed = s.error is not None or (s.status is not None and s.status >= 400)
+            otel_spans.append({"traceId": s.trace_id,
+                               "spanId": s.span_id,
+                               "name": s.name,
+                               "kind": 3, # CLIENT
+                               "startTimeUnixNano": str(s.start_ns),
+                               "endTimeUnixNano": str(s.end_ns),
+                               "attributes": _otel_attributes(attributes),
+                               "status": {"code": 2 if failed else 0}})
+            for phase, start, end in s.phases:
+                otel_spans.append({"traceId": s.trace_id,
+                                   "spanId": os.urandom(8).hex(),
+                                   "parentSpanId": s.span_id,
+                                   "name": phase,
+                                   "kind": 1, # INTERNAL
+                                   "startTimeUnixNano": str(start),
+                                   "endTimeUnixNano": str(end)})
+        return {"resourceSpans": [{
+            "resource": {"attributes": _otel_attributes({"service.name": service_name})},
+            "scopeSpans": [{"scope": {"name": __name__}, "spans": otel_spans}]}]}
+
+
+def current_span():
+    '''The span of the request this thread is sending, None if not tracing'''
+    return getattr(_local, "span", None)
+
+def in_span(span, fn, *args, **kwargs):
+    '''Calls fn with span as the current span of this thread, for requests sent from
+    another thread than the one that started the span'''
+    previous = current_span()
+    _local.span = span
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        _local.span = previous
+
+def _phase(phase, start):
+    span = current_span()
+    if span is not None:
+        end = perf_counter_ns()
+        span.add_phase(phase, start, end)
+        return end
+    return None
+
+def mark_body():
+    '''Called once the response body has been read, ends the body phase'''
+    span = current_span()
+    if span is not None and span._headers_at is not None:
+        span.add_phase("body", span._headers_at, perf_counter_ns())
+        span._headers_at = None
+
+
+_adapter_class = None
+
+def tracing_adapter_class():
+    '''A requests HTTPAdapter whose urllib3 pools and connections report their phases.
+    Built on first use so importing this module doesn't import requests'''
+    global _adapter_class
+    if _adapter_class is not None:
+        return _adapter_class
+
+    from requests.adapters import HTTPAdapter
+    from urllib3.connection import HTTPConnection
+    from urllib3.connection import HTTPSConnection
+    from urllib3.connectionpool import HTTPConnectionPool
+    from urllib3.connectionpool import HTTPSConnectionPool
+    from urllib3.exceptions import NewConnectionError
+
+    class _TracedConnection(object):
+        def _new_conn(self):
+            if current_span() is None:
+                return super()._new_conn()
+            host = self._dns_host
+            start = perf_counter_ns()
+            try:
+                addresses = socket.getaddrinfo(host, self.port, 0, socket.SOCK_STREAM)
+            except socket.gaierror:
+                return super()._new_conn() # Raises the same error urllib3 would
+            start = _phase("dns", start)
+            # Connect to the addresses we resolved, in order, so they are not resolved again.
+            # The TLS handshake still uses the host name
+            error = None
+            try:
+                for address in addresses:
+                    self._dns_host = address[4][0]
+                    try:
+                        sock = super()._new_conn()
+                        break
+                    except NewConnectionError as e:
+                        error = e
+                else:
+                    raise error
+            finally:
+                self._dns_host = host
+            self._connected_at = _phase("connect", start)
+            return sock
+
+        def request(self, *args, **kwargs):
+            start = perf_counter_ns()
+            try:
+                return super().request(*args, **kwargs)
+            finally:
+                _phase("send", start)
+
+        def getresponse(self, *args, **kwargs):
+            start = perf_counter_ns()
+            r = super().getresponse(*args, **kwargs)
+            span = current_span()
+            if span is not None:
+                span._headers_at = _phase("ttfb", start)
+            return r
+
+    class TracedHTTPConnection(_TracedConnection, HTTPConnection):
+        pass
+
+    class TracedHTTPSConnection(_TracedConnection, HTTPSConnection):
+        def connect(self):
+            self._connected_at = None
+            super().connect()
+            if self._connected_at is not None:
+                _phase("tls", self._connected_at)
+
+    class _TracedPool(object):
+        def _get_conn(self, timeout=None):
+            start = perf_counter_ns()
+            conn = super()._get_conn(timeout)
+            _phase("pool_wait", start)
+            return conn
+
+    class TracedHTTPConnectionPool(_TracedPool, HTTPConnectionPool):
+        ConnectionCls = TracedHTTPConnection
+
+    class TracedHTTPSConnectionPool(_TracedPool, HTTPSConnectionPool):
+        ConnectionCls = TracedHTTPSConnection
+
+    class TracingAdapter(HTTPAdapter):
+        def init_poolmanager(self, *args, **kwargs):
+            super().init_poolmanager(*args, **kwargs)
+            self.poolmanager.pool_classes_by_scheme = {"http": TracedHTTPConnectionPool,
+                                                       "https": TracedHTTPSConnectionPool}
+
+    _adapter_class = TracingAdapter
+    return _adapter_class
@@ -0,0 +1,398 @@
+'''HTTP transport every request of the wrapper goes through'''
+
+import threading
+import contextlib
+
+from collections import deque
+from time import sleep
+from time import perf_counter
+
+from . import AFWExceptions
+from . import events
+from .cache import ResponseCache
+from .cache import SingleFlight
+from .utils import regional_endpoint
+from .utils import retry_after
+from .utils import AUTODESK_BASE_URL
+from . import metrics as _metrics
+from . import tracing as _tracing
+from . import http2 as _http2
+
+# Statuses of requests the server did not process, safe to send again
+RETRY_STATUSES = (429, 503)
+
+# Deadlines set with deadline(), per thread
+_calls = threading.local()
+
+
+@contextlib.contextmanager
+def deadline(seconds):
+    '''Every request sent from this thread inside it must be answered within seconds of
+    entering it, retries and waits included, or AFWExceptions.DeadlineExceeded is raised:<br>
+
+        with afw.transport.deadline(2):
+            item = afw.datamgt.Item.item_by_id(token, project_id, item_id)
+
+    Nested deadlines can only shorten the one around them'''
+    previous = getattr(_calls, "deadline", None)
+    current = perf_counter() + seconds
+    _calls.deadline = current if previous is None else min(previous, current)
+    try:
+        yield
+    finally:
+        _calls.deadline = previous
+
+
+class _Latencies(object):
+    '''The latest latencies of an operation and their quantile, updated every few samples'''
+    def __init__(self, quantile, size=200, every=20):
+        self.quantile = quantile
+        self.every = every
+        self.value = None
+        self._samples = deque(maxlen=size)
+        self._added = 0
+        self._lock = threading.Lock()
+
+    def add(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+            self._added += 1
+            if self._added % self.every == 0:
+                ordered = sorted(self._samples)
+                self.value = ordered[min(int(self.quantile * len(ordered)), len(ordered) - 1)]
+
+
+class _Methods(object):
+    '''HTTP verbs on top of request()'''
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def put(self, url, **kwargs):
+        return self.request("PUT", url, **kwargs)
+
+    def patch(self, url, **kwargs):
+        return self.request("PATCH", url, **kwargs)
+
+    def delete(self, url, **kwargs):
+        return self.request("DELETE", url, **kwargs)
+
+    def head(self, url, **kwargs):
+        return self.request("HEAD", url, **kwargs)
+
+
+class Transport(_Methods):
+    '''Sends requests through a pooled requests.Session, connections are reused between calls.<br>
+    pool_size - Connections kept open per host<br>
+    cache - A cache.ResponseCache, GET responses with an ETag or Last-Modified are stored and
+    revalidated with If-None-Match/If-Modified-Since. On a 304 the stored body is served<br>
+    coalesce - Concurrent identical GET and HEAD requests (same url, query and user) are
+    sent once and all the callers get that response<br>
+    metrics - A sink from the metrics module (InMemorySink, PrometheusSink, StatsDSink), 
+    every request is recorded under the wrapper call that sent it<br>
+    retries - Times a request answered with 429 or 503 is sent again, after the Retry-After 
+    the server asked for or an exponential backoff. Requests with a file or stream body are not retried<br>
+    max_retry_wait - Seconds a retry waits at most, past that the 429/503 response is returned<br>
+    tracer - A tracing.Tracer, every request is recorded as a span with its connection phases<br>
+    base_url - Sends the requests meant for https://developer.api.autodesk.com here instead,
+    eg a gateway or the mock server of the benchmarks<br>
+    timeout - Seconds (or (connect, read) seconds) a request may wait for the server, by default
+    it can wait forever<br>
+    deadlines - {operation: seconds}, eg {"datamgt.Item.item_by_id": 2}, the calls of an operation
+    must be answered in that time, retries included, see `deadline` to set one around any call<br>
+    hedge - True or a list of operations whose GETs are hedged: if the answer takes longer than the
+    hedge_quantile of the latest latencies of the operation a second request is sent and the first
+    answer is used. Only for idempotent requests, it adds load to cut tail latency<br>
+    http2 - Send through httpx over HTTP/2, concurrent requests share a few multiplexed connections
+    instead of taking one each. Needs `pip install httpx[http2]`, spans of a tracer have no
+    connection phases<br><br>
+
+    Pass it to client.Client to use it, requests of a client without one go through the
+    shared `default_transport()`'''
+    def __init__(self, pool_size=10, cache=None, coalesce=True, metrics=None, retries=0, max_retry_wait=60,
+                 tracer=None, base_url=None, timeout=None, deadlines=None, hedge=None, hedge_quantile=0.95,
+                 http2=False):
+        # requests is only imported once a transport is needed, it is most of the import time
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        self.session = requests.Session()
+        if http2:
+            adapter = _http2.http2_adapter_class()(pool_size)
+        else:
+            adapter_class = HTTPAdapter if tracer is None else _tracing.tracing_adapter_class()
+            adapter = adapter_class(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.cache = cache
+        self.coalesce = coalesce
+        self.metrics = metrics
+        self.retries = retries
+        self.max_retry_wait = max_retry_wait
+        self.tracer = tracer
+        self.http2 = http2
+        self.base_url = base_url.rstrip("/") if base_url is not None else None
+        self.timeout = timeout
+        self.deadlines = dict(deadlines or {})
+        self.hedge = hedge if hedge in (None, True, False) else frozenset(hedge)
+        self.hedge_quantile = hedge_quantile
+        self._flight = SingleFlight()
+        self._local = threading.local()
+        self._latencies = {}
+        self._hedge_pool = None
+        self._hedge_lock = threading.Lock()
+        self._pool_size = pool_size
+        self._timeout_error = requests.exceptions.Timeout
+
+    def request(self, method, url, region=None, **kwargs):
+        '''Same arguments as requests.request, returns a requests.Response<br>
+        region - Routes the request to the endpoints of this region, see utils.REGION_ROUTES'''
+        if region is not None:
+            url, kwargs["headers"] = regional_endpoint(url, region, kwargs.get("headers", None))
+        if self.base_url is not None and url.startswith(AUTODESK_BASE_URL):
+            url = self.base_url+url[len(AUTODESK_BASE_URL):]
+        if self.metrics is None and self.tracer is None and not _metrics.global_sinks and not self.deadlines \
+           and not self.hedge:
+            self._local.operation = None
+            self._local.deadline = getattr(_calls, "deadline", None)
+            return self._dispatch(method, url, **kwargs)
+
+        operation = self._local.operation = _metrics.current_operation(2)
+        self._local.deadline = getattr(_calls, "deadline", None)
+        if operation in self.deadlines:
+            call_deadline = perf_counter() + self.deadlines[operation]
+            if self._local.deadline is None or call_deadline < self._local.deadline:
+                self._local.deadline = call_deadline
+        stats = self._local.stats = [0, 0.0] # retries, throttle wait
+        self._local.led = True
+        span = self.tracer.start(operation, method, url) if self.tracer is not None else None
+        start = perf_counter()
+        r = None
+        error = None
+        try:
+            r = self._dispatch(method, url, **kwargs)
+            return r
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            status = r.status_code if r is not None else None
+            if span is not None:
+                self.tracer.finish(span, status, error)
+            sinks = list(_metrics.global_sinks)
+            if self.metrics is not None:
+                sinks.append(self.metrics)
+            if sinks and self._local.led: # Requests joined to another thread's were not sent
+                stream = kwargs.get("stream", False)
+                sample = _metrics.Sample(
+                    operation, method, status, perf_counter() - start,
+                    _metrics.request_size(r) if r is not None else 0,
+                    _metrics.response_size(r, stream) if r is not None else 0,
+                    stats[0], stats[1])
+                for sink in sinks:
+                    sink.record(sample)
+
+    def _dispatch(self, method, url, **kwargs):
+        if self.coalesce and method in ("GET", "HEAD") and not kwargs.get("stream", False):
+            key = (method, ResponseCache.key(url, kwargs.get("params", None), kwargs.get("headers", None)))
+            limit = getattr(self._local, "deadline", None)
+            # Waiting on another thread's request counts against this thread's deadline
+            timeout = max(limit - perf_counter(), 0) if limit is not None else None
+            self._local.led = False
+            try:
+                return self._flight.do_within(timeout, key, self._lead, method, url, **kwargs)
+            except AFWExceptions.DeadlineExceeded:
+                raise
+            except TimeoutError as e:
+                raise AFWExceptions.DeadlineExceeded("No response within the deadline: {e}".format(e=e)) from e
+        return self._send(method, url, **kwargs)
+
+    def _lead(self, method, url, **kwargs):
+        # Runs in the one thread of a coalesced request that sends it
+        self._local.led = True
+        return self._send(method, url, **kwargs)
+
+    def _send(self, method, url, **kwargs):
+        if self.cache is not None and method == "GET" and not kwargs.get("stream", False):
+            return self._conditional_get(url, **kwargs)
+        return self._send_with_retries(method, url, **kwargs)
+
+    def _send_with_retries(self, method, url, **kwargs):
+        attempt = 0
+        limit = getattr(self._local, "deadline", None)
+        while True:
+            r = self._send_once(method, url, kwargs, limit)
+            if not kwargs.get("stream", False):
+                _tracing.mark_body()
+            if r.status_code not in RETRY_STATUSES or attempt >= self.retries or not _replayable(kwargs):
+                return r
+            wait = _retry_after(r, attempt)
+            if wait > self.max_retry_wait or (limit is not None and perf_counter() + wait >= limit):
+                return r
+            r.close()
+            attempt += 1
+            stats = getattr(self._local, "stats", None)
+            if stats is not None:
+                stats[0] += 1
+                stats[1] += wait
+            sleep(wait)
+
+    def _send_once(self, method, url, kwargs, limit):
+        if limit is not None or self.timeout is not None:
+            kwargs = dict(kwargs, timeout=_timeout(kwargs.get("timeout", self.timeout), limit))
+        operation = getattr(self._local, "operation", None)
+        hedged = self.hedge is True or (self.hedge and operation in self.hedge)
+        if not hedged or method != "GET" or kwargs.get("stream", False):
+            return self._timed(self.session.request, limit, method, url, **kwargs)
+
+        latencies = self._latencies.get(operation, None)
+        if latencies is None:
+            latencies = self._latencies.setdefault(operation, _Latencies(self.hedge_quantile))
+        start = perf_counter()
+        r = self._timed(self._hedged, limit, latencies.value, operation, method, url, **kwargs)
+        latencies.add(perf_counter() - start)
+        return r
+
+    def _timed(self, send, limit, *args, **kwargs):
+        try:
+            return send(*args, **kwargs)
+        except self._timeout_error as e:
+            if limit is None:
+                raise
+            raise AFWExceptions.DeadlineExceeded("No response within the deadline: {e}".format(e=e)) from e
+
+    def _hedged(self, delay, operation, method, url, **kwargs):
+        '''Sends the request from this thread and, if there is no answer after delay seconds,
+        a second one from the hedge pool. Returns the answer of the first request, or the one of
+        the second if the first failed; the unused one is closed when it arrives'''
+        if delay is None: # Not enough latencies seen yet
+            return self.session.request(method, url, **kwargs)
+        from concurrent.futures import ThreadPoolExecutor
+        if self._hedge_pool is None:
+            with self._hedge_lock:
+                if self._hedge_pool is None:
+                    self._hedge_pool = ThreadPoolExecutor(max_workers=self._pool_size,
+                                                          thread_name_prefix="afw-hedge")
+        answered = threading.Event()
+        # The pool thread records the connection phases in the span of this thread
+        span = _tracing.current_span()
+        def hedge():
+            if answered.wait(delay):
+                return None
+            events.emit("transport.hedged", events.DEBUG, operation=operation, url=url, after=delay)
+            return _tracing.in_span(span, self.session.request, method, url, **kwargs)
+        second = self._hedge_pool.submit(hedge)
+        try:
+            r = self.session.request(method, url, **kwargs)
+        except Exception:
+            answered.set()
+            if second.exception() is not None or second.result() is None:
+                raise
+            return second.result()
+        answered.set()
+        second.add_done_callback(_close_response)
+        return r
+
+    def _conditional_get(self, url, **kwargs):
+        key = self.cache.key(url, kwargs.get("params", None), kwargs.get("headers", None))
+        entry = self.cache.get(key)
+        if entry is not None:
+            headers = dict(kwargs.get("headers", None) or {})
+            if entry.etag is not None:
+                headers["If-None-Match"] = entry.etag
+            if entry.last_modified is not None:
+                headers["If-Modified-Since"] = entry.last_modified
+            kwargs["headers"] = headers
+
+        r = self._send_with_retries("GET", url, **kwargs)
+        if r.status_code == 304 and entry is not None:
+            return entry.to_response(r)
+        if r.status_code == 200:
+            self.cache.put(key, r)
+        return r
+
+    def for_region(self, region):
+        '''A view of this transport that routes every request to region'''
+        return RegionalTransport(self, region)
+
+    def close(self):
+        if self._hedge_pool is not None:
+            self._hedge_pool.shutdown(wait=False)
+        self.session.close()
+
+
+def _timeout(timeout, limit):
+    '''The requests timeout that ends a request by limit (perf_counter), raises
+    DeadlineExceeded if limit has passed'''
+    if limit is None:
+        return timeout
+    remaining = limit - perf_counter()
+    if remaining <= 0:
+        raise AFWExceptions.DeadlineExceeded("The deadline passed before the request was sent")
+    if timeout is None:
+        return remaining
+    if isinstance(timeout, tuple):
+        return tuple(remaining if t is None else min(t, remaining) for t in timeout)
+    return min(timeout, remaining)
+
+def _close_response(future):
+    if future.exception() is None and future.result() is not None:
+        future.result().close()
+
+def _replayable(kwargs):
+    '''False if the body is a file or stream that was consumed by the first attempt'''
+    if kwargs.get("files", None) is not None:
+        return False
+    data = kwargs.get("data", None)
+    return data is None or isinstance(data, (bytes, str, dict, list, tuple))
+
+def _retry_after(r, attempt):
+    '''Seconds the server asked to wait (Retry-After), or an exponential backoff'''
+    wait = retry_after(r.headers)
+    return wait if wait is not None else 0.5 * 2**attempt
+
+
+class RegionalTransport(_Methods):
+    '''Routes the requests to the endpoints of region and sends them through transport,
+    the connections and caches of transport are shared'''
+    def __init__(self, transport, region):
+        self.transport = transport
+        self.region = region
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault("region", self.region)
+        return self.transport.request(method, url, **kwargs)
+
+    def for_region(self, region):
+        return self.transport.for_region(region)
+
+    def close(self):
+        self.transport.close()
+
+
+_default_transport = None
+_default_http2_transport = None
+_default_lock = threading.Lock()
+
+def default_transport(http2=False):
+    '''The Transport used by clients that were not given one, the HTTP/2 one for the clients
+    created with http2=True'''
+    global _default_transport, _default_http2_transport
+    if http2:
+        if _default_http2_transport is None:
+            with _default_lock:
+                if _default_http2_transport is None:
+                    _default_http2_transport = Transport(http2=True)
+        return _default_http2_transport
+    if _default_transport is None:
+        with _default_lock:
+            if _default_transport is None:
+                _default_transport = Transport()
+    return _default_transport
+
+def set_default_transport(transport):
+    '''Replaces the Transport used by clients that were not given one'''
+    global _default_transport
+    _default_transport = transport
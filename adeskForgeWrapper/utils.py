@@ -1,5 +1,9 @@
 '''Forge URLs and utility functions'''
 
+import email.utils
+
+from time import time
+
 from . import AFWExceptions
 
 AUTODESK_BASE_URL = "https://developer.api.autodesk.com"
@@ -8,7 +12,21 @@ TOKENFLEX_API = AUTODESK_BASE_URL+"/tokenflex/v1"
 RECAP_API = AUTODESK_BASE_URL+"/photo-to-3d/v1"
 AUTH_API = AUTODESK_BASE_URL+"/authentication/v1"
 INFO_AUTH = AUTODESK_BASE_URL+"/userprofile/v1"
-DA_API = AUTODESK_BASE_URL+"/da/us-east/v3"
+DA_REGIONS = ("us-east",) # Known Design Automation regions, probe_region tries these
+DA_REGION = "us-east"
+DA_API = AUTODESK_BASE_URL+"/da/{r}/v3".format(r=DA_REGION)
+
+# Requests of accounts outside the US are routed to their region.
+# {region: [(url prefix, regional prefix or None to keep the url, headers to add)]}, 
+# region as returned by datamgt.Hub.region
+REGION_ROUTES = {
+    "EMEA": [(AUTODESK_BASE_URL+"/hq/v1/accounts/", AUTODESK_BASE_URL+"/hq/v1/regions/eu/accounts/", {}),
+             (AUTODESK_BASE_URL+"/hq/v2/accounts/", AUTODESK_BASE_URL+"/hq/v2/regions/eu/accounts/", {}),
+             (AUTODESK_BASE_URL+"/bim360/admin/", None, {"Region": "EMEA"}),
+             (AUTODESK_BASE_URL+"/project/", None, {"x-ads-region": "EMEA"}),
+             (AUTODESK_BASE_URL+"/data/", None, {"x-ads-region": "EMEA"}),
+             (AUTODESK_BASE_URL+"/oss/", None, {"x-ads-region": "EMEA"})]
+}
 
 # BIM360 and data management APIs are not consistent with their API urls
 
@@ -23,18 +41,92 @@ def checkScopes(token, endpoint_scope: str):
     else:
         raise AFWExceptions.AFWError("Missing required scopes:", endpoint_scope)
 
+def retry_after(headers):
+    '''Seconds the Retry-After header asks to wait, None if there is none'''
+    value = headers.get("Retry-After", None) if headers else None
+    if value is None:
+        return None
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        date = email.utils.parsedate_tz(value)
+        if date is not None:
+            return max(email.utils.mktime_tz(date) - time(), 0)
+    return None
+
+def _error_details(body):
+    '''(code, message, errors) of the error formats of the different APIs, None if body isn't one'''
+    if not isinstance(body, dict):
+        return None
+    if "code" in body and "message" in body:
+        return body["code"], body["message"], None
+    elif "developerMessage" in body and "errorCode" in body:
+        return body["errorCode"], body["developerMessage"], None
+    elif "code" in body and "msg" in body:
+        return body["code"], body["msg"], None
+    elif "jsonapi" in body and "errors" in body: # Data management returns a list of errors
+        first = body["errors"][0] if body["errors"] else {}
+        return first.get("code", None), first.get("detail", first.get("title", None)), body["errors"]
+    elif "Error" in body: # This is ReCap format... too many error formats
+        return body["Error"]["code"], body["Error"]["msg"], None
+    return None
+
+def _body_status(code, errors):
+    # Errors read from a body carry no HTTP status, data management ones have it in each error
+    if errors:
+        try:
+            return int(errors[0].get("status", None))
+        except (TypeError, ValueError):
+            pass
+    if isinstance(code, str) and code.startswith("AUTH-"):
+        return 401
+    return None
+
 def checkResponse(r):
-    '''If the response raised an error, this will detect it'''
-    if "code" in r and "message" in r:
-        raise AFWExceptions.APIError("CODE {e1} - {e2}".format(e1=r["code"], e2=r["message"]))
-    elif "developerMessage" in r and "errorCode" in r:
-        raise AFWExceptions.APIError("CODE {e1} - {e2}".format(e1=r["errorCode"], e2=r["developerMessage"]))
-    elif "code" in r and "msg" in r:
-        raise AFWExceptions.APIError("CODE {e1} - {e2}".format(e1=r["code"], e2=r["msg"]))
-    elif "jsonapi" in r and "errors" in r: # Check for dm errors, response returns a list of errors so raise that list
-        raise AFWExceptions.APIError(r["errors"])
-    elif "Error" in r: # This is ReCap format... too many error formats
-        raise AFWExceptions.APIError("CODE {e1} - {e2}".format(e1=r["Error"]["code"], e2=r["Error"]["msg"]))
+    '''Raises the AFWExceptions.APIError subclass of a failed response, returns r otherwise.<br>
+    r - requests.Response, classified by its HTTP status. The body of successful responses
+    is not read. A decoded body (dict) is searched for the error formats of the APIs
+    instead, for ReCap that answers errors with a 200'''
+    if not hasattr(r, "status_code"):
+        details = _error_details(r)
+        if details is not None:
+            code, message, errors = details
+            status = _body_status(code, errors)
+            raise AFWExceptions.error_class(status)("CODE {e1} - {e2}".format(e1=code, e2=message),
+                                                    status=status, code=code, errors=errors)
+        return r
+    if r.status_code < 400:
+        return r
+    try:
+        body = r.json()
+    except ValueError:
+        body = None
+    code, message, errors = _error_details(body) or (None, r.text[:200] or r.reason, None)
+    raise AFWExceptions.error_class(r.status_code)(
+        "HTTP {s} CODE {e1} - {e2}".format(s=r.status_code, e1=code, e2=message), status=r.status_code,
+        code=code, headers=r.headers, retry_after=retry_after(r.headers), errors=errors)
+
+def da_api():
+    '''Base url of the Design Automation API in DA_REGION'''
+    return DA_API
+
+def set_da_region(region):
+    '''Sends the Design Automation requests to region, eg "us-east"'''
+    global DA_REGION, DA_API
+    DA_REGION = region
+    DA_API = AUTODESK_BASE_URL+"/da/{r}/v3".format(r=region)
+
+def regional_endpoint(url, region, headers=None):
+    '''Returns the url and headers that route a request to region, see REGION_ROUTES.<br>
+    Requests of US or unknown regions are returned unchanged'''
+    for prefix, regional, extra in REGION_ROUTES.get(region, ()):
+        if url.startswith(prefix):
+            if regional is not None:
+                url = regional+url[len(prefix):]
+            if extra:
+                headers = dict(headers or {}, **extra)
+            break
+    return url, headers
 
 def batch(iterable, n=1):
     l = len(iterable)
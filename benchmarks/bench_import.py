@@ -0,0 +1,48 @@
+'''Import time of the package, run from the repository root:
+
+    python benchmarks/bench_import.py [--runs 15]
+
+Each statement runs in a fresh interpreter, the median time is compared to its budget.
+Exits with 1 if a budget is exceeded'''
+
+import os
+import sys
+import argparse
+import statistics
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# (statement, budget in milliseconds)
+BUDGETS = [("import adeskForgeWrapper", 10),
+           ("import adeskForgeWrapper.tokenflex", 50),
+           ("import adeskForgeWrapper.realitycapture", 50),
+           ("import adeskForgeWrapper.b360, adeskForgeWrapper.datamgt, adeskForgeWrapper.sync", 80),
+           ("import adeskForgeWrapper.transport; adeskForgeWrapper.transport.Transport()", 400)]
+
+TIMER = "import time; _t = time.perf_counter(); {stmt}; print(time.perf_counter() - _t)"
+
+
+def measure(stmt, runs):
+    times = []
+    for _ in range(runs):
+        out = subprocess.check_output([sys.executable, "-c", TIMER.format(stmt=stmt)], cwd=ROOT)
+        times.append(float(out) * 1000)
+    return statistics.median(times)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=15)
+    args = parser.parse_args()
+
+    failed = False
+    for stmt, budget in BUDGETS:
+        ms = measure(stmt, args.runs)
+        over = ms > budget
+        failed = failed or over
+        print("{status} {ms:7.1f} ms (budget {b} ms)  {s}".format(
+            status="FAIL" if over else "ok  ", ms=ms, b=budget, s=stmt))
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,137 @@
+'''CPU time and allocations of a full hub crawl, replayed from a cassette with no network.
+
+    python benchmarks/bench_replay.py --record crawl.jsonl.gz           # against the mock
+    python benchmarks/bench_replay.py --record crawl.jsonl.gz --live    # against Forge, see below
+    python benchmarks/bench_replay.py crawl.jsonl.gz --save baseline.json
+    python benchmarks/bench_replay.py crawl.jsonl.gz --baseline baseline.json --tolerance 0.1
+
+--live reads the credentials from FORGE_CLIENT_ID, FORGE_CLIENT_SECRET and BIM_ACCOUNT_ID.
+The replay answers the same bytes every run, so the CPU time and allocations measured only
+depend on the wrapper version. With --baseline the run fails (exit 1) if either grew by
+more than tolerance'''
+
+import os
+import sys
+import json
+import argparse
+import statistics
+import tracemalloc
+
+from time import perf_counter
+from time import process_time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+import adeskForgeWrapper as afw
+from adeskForgeWrapper import cassette
+
+SCOPE = "data:read account:read"
+
+
+def crawl(client):
+    '''Every folder, item and version of every project of every hub, returns how many entities'''
+    token = afw.client.Token.get_2_legged_token(SCOPE, client)
+    count = 0
+    for hub in afw.datamgt.Hub.get_hubs(token):
+        for project in hub.get_projects(token):
+            folders = project.top_folders(token)
+            count += 1 + len(folders)
+            while folders:
+                folder = folders.pop()
+                for content in folder.get_contents(token, project.id):
+                    count += 1
+                    if isinstance(content, afw.datamgt.Folder):
+                        folders.append(content)
+                    elif isinstance(content, afw.datamgt.Item):
+                        count += len(content.get_versions(token))
+    return count
+
+def client_for(transport, live):
+    if live:
+        return afw.client.Client(os.environ["FORGE_CLIENT_ID"], os.environ["FORGE_CLIENT_SECRET"],
+                                 os.environ["BIM_ACCOUNT_ID"], "Live", transport=transport)
+    return afw.client.Client("mock-id", "mock-secret", "mock-account", "Mock", transport=transport)
+
+def record(path, live):
+    if os.path.exists(path):
+        os.remove(path)
+    if live:
+        transport = cassette.record_transport(path, retries=5)
+        return crawl(client_for(transport, True))
+    sys.path.insert(0, HERE)
+    from mockforge import MockForge
+    with MockForge(projects=3, depth=2, subfolders=3, items=5) as mock:
+        transport = cassette.record_transport(path, base_url=mock.base_url, retries=5)
+        return crawl(client_for(transport, False))
+
+def replay(path, runs):
+    transport = cassette.replay_transport(path)
+    client = client_for(transport, False)
+    crawl(client) # Warm the code paths
+
+    cpu, wall = [], []
+    for _ in range(runs):
+        transport = cassette.replay_transport(path)
+        client = client_for(transport, False)
+        wall_start, cpu_start = perf_counter(), process_time()
+        entities = crawl(client)
+        cpu.append(process_time() - cpu_start)
+        wall.append(perf_counter() - wall_start)
+
+    # Allocations on their own pass, tracemalloc slows everything down
+    transport = cassette.replay_transport(path)
+    client = client_for(transport, False)
+    tracemalloc.start()
+    crawl(client)
+    snapshot = tracemalloc.take_snapshot()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    blocks = sum(s.count for s in snapshot.statistics("filename"))
+
+    return {"entities": entities,
+            "cpu_ms": statistics.median(cpu) * 1000,
+            "wall_ms": statistics.median(wall) * 1000,
+            "peak_kib": peak / 1024.0,
+            "live_blocks": blocks}
+
+def compare(result, baseline, tolerance):
+    '''Returns the regressions as text lines'''
+    regressions = []
+    for key in ("cpu_ms", "peak_kib"):
+        if result[key] > baseline[key] * (1 + tolerance):
+            regressions.append("{k}: {v:.1f}, baseline {b:.1f}".format(k=key, v=result[key], b=baseline[key]))
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("cassette", nargs="?", default="crawl.jsonl.gz")
+    parser.add_argument("--record", action="store_true", help="Record the crawl to the cassette instead")
+    parser.add_argument("--live", action="store_true", help="Record against Forge rather than the mock")
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--save", help="Write the results to this JSON file")
+    parser.add_argument("--baseline", help="Compare with the results saved in this JSON file")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    if args.record:
+        entities = record(args.cassette, args.live)
+        print("Recorded a crawl of {n} entities to {p}".format(n=entities, p=args.cassette))
+        return 0
+
+    result = replay(args.cassette, args.runs)
+    print("{entities} entities, cpu {cpu_ms:.1f} ms, wall {wall_ms:.1f} ms, peak {peak_kib:.0f} KiB, "
+          "{live_blocks} live blocks".format(**result))
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(result, f, indent=1)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(result, json.load(f), args.tolerance)
+        for line in regressions:
+            print("REGRESSION", line)
+        return 1 if regressions else 0
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
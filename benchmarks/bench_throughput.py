@@ -0,0 +1,183 @@
+'''Throughput, latency and memory of the key wrapper operations against the local mock server.
+
+    python benchmarks/bench_throughput.py [--requests 200] [--concurrency 8] [--latency 0.02]
+    python benchmarks/bench_throughput.py --save baseline.json
+    python benchmarks/bench_throughput.py --baseline baseline.json --tolerance 0.2
+    python benchmarks/bench_throughput.py --concurrency 64 --save http1.json
+    python benchmarks/bench_throughput.py --concurrency 64 --http2 --baseline http1.json
+
+The mock runs in its own process so it doesn't compete with the client for the GIL.
+With --baseline the run fails (exit 1) if an operation got slower, its p99 grew or it
+allocates more than tolerance times the baseline. With --http2 both the mock and the
+transport speak HTTP/2, compare with an HTTP/1.1 run saved with the same settings'''
+
+import io
+import os
+import sys
+import json
+import argparse
+import itertools
+import statistics
+import subprocess
+import tracemalloc
+
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+import adeskForgeWrapper as afw
+
+UPLOAD = bytes(range(256))*64 # 16 KiB
+
+
+def operations(ctx):
+    '''{name: callable()}, ctx holds the token and the entities the calls start from'''
+    token = ctx["token"]
+    client = ctx["client"]
+    items = ctx["items"]
+    turn = itertools.count()
+    return {
+        "client.Token.get_2_legged_token": lambda: afw.client.Token.get_2_legged_token(ctx["scope"], client),
+        "b360.Project.get_projects": lambda: afw.b360.Project.get_projects(token),
+        "b360.User.users_from_account": lambda: afw.b360.User.users_from_account(token),
+        "datamgt.Hub.get_projects": lambda: ctx["hub"].get_projects(token),
+        "datamgt.Project.top_folders": lambda: ctx["project"].top_folders(token),
+        "datamgt.Folder.get_contents": lambda: ctx["folder"].get_contents(token, ctx["project"].id),
+        "datamgt.Folder.search": lambda: ctx["folder"].search(token),
+        "datamgt.Item.get_versions": lambda: ctx["item"].get_versions(token),
+        # A different item each call, concurrent calls are not coalesced into one request
+        "datamgt.Item.item_by_id": lambda: afw.datamgt.Item.item_by_id(token, *items[next(turn) % len(items)]),
+        "tokenflex.Contract.get_contracts": lambda: afw.tokenflex.Contract.get_contracts(token),
+        "designautomation.Engine.get_engines": lambda: afw.designautomation.Engine.get_engines(token),
+        # Storage, OSS upload and a new version of the same file each call
+        "datamgt.Folder.upload": lambda: ctx["upload_folder"].upload(token, ("bench.rvt", io.BytesIO(UPLOAD))),
+    }
+
+
+def start_mock(args):
+    cmd = [sys.executable, os.path.join(HERE, "mockforge.py"), "--port", "0", "--latency", str(args.latency),
+           "--throttle", str(args.throttle), "--retry-after", "0.05", "--page-limit", str(args.page_limit)]
+    if args.http2:
+        cmd.append("--http2")
+    # --port 0 lets the OS pick, the mock prints the url it got
+    process = subprocess.Popen(cmd, stdout=subprocess.PIPE, universal_newlines=True)
+    line = process.stdout.readline()
+    if not line.startswith("Mock Forge on "):
+        process.kill()
+        raise RuntimeError("The mock server did not start")
+    return process, line.split()[-1]
+
+def setup(base_url, concurrency, http2=False):
+    sink = afw.metrics.InMemorySink()
+    transport = afw.transport.Transport(pool_size=concurrency, base_url=base_url, retries=5, metrics=sink,
+                                        http2=http2)
+    client = afw.client.Client("mock-id", "mock-secret", "mock-account", "Mock", transport=transport)
+    scope = "data:read data:create data:write account:read code:all"
+    token = afw.client.Token.get_2_legged_token(scope, client)
+    hub = afw.datamgt.Hub.get_hubs(token)[0]
+    project = hub.get_projects(token)[0]
+    folder = project.top_folders(token)[0]
+    upload_folder = project.top_folders(token)[1].create_folder(token, "Bench uploads") # Not under folder
+    item = next(c for c in folder.get_contents(token, project.id) if isinstance(c, afw.datamgt.Item))
+    items = [(p.id, c.id) for p in hub.get_projects(token) for f in p.top_folders(token)
+             for c in f.get_contents(token, p.id) if isinstance(c, afw.datamgt.Item)]
+    return sink, {"client": client, "token": token, "scope": scope, "hub": hub,
+                  "project": project, "folder": folder, "item": item, "items": items,
+                  "upload_folder": upload_folder}
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(int(round(p / 100.0 * (len(values) - 1))), len(values) - 1)]
+
+def run(name, func, sink, requests, concurrency):
+    for _ in range(min(5, requests)): # Warm the connections and the code paths
+        func()
+
+    def timed(_):
+        start = perf_counter()
+        func()
+        return perf_counter() - start
+
+    sink.reset()
+    start = perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        latencies = list(pool.map(timed, range(requests)))
+    wall = perf_counter() - start
+    http = sum(s["calls"] for s in sink.snapshot().values())
+
+    # Memory on its own pass, tracemalloc slows everything down
+    tracemalloc.start()
+    for _ in range(5):
+        func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {"ops_per_sec": requests / wall,
+            "http_per_sec": http / wall,
+            "p50_ms": statistics.median(latencies) * 1000,
+            "p99_ms": percentile(latencies, 99) * 1000,
+            "peak_kib": peak / 1024.0}
+
+def compare(results, baseline, tolerance):
+    '''Returns the regressions as text lines'''
+    regressions = []
+    for name, r in results.items():
+        b = baseline.get(name, None)
+        if b is None:
+            continue
+        if r["ops_per_sec"] < b["ops_per_sec"] * (1 - tolerance):
+            regressions.append("{n}: {v:.1f} ops/s, baseline {b:.1f}".format(n=name, v=r["ops_per_sec"], b=b["ops_per_sec"]))
+        if r["p99_ms"] > b["p99_ms"] * (1 + tolerance):
+            regressions.append("{n}: p99 {v:.1f} ms, baseline {b:.1f}".format(n=name, v=r["p99_ms"], b=b["p99_ms"]))
+        if r["peak_kib"] > b["peak_kib"] * (1 + tolerance):
+            regressions.append("{n}: peak {v:.0f} KiB, baseline {b:.0f}".format(n=name, v=r["peak_kib"], b=b["peak_kib"]))
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=200, help="Calls per operation")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds the mock adds to each response")
+    parser.add_argument("--throttle", type=float, default=0.0, help="Fraction of requests the mock answers with a 429")
+    parser.add_argument("--page-limit", type=int, default=10, help="Page size of the mock listings")
+    parser.add_argument("--only", help="Comma separated operations to run")
+    parser.add_argument("--http2", action="store_true", help="HTTP/2 transport and mock, needs httpx[http2]")
+    parser.add_argument("--save", help="Write the results to this JSON file")
+    parser.add_argument("--baseline", help="Compare with the results saved in this JSON file")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    process, base_url = start_mock(args)
+    try:
+        sink, ctx = setup(base_url, args.concurrency, args.http2)
+        ops = operations(ctx)
+        if args.only:
+            ops = {k: v for k, v in ops.items() if k in args.only.split(",")}
+
+        results = {}
+        print("{:<40} {:>10} {:>10} {:>9} {:>9} {:>10}".format("operation", "ops/s", "http/s", "p50 ms", "p99 ms", "peak KiB"))
+        for name, func in ops.items():
+            r = results[name] = run(name, func, sink, args.requests, args.concurrency)
+            print("{:<40} {:>10.1f} {:>10.1f} {:>9.2f} {:>9.2f} {:>10.0f}".format(
+                name, r["ops_per_sec"], r["http_per_sec"], r["p50_ms"], r["p99_ms"], r["peak_kib"]))
+        stats = ctx["client"].transport.get(base_url+"/mock/stats").json()
+        print("{r} requests over {c} connections".format(r=stats["requests"], c=stats["connections"]))
+    finally:
+        process.kill()
+        process.wait()
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=1)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for line in regressions:
+            print("REGRESSION", line)
+        return 1 if regressions else 0
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
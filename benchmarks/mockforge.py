@@ -0,0 +1,870 @@
+'''Local stand-in for the Forge APIs the wrapper calls, for benchmarks and offline runs.
+
+    python benchmarks/mockforge.py --port 8000 --latency 0.05 --throttle 0.01
+
+Point a transport at it with transport.Transport(base_url="http://127.0.0.1:8000").
+The data is generated from the settings, the same settings always serve the same data.
+Served: authentication/v1, hq/v1 (and v2 industry roles), bim360/admin/v1, project/v1,
+data/v1, oss/v2, da/v3, photo-to-3d/v1 and tokenflex/v1. Listings are paged like the real ones,
+GET responses carry an ETag and answer If-None-Match with a 304. Folders, storages, items and
+versions created through data/v1 and the objects uploaded to oss/v2 (in one PUT or resumable)
+are kept in memory and show up in the listings. With --http2 it speaks
+HTTP/2 (cleartext, prior knowledge). GET /mock/stats returns the requests, 429s and
+connections served so far'''
+
+import re
+import json
+import time
+import socket
+import random
+import hashlib
+import argparse
+import threading
+import email.message
+import urllib.parse
+
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+
+DATE = "2021-03-01T12:00:00.000Z"
+ROUTES = []
+
+
+def route(method, pattern):
+    '''Registers a handler for method and a path regex, region prefixes are accepted'''
+    def decorator(func):
+        ROUTES.append((method, re.compile("^"+pattern+"$"), func))
+        return func
+    return decorator
+
+
+class MockForge(object):
+    '''The mock server, as a context manager it runs in a background thread.<br>
+    latency - Seconds added to every response<br>
+    jitter - Up to this many seconds more, at random<br>
+    throttle_rate - Fraction of the requests answered with a 429<br>
+    retry_after - Retry-After of the 429 responses, in seconds<br>
+    page_limit - Default page size of the paged listings<br>
+    projects, subfolders, depth, items, versions - Size of the project trees: each project has
+    two top folders, each folder has subfolders folders down to depth levels and items files
+    with versions versions each<br>
+    users, companies, contracts, engines - Size of the other listings<br>
+    http2 - Speak HTTP/2 instead (cleartext, prior knowledge), for transport.Transport(http2=True)'''
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, jitter=0.0, throttle_rate=0.0, retry_after=1,
+                 page_limit=50, account_id="mock-account", projects=10, subfolders=3, depth=2, items=20,
+                 versions=3, users=100, companies=20, contracts=3, engines=30, seed=0, http2=False):
+        self.latency = latency
+        self.jitter = jitter
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.page_limit = page_limit
+        self.account_id = account_id
+        self.projects = projects
+        self.subfolders = subfolders
+        self.depth = depth
+        self.items = items
+        self.versions = versions
+        self.users = users
+        self.companies = companies
+        self.contracts = contracts
+        self.engines = engines
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.throttled = 0
+        self.connections = 0
+        self.scenes = {}
+        # Entities created by the requests, on top of the generated ones
+        self.created = {} # folder id: [raw folders and items created in it]
+        self.created_folders = {} # folder id: raw
+        self.created_items = {} # item id: raw
+        self.added_versions = {} # item id: [raw versions past the generated ones]
+        self.objects = {} # (bucket, object name): bytes
+        self.sessions = {} # (bucket, object name, session id): {first byte: chunk}
+        self._next_id = 0
+
+        server = self
+        class Handler(_Handler):
+            mock = server
+        if http2:
+            self.httpd = _H2Server(self, (host, port))
+        else:
+            self.httpd = ThreadingHTTPServer((host, port), Handler)
+            self.httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return "http://{h}:{p}".format(h=host, p=port)
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self.base_url
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _connected(self):
+        with self._lock:
+            self.connections += 1
+
+    def _delay(self):
+        with self._lock:
+            self.requests += 1
+            throttled = self._random.random() < self.throttle_rate
+            if throttled:
+                self.throttled += 1
+            jitter = self._random.uniform(0, self.jitter) if self.jitter else 0
+        if self.latency or jitter:
+            time.sleep(self.latency + jitter)
+        return throttled
+
+    def new_id(self):
+        with self._lock:
+            self._next_id += 1
+            return self._next_id
+
+    # Generated data, ids carry the position of each entity so nothing has to be stored
+
+    def hub(self):
+        return {"type": "hubs", "id": "b."+self.account_id,
+                "attributes": {"name": "Mock Hub", "region": "US",
+                               "extension": {"type": "hubs:autodesk.bim360:Account", "version": "1.0"}}}
+
+    def dm_project(self, n):
+        return {"type": "projects", "id": "b.p{n}".format(n=n),
+                "attributes": {"name": "Project {n}".format(n=n),
+                               "extension": {"type": "projects:autodesk.bim360:Project", "version": "1.0"}},
+                "relationships": {"hub": {"data": {"type": "hubs", "id": "b."+self.account_id}}}}
+
+    def hq_project(self, n):
+        return {"id": "p{n}".format(n=n), "account_id": self.account_id, "name": "Project {n}".format(n=n),
+                "start_date": "2021-01-01", "end_date": "2022-01-01", "project_type": "Office",
+                "value": 1000000, "currency": "USD", "status": "active", "job_number": str(n),
+                "address_line_1": "1 Main St", "city": "Springfield", "country": "United States",
+                "language": "en", "construction_type": "New Construction", "contract_type": "Design-Bid",
+                "business_unit_id": None, "service_types": "doc_manager", "created_at": DATE, "updated_at": DATE}
+
+    def folder(self, project, path):
+        '''path is a tuple of indexes from the top folder'''
+        fid = self.folder_id(project, path)
+        parent = None if len(path) == 1 else self.folder_id(project, path[:-1])
+        name = ("Project Files", "Plans")[path[0]] if len(path) == 1 else "Folder {i}".format(i=path[-1])
+        raw = {"type": "folders", "id": fid,
+               "attributes": {"name": name, "displayName": name, "createTime": DATE, "createUserId": "U1",
+                              "createUserName": "Mock User", "lastModifiedTime": DATE,
+                              "lastModifiedUserId": "U1", "lastModifiedUserName": "Mock User",
+                              "objectCount": self.subfolders + self.items if len(path) <= self.depth else self.items,
+                              "hidden": False,
+                              "extension": {"type": "folders:autodesk.bim360:Folder", "version": "1.0"}},
+               "relationships": {}}
+        if parent is not None:
+            raw["relationships"]["parent"] = {"data": {"type": "folders", "id": parent}}
+        return raw
+
+    def folder_id(self, project, path):
+        return "urn:adsk.wipprod:fs.folder:co.{p}.{path}".format(p=project, path="-".join(map(str, path)))
+
+    @staticmethod
+    def parse_folder(fid):
+        m = re.match(r"urn:adsk\.wipprod:fs\.folder:co\.(b\.p\d+)\.([\d-]+)$", fid)
+        if m is None:
+            return None
+        return m.group(1), tuple(int(i) for i in m.group(2).split("-"))
+
+    def item(self, project, path, k):
+        iid = "urn:adsk.wipprod:dm.lineage:{p}.{path}.i{k}".format(p=project, path="-".join(map(str, path)), k=k)
+        name = "File {k}.rvt".format(k=k)
+        added = self.added_versions.get(iid, None)
+        tip = added[-1]["id"] if added else self.version_id(iid, self.versions)
+        return {"type": "items", "id": iid,
+                "attributes": {"displayName": name, "createTime": DATE, "createUserId": "U1",
+                               "createUserName": "Mock User", "lastModifiedTime": DATE,
+                               "lastModifiedUserId": "U1", "lastModifiedUserName": "Mock User", "hidden": False,
+                               "extension": {"type": "items:autodesk.bim360:File", "version": "1.0"}},
+                "relationships": {"tip": {"data": {"type": "versions", "id": tip}},
+                                  "parent": {"data": {"type": "folders", "id": self.folder_id(project, path)}}}}
+
+    @staticmethod
+    def parse_item(iid):
+        m = re.match(r"urn:adsk\.wipprod:dm\.lineage:(b\.p\d+)\.([\d-]+)\.i(\d+)$", iid)
+        if m is None:
+            return None
+        return m.group(1), tuple(int(i) for i in m.group(2).split("-")), int(m.group(3))
+
+    @staticmethod
+    def version_id(iid, v):
+        return iid.replace("dm.lineage", "fs.file:vf")+"?version={v}".format(v=v)
+
+    def version(self, iid, v):
+        k = int(iid.rsplit(".i", 1)[1])
+        size = 1024*(k+1)*v
+        object_name = "{h}-{s}".format(h=hashlib.md5("{i}{v}".format(i=iid, v=v).encode("utf-8")).hexdigest(), s=size)
+        return {"type": "versions", "id": self.version_id(iid, v),
+                "attributes": {"name": "File {k}.rvt".format(k=k), "displayName": "File {k}.rvt".format(k=k),
+                               "createTime": DATE, "createUserId": "U1", "createUserName": "Mock User",
+                               "lastModifiedTime": DATE, "lastModifiedUserId": "U1",
+                               "lastModifiedUserName": "Mock User", "versionNumber": v,
+                               "mimeType": "application/vnd.autodesk.r360", "storageSize": size,
+                               "fileType": "rvt",
+                               "extension": {"type": "versions:autodesk.bim360:File", "version": "1.0"}},
+                "relationships": {"item": {"data": {"type": "items", "id": iid}},
+                                  "storage": {"data": {"type": "objects",
+                                                       "id": "urn:adsk.objects:os.object:wip.dm.prod/{o}.rvt".format(o=object_name)}}}}
+
+    def contents(self, project, path):
+        folders = [self.folder(project, path+(i,)) for i in range(self.subfolders)] if len(path) <= self.depth else []
+        return folders + [self.item(project, path, k) for k in range(self.items)]
+
+    def object_data(self, bucket, name):
+        '''Bytes of an object, the ones of generated versions are storageSize bytes long'''
+        data = self.objects.get((bucket, name), None)
+        m = re.match(r"[0-9a-f]{32}-(\d+)\.rvt$", name)
+        if data is None and m is not None:
+            size = int(m.group(1))
+            data = (hashlib.md5(name.encode("utf-8")).digest()*(size//16+1))[:size]
+        return data
+
+    def created_folder(self, project, parent, name):
+        fid = "urn:adsk.wipprod:fs.folder:co.{p}.n{n}".format(p=project, n=self.new_id())
+        raw = {"type": "folders", "id": fid,
+               "attributes": {"name": name, "displayName": name, "createTime": DATE, "createUserId": "U1",
+                              "createUserName": "Mock User", "lastModifiedTime": DATE,
+                              "lastModifiedUserId": "U1", "lastModifiedUserName": "Mock User",
+                              "objectCount": 0, "hidden": False,
+                              "extension": {"type": "folders:autodesk.bim360:Folder", "version": "1.0"}},
+               "relationships": {"parent": {"data": {"type": "folders", "id": parent}}}}
+        with self._lock:
+            self.created_folders[fid] = raw
+            self.created.setdefault(parent, []).append(raw)
+        return raw
+
+    def created_version(self, iid, name, storage_id, number):
+        bucket, object_name = storage_id.split(":")[-1].split("/", 1)
+        return {"type": "versions", "id": self.version_id(iid, number),
+                "attributes": {"name": name, "displayName": name, "createTime": DATE, "createUserId": "U1",
+                               "createUserName": "Mock User", "lastModifiedTime": DATE, "lastModifiedUserId": "U1",
+                               "lastModifiedUserName": "Mock User", "versionNumber": number,
+                               "storageSize": len(self.objects.get((bucket, object_name), b"")),
+                               "fileType": name.rsplit(".", 1)[-1],
+                               "extension": {"type": "versions:autodesk.bim360:File", "version": "1.0"}},
+                "relationships": {"item": {"data": {"type": "items", "id": iid}},
+                                  "storage": {"data": {"type": "objects", "id": storage_id}}}}
+
+    def versions_of(self, iid):
+        '''All the versions of an item, the latest first'''
+        generated = [] if iid in self.created_items else [self.version(iid, v) for v in range(1, self.versions+1)]
+        return list(reversed(generated + self.added_versions.get(iid, [])))
+
+    def user(self, n):
+        return {"id": "u{n}".format(n=n), "account_id": self.account_id, "email": "user{n}@example.com".format(n=n),
+                "name": "User {n}".format(n=n), "first_name": "User", "last_name": str(n),
+                "uid": "U{n}".format(n=n), "role": "project_user", "status": "active", "company_id": "c{c}".format(c=n % max(self.companies, 1)),
+                "company_name": "Company {c}".format(c=n % max(self.companies, 1)), "default_role": "Architect",
+                "created_at": DATE, "updated_at": DATE}
+
+    def company(self, n):
+        return {"id": "c{n}".format(n=n), "account_id": self.account_id, "name": "Company {n}".format(n=n),
+                "trade": "Architecture", "city": "Springfield", "country": "United States",
+                "erp_id": None, "tax_id": None, "created_at": DATE, "updated_at": DATE}
+
+    def contract(self, n):
+        return {"contractNumber": "11000{n}".format(n=n), "contractName": "Contract {n}".format(n=n),
+                "contractStartDate": "2021-01-01", "contractEndDate": "2023-12-31",
+                "multiyearProvisionedTokens": 10000, "contractYears": [], "isActive": True}
+
+    def engine(self, n):
+        products = ("AutoCAD", "Inventor", "Revit", "3dsMax")
+        product = products[n % len(products)]
+        return {"id": "Autodesk.{p}+{v}".format(p=product, v=20+n), "productVersion": str(2000+n),
+                "description": "{p} engine".format(p=product), "version": n}
+
+
+def _page(data, query, limit_key, number_key=None, offset_key=None, default_limit=50):
+    '''Returns the requested page of data and whether there are more'''
+    limit = int(query.get(limit_key, [default_limit])[0])
+    if number_key is not None:
+        start = int(query.get(number_key, [0])[0]) * limit
+    else:
+        start = int(query.get(offset_key, [0])[0])
+    return data[start:start+limit], start + limit < len(data)
+
+
+def _json_api_page(handler, data, query, included=None):
+    page, more = _page(data, query, "page[limit]", number_key="page[number]", default_limit=handler.mock.page_limit)
+    body = {"jsonapi": {"version": "1.0"}, "links": {"self": {"href": handler.url()}}, "data": page}
+    if included is not None:
+        ids = {_tip(d) for d in page}
+        body["included"] = [v for v in included if v["id"] in ids]
+    if more:
+        next_query = dict(query)
+        next_query["page[number]"] = [str(int(query.get("page[number]", [0])[0]) + 1)]
+        next_query.setdefault("page[limit]", [str(handler.mock.page_limit)])
+        body["links"]["next"] = {"href": handler.url(query=next_query)}
+    return body
+
+def _tip(raw):
+    return raw.get("relationships", {}).get("tip", {}).get("data", {}).get("id", None)
+
+def _hq_list(handler, data, query):
+    '''hq lists are plain arrays, paged with limit and offset only when asked to'''
+    if "limit" not in query and "offset" not in query:
+        return data
+    return _page(data, query, "limit", offset_key="offset", default_limit=10)[0]
+
+
+class _Request(object):
+    '''What the routes see of a request: path, headers, the mock and url()'''
+    mock = None
+
+    def url(self, query=None):
+        '''Absolute url of this request, with another query if given'''
+        parsed = urllib.parse.urlsplit(self.path)
+        q = parsed.query if query is None else urllib.parse.urlencode(query, doseq=True)
+        return "http://{h}{p}{q}".format(h=self.headers.get("Host"), p=parsed.path, q="?"+q if q else "")
+
+    def respond(self, command, body):
+        '''Runs the route of the request, returns (status, headers, data)'''
+        if self.mock._delay():
+            return self._encode(command, 429, {"developerMessage": "Too many requests", "errorCode": "AUTH-012"},
+                                {"Retry-After": str(self.mock.retry_after)})
+        parsed = urllib.parse.urlsplit(self.path)
+        path = re.sub(r"/regions/eu/", "/", parsed.path)
+        query = urllib.parse.parse_qs(parsed.query)
+        method = "GET" if command == "HEAD" else command
+        for m, pattern, func in ROUTES:
+            match = pattern.match(path) if m == method else None
+            if match is not None:
+                args = [urllib.parse.unquote(g) for g in match.groups()]
+                result = func(self, query, body, *args)
+                if not isinstance(result, tuple):
+                    result = (200, result)
+                return self._encode(command, *result) # status, payload and maybe headers
+        return self._encode(command, 404, {"developerMessage": "No mock for {m} {p}".format(m=command, p=parsed.path),
+                                           "errorCode": "MOCK-404"})
+
+    def _encode(self, command, status, body, headers=None):
+        binary = isinstance(body, bytes) # OSS objects
+        data = body if binary else b"" if body is None else json.dumps(body).encode("utf-8")
+        headers = dict(headers or {})
+        if command == "GET" and status == 200:
+            etag = '"{h}"'.format(h=hashlib.md5(data).hexdigest())
+            headers["ETag"] = etag
+            if self.headers.get("If-None-Match", None) == etag:
+                status, data = 304, b""
+        if binary:
+            headers["Content-Type"] = "application/octet-stream"
+        elif data:
+            headers["Content-Type"] = "application/vnd.api+json" if b'"jsonapi"' in data[:40] else "application/json"
+        headers["Content-Length"] = str(len(data))
+        return status, headers, data if command != "HEAD" else b""
+
+
+class _Handler(_Request, BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True # Headers and body are written apart, don't wait for the ACK of the first
+
+    def log_message(self, format, *args):
+        pass
+
+    def setup(self):
+        super().setup()
+        self.mock._connected()
+
+    def _body(self):
+        length = int(self.headers.get("Content-Length", 0) or 0)
+        return self.rfile.read(length) if length else b""
+
+    def _dispatch(self):
+        status, headers, data = self.respond(self.command, self._body())
+        self.send_response(status)
+        for k, v in headers.items():
+            self.send_header(k, v)
+        self.end_headers()
+        if data:
+            self.wfile.write(data)
+
+    do_GET = do_POST = do_PUT = do_PATCH = do_DELETE = do_HEAD = _dispatch
+
+
+class _H2Request(_Request):
+    def __init__(self, mock, headers):
+        self.mock = mock
+        self.headers = email.message.Message() # Case insensitive get()
+        for k, v in headers:
+            if k.startswith(":"):
+                continue
+            self.headers[k] = v
+        pseudo = dict(headers)
+        self.headers["Host"] = pseudo[":authority"]
+        self.command = pseudo[":method"]
+        self.path = pseudo[":path"]
+
+
+class _H2Server(object):
+    '''Serves the mock over HTTP/2 without TLS (prior knowledge), a thread per request so
+    the streams of a connection are answered concurrently. Needs h2, pip install h2'''
+    def __init__(self, mock, address):
+        self.mock = mock
+        self.socket = socket.create_server(address)
+        self.server_address = self.socket.getsockname()
+        self._closed = False
+
+    def serve_forever(self):
+        while not self._closed:
+            try:
+                sock, _ = self.socket.accept()
+            except OSError:
+                break
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self.mock._connected()
+            threading.Thread(target=self._connection, args=(sock,), daemon=True).start()
+
+    def shutdown(self):
+        self._closed = True
+
+    def server_close(self):
+        self._closed = True
+        self.socket.close()
+
+    def _connection(self, sock):
+        import h2.config
+        import h2.events
+        import h2.errors
+        import h2.exceptions
+        import h2.connection
+
+        conn = h2.connection.H2Connection(h2.config.H2Configuration(client_side=False, header_encoding="utf-8"))
+        lock = threading.Condition()
+        conn.initiate_connection()
+        sock.sendall(conn.data_to_send())
+        streams = {}
+        closed = False
+
+        def answer(stream_id, headers, body):
+            request = _H2Request(self.mock, headers)
+            status, response_headers, data = request.respond(request.command, bytes(body))
+            with lock:
+                try:
+                    conn.send_headers(stream_id, [(":status", str(status))] +
+                                      [(k.lower(), v) for k, v in response_headers.items()], end_stream=not data)
+                    sock.sendall(conn.data_to_send())
+                    while data and not closed:
+                        window = min(conn.local_flow_control_window(stream_id), conn.max_outbound_frame_size)
+                        if window <= 0:
+                            lock.wait() # For a WINDOW_UPDATE
+                            continue
+                        chunk, data = data[:window], data[window:]
+                        conn.send_data(stream_id, chunk, end_stream=not data)
+                        sock.sendall(conn.data_to_send())
+                except (h2.exceptions.H2Error, OSError):
+                    pass # The client reset the stream or the connection is gone
+
+        try:
+            while True:
+                received = sock.recv(65536)
+                if not received:
+                    break
+                with lock:
+                    for event in conn.receive_data(received):
+                        if isinstance(event, h2.events.RequestReceived):
+                            streams[event.stream_id] = (event.headers, bytearray())
+                        elif isinstance(event, h2.events.DataReceived):
+                            streams[event.stream_id][1].extend(event.data)
+                            conn.acknowledge_received_data(event.flow_controlled_length, event.stream_id)
+                        elif isinstance(event, h2.events.StreamEnded):
+                            headers, body = streams.pop(event.stream_id)
+                            threading.Thread(target=answer, args=(event.stream_id, headers, body), daemon=True).start()
+                        elif isinstance(event, (h2.events.WindowUpdated, h2.events.RemoteSettingsChanged)):
+                            lock.notify_all()
+                        elif isinstance(event, h2.events.ConnectionTerminated):
+                            return
+                    sock.sendall(conn.data_to_send())
+        except h2.exceptions.ProtocolError:
+            with lock:
+                conn.close_connection(h2.errors.ErrorCodes.PROTOCOL_ERROR)
+                try:
+                    sock.sendall(conn.data_to_send())
+                except OSError:
+                    pass
+        except OSError:
+            pass
+        finally:
+            with lock:
+                closed = True
+                lock.notify_all()
+            sock.close()
+
+
+@route("GET", r"/mock/stats")
+def _mock_stats(h, query, body):
+    return {"requests": h.mock.requests, "throttled": h.mock.throttled, "connections": h.mock.connections}
+
+def _not_found(what):
+    return 404, {"jsonapi": {"version": "1.0"}, "errors": [{"status": "404", "code": "NOT_FOUND", "detail": what}]}
+
+# Authentication
+
+@route("POST", r"/authentication/v1/(authenticate|gettoken|refreshtoken)")
+def _token(h, query, body, grant):
+    form = urllib.parse.parse_qs(body.decode("utf-8"))
+    raw = {"access_token": hashlib.sha1(body + str(time.time()).encode("utf-8")).hexdigest(),
+           "token_type": "Bearer", "expires_in": 3599}
+    if grant != "authenticate":
+        raw["refresh_token"] = hashlib.sha1(raw["access_token"].encode("utf-8")).hexdigest()
+    if "scope" in form:
+        raw["scope"] = form["scope"][0]
+    return raw
+
+@route("GET", r"/userprofile/v1/users/@me")
+def _me(h, query, body):
+    return {"userId": "U1", "userName": "mock", "emailId": "mock@example.com", "firstName": "Mock", "lastName": "User"}
+
+# BIM 360 hq and admin
+
+@route("GET", r"/hq/v1/accounts/([^/]+)/projects")
+def _hq_projects(h, query, body, account):
+    return _hq_list(h, [h.mock.hq_project(n) for n in range(h.mock.projects)], query)
+
+@route("GET", r"/hq/v1/accounts/([^/]+)/projects/p(\d+)")
+def _hq_project(h, query, body, account, n):
+    return h.mock.hq_project(int(n)) if int(n) < h.mock.projects else (404, {"code": 1004, "message": "Project not found"})
+
+@route("GET", r"/hq/v1/accounts/([^/]+)/users")
+def _hq_users(h, query, body, account):
+    return _hq_list(h, [h.mock.user(n) for n in range(h.mock.users)], query)
+
+@route("GET", r"/hq/v1/accounts/([^/]+)/users/u(\d+)")
+def _hq_user(h, query, body, account, n):
+    return h.mock.user(int(n))
+
+@route("GET", r"/hq/v1/accounts/([^/]+)/companies")
+def _hq_companies(h, query, body, account):
+    return _hq_list(h, [h.mock.company(n) for n in range(h.mock.companies)], query)
+
+@route("GET", r"/hq/v1/accounts/([^/]+)/companies/c(\d+)")
+def _hq_company(h, query, body, account, n):
+    return h.mock.company(int(n))
+
+@route("GET", r"/hq/v1/accounts/([^/]+)/business_units_structure")
+def _hq_business_units(h, query, body, account):
+    return {"business_units": [{"id": "bu{n}".format(n=n), "parent_id": None, "name": "Unit {n}".format(n=n),
+                                "description": "", "created_at": DATE, "updated_at": DATE} for n in range(3)]}
+
+@route("GET", r"/hq/v2/accounts/([^/]+)/projects/([^/]+)/industry_roles")
+def _hq_industry_roles(h, query, body, account, project):
+    return [{"id": "r{n}".format(n=n), "project_id": project, "name": role, "services": {}, "member_group_id": str(n),
+             "created_at": DATE, "updated_at": DATE} for n, role in enumerate(("Architect", "Engineer", "Owner"))]
+
+@route("GET", r"/bim360/admin/v1/projects/([^/]+)/users")
+def _admin_users(h, query, body, project):
+    users = [h.mock.user(n) for n in range(h.mock.users)]
+    page, _ = _page(users, query, "limit", offset_key="offset", default_limit=20)
+    offset = int(query.get("offset", [0])[0])
+    return {"pagination": {"limit": len(page), "offset": offset, "totalResults": len(users)}, "results": page}
+
+# Data Management
+
+@route("GET", r"/project/v1/hubs")
+def _hubs(h, query, body):
+    return _json_api_page(h, [h.mock.hub()], query)
+
+@route("GET", r"/project/v1/hubs/([^/]+)")
+def _hub(h, query, body, hub):
+    return {"jsonapi": {"version": "1.0"}, "data": dict(h.mock.hub(), id=hub)}
+
+@route("GET", r"/project/v1/hubs/([^/]+)/projects")
+def _dm_projects(h, query, body, hub):
+    return _json_api_page(h, [h.mock.dm_project(n) for n in range(h.mock.projects)], query)
+
+@route("GET", r"/project/v1/hubs/([^/]+)/projects/b\.p(\d+)")
+def _dm_project(h, query, body, hub, n):
+    return {"jsonapi": {"version": "1.0"}, "data": h.mock.dm_project(int(n))}
+
+@route("GET", r"/project/v1/hubs/([^/]+)/projects/([^/]+)/topFolders")
+def _top_folders(h, query, body, hub, project):
+    return {"jsonapi": {"version": "1.0"}, "data": [h.mock.folder(project, (i,)) for i in range(2)]}
+
+@route("GET", r"/data/v1/projects/([^/]+)/folders/([^/]+)")
+def _folder(h, query, body, project, fid):
+    parsed = h.mock.parse_folder(fid)
+    raw = h.mock.folder(*parsed) if parsed else h.mock.created_folders.get(fid, None)
+    return {"jsonapi": {"version": "1.0"}, "data": raw} if raw else _not_found(fid)
+
+@route("GET", r"/data/v1/projects/([^/]+)/folders/([^/]+)/contents")
+def _contents(h, query, body, project, fid):
+    parsed = h.mock.parse_folder(fid)
+    if parsed is None and fid not in h.mock.created_folders:
+        return _not_found(fid)
+    data = (h.mock.contents(*parsed) if parsed else []) + list(h.mock.created.get(fid, []))
+    wanted = query.get("filter[type]", None)
+    if wanted is not None:
+        types = wanted[0].split(",")
+        data = [d for d in data if d["type"] in types]
+    tips = [h.mock.versions_of(d["id"])[0] for d in data if d["type"] == "items"]
+    return _json_api_page(h, data, query, tips)
+
+@route("GET", r"/data/v1/projects/([^/]+)/folders/([^/]+)/search")
+def _search(h, query, body, project, fid):
+    parsed = h.mock.parse_folder(fid)
+    if parsed is None:
+        return _not_found(fid)
+    found = []
+    pending = [parsed[1]]
+    while pending:
+        path = pending.pop()
+        found.extend(h.mock.version(h.mock.item(project, path, k)["id"], h.mock.versions) for k in range(h.mock.items))
+        if len(path) <= h.mock.depth:
+            pending.extend(path+(i,) for i in range(h.mock.subfolders))
+    contains = query.get("filter[displayName]-contains", None)
+    if contains is not None:
+        found = [v for v in found if contains[0] in v["attributes"]["displayName"]]
+    return _json_api_page(h, found, query)
+
+@route("GET", r"/data/v1/projects/([^/]+)/items/([^/]+)")
+def _item(h, query, body, project, iid):
+    parsed = h.mock.parse_item(iid)
+    raw = h.mock.item(*parsed) if parsed else h.mock.created_items.get(iid, None)
+    if raw is None:
+        return _not_found(iid)
+    return {"jsonapi": {"version": "1.0"}, "data": raw, "included": h.mock.versions_of(iid)[:1]}
+
+@route("GET", r"/data/v1/projects/([^/]+)/items/([^/]+)/tip")
+def _item_tip(h, query, body, project, iid):
+    return {"jsonapi": {"version": "1.0"}, "data": h.mock.versions_of(iid)[0]}
+
+@route("GET", r"/data/v1/projects/([^/]+)/items/([^/]+)/versions")
+def _item_versions(h, query, body, project, iid):
+    return _json_api_page(h, h.mock.versions_of(iid), query)
+
+@route("POST", r"/data/v1/projects/([^/]+)/folders")
+def _create_folder(h, query, body, project):
+    data = json.loads(body)["data"]
+    parent = data["relationships"]["parent"]["data"]["id"]
+    return 201, {"jsonapi": {"version": "1.0"}, "data": h.mock.created_folder(project, parent, data["attributes"]["name"])}
+
+@route("POST", r"/data/v1/projects/([^/]+)/storage")
+def _create_storage(h, query, body, project):
+    name = json.loads(body)["data"]["attributes"]["name"]
+    object_name = "{n}.{e}".format(n=hashlib.md5("{i}{n}".format(i=h.mock.new_id(), n=name).encode("utf-8")).hexdigest(),
+                                   e=name.rsplit(".", 1)[-1])
+    return 201, {"jsonapi": {"version": "1.0"},
+                 "data": {"type": "objects", "id": "urn:adsk.objects:os.object:wip.dm.prod/"+object_name}}
+
+@route("POST", r"/data/v1/projects/([^/]+)/items")
+def _create_item(h, query, body, project):
+    request = json.loads(body)
+    data = request["data"]
+    parent = data["relationships"]["parent"]["data"]["id"]
+    name = data["attributes"]["displayName"]
+    storage_id = request["included"][0]["relationships"]["storage"]["data"]["id"]
+    iid = "urn:adsk.wipprod:dm.lineage:{p}.n{n}".format(p=project, n=h.mock.new_id())
+    version = h.mock.created_version(iid, name, storage_id, 1)
+    raw = {"type": "items", "id": iid,
+           "attributes": {"displayName": name, "createTime": DATE, "createUserId": "U1",
+                          "createUserName": "Mock User", "lastModifiedTime": DATE,
+                          "lastModifiedUserId": "U1", "lastModifiedUserName": "Mock User", "hidden": False,
+                          "extension": data["attributes"]["extension"]},
+           "relationships": {"tip": {"data": {"type": "versions", "id": version["id"]}},
+                             "parent": {"data": {"type": "folders", "id": parent}}}}
+    with h.mock._lock:
+        h.mock.created_items[iid] = raw
+        h.mock.added_versions[iid] = [version]
+        h.mock.created.setdefault(parent, []).append(raw)
+    return 201, {"jsonapi": {"version": "1.0"}, "data": raw, "included": [version]}
+
+@route("POST", r"/data/v1/projects/([^/]+)/versions")
+def _create_version(h, query, body, project):
+    data = json.loads(body)["data"]
+    iid = data["relationships"]["item"]["data"]["id"]
+    if h.mock.parse_item(iid) is None and iid not in h.mock.created_items:
+        return _not_found(iid)
+    storage_id = data["relationships"]["storage"]["data"]["id"]
+    with h.mock._lock:
+        number = len(h.mock.versions_of(iid)) + 1
+        version = h.mock.created_version(iid, data["attributes"]["name"], storage_id, number)
+        h.mock.added_versions.setdefault(iid, []).append(version)
+        raw = h.mock.created_items.get(iid, None)
+        if raw is not None:
+            raw["relationships"]["tip"]["data"]["id"] = version["id"]
+    return 201, {"jsonapi": {"version": "1.0"}, "data": version}
+
+# OSS
+
+def _object_details(bucket, name, data):
+    return {"bucketKey": bucket, "objectId": "urn:adsk.objects:os.object:{b}/{n}".format(b=bucket, n=name),
+            "objectKey": name, "sha1": hashlib.sha1(data).hexdigest(), "size": len(data),
+            "contentType": "application/octet-stream",
+            "location": "https://developer.api.autodesk.com/oss/v2/buckets/{b}/objects/{n}".format(b=bucket, n=name)}
+
+@route("PUT", r"/oss/v2/buckets/([^/]+)/objects/([^/]+)")
+def _put_object(h, query, body, bucket, name):
+    h.mock.objects[(bucket, name)] = bytes(body)
+    return _object_details(bucket, name, body)
+
+@route("PUT", r"/oss/v2/buckets/([^/]+)/objects/([^/]+)/resumable")
+def _put_chunk(h, query, body, bucket, name):
+    '''One chunk of a resumable upload, the object exists once every byte arrived'''
+    m = re.match(r"bytes (\d+)-(\d+)/(\d+)$", h.headers.get("Content-Range", ""))
+    session = h.headers.get("Session-Id", None)
+    if m is None or session is None:
+        return 400, {"reason": "Content-Range and Session-Id are required"}
+    start, end, total = (int(g) for g in m.groups())
+    key = (bucket, name, session)
+    with h.mock._lock:
+        chunks = h.mock.sessions.setdefault(key, {})
+        chunks[start] = bytes(body)
+        received = b"".join(chunks[k] for k in sorted(chunks))
+        if len(received) < total:
+            return 202, None, {"Range": "bytes=0-{e}".format(e=len(received)-1)}
+        del h.mock.sessions[key]
+        h.mock.objects[(bucket, name)] = received
+    return _object_details(bucket, name, received)
+
+@route("GET", r"/oss/v2/buckets/([^/]+)/objects/([^/]+)/status/([^/]+)")
+def _upload_status(h, query, body, bucket, name, session):
+    chunks = h.mock.sessions.get((bucket, name, session), {})
+    received = sum(len(c) for c in chunks.values())
+    return 202, None, {"Range": "bytes=0-{e}".format(e=received-1)} if received else {}
+
+@route("GET", r"/oss/v2/buckets/([^/]+)/objects/([^/]+)")
+def _get_object(h, query, body, bucket, name):
+    data = h.mock.object_data(bucket, name)
+    return data if data is not None else (404, {"reason": "Object doesn't exist"})
+
+@route("GET", r"/oss/v2/buckets/([^/]+)/objects/([^/]+)/details")
+def _object_details_route(h, query, body, bucket, name):
+    data = h.mock.object_data(bucket, name)
+    return _object_details(bucket, name, data) if data is not None else (404, {"reason": "Object doesn't exist"})
+
+# Design Automation
+
+@route("GET", r"/da/([^/]+)/v3/engines")
+def _engines(h, query, body, region):
+    engines = [h.mock.engine(n)["id"] for n in range(h.mock.engines)]
+    start = int(query.get("page", [0])[0])
+    page = engines[start:start+h.mock.page_limit]
+    more = start + h.mock.page_limit < len(engines)
+    return {"paginationToken": str(start + h.mock.page_limit) if more else None, "data": page}
+
+@route("GET", r"/da/([^/]+)/v3/engines/([^/]+)")
+def _engine(h, query, body, region, engine_id):
+    for n in range(h.mock.engines):
+        if h.mock.engine(n)["id"] == engine_id:
+            return h.mock.engine(n)
+    return 404, {"developerMessage": "Engine not found", "errorCode": "DA-404"}
+
+@route("GET", r"/da/([^/]+)/v3/health/([^/]+)")
+def _engine_health(h, query, body, region, engine):
+    return {"Status": "Healthy"}
+
+@route("GET", r"/da/([^/]+)/v3/forgeapps/([^/]+)")
+def _forgeapp(h, query, body, region, app):
+    return "mocknickname"
+
+@route("PATCH", r"/da/([^/]+)/v3/forgeapps/me")
+def _forgeapp_nickname(h, query, body, region):
+    return {}
+
+# Reality Capture
+
+@route("POST", r"/photo-to-3d/v1/photoscene")
+def _create_scene(h, query, body):
+    form = urllib.parse.parse_qs(body.decode("utf-8"))
+    scene_id = hashlib.sha1(body + str(time.time()).encode("utf-8")).hexdigest()[:20]
+    h.mock.scenes[scene_id] = {"name": form.get("scenename", ["scene"])[0], "progress": 0}
+    return {"Photoscene": {"photosceneid": scene_id}}
+
+@route("POST", r"/photo-to-3d/v1/file")
+def _scene_files(h, query, body):
+    return {"Files": {"file": [{"fileid": "file0", "filename": "image.jpg", "filesize": str(len(body))}]}}
+
+@route("POST", r"/photo-to-3d/v1/photoscene/([^/]+)")
+def _start_scene(h, query, body, scene_id):
+    if scene_id not in h.mock.scenes:
+        return {"Error": {"code": "18", "msg": "Photoscene does not exist"}}
+    return {"msg": "No error", "Photoscene": {"photosceneid": scene_id}}
+
+@route("GET", r"/photo-to-3d/v1/photoscene/([^/]+)/progress")
+def _scene_progress(h, query, body, scene_id):
+    scene = h.mock.scenes.get(scene_id, None)
+    if scene is None:
+        return {"Error": {"code": "18", "msg": "Photoscene does not exist"}}
+    scene["progress"] = min(scene["progress"] + 25, 100)
+    return {"Photoscene": {"photosceneid": scene_id, "progressmsg": "DONE" if scene["progress"] == 100 else "Processing",
+                           "progress": str(scene["progress"])}}
+
+@route("GET", r"/photo-to-3d/v1/photoscene/([^/]+)")
+def _scene_link(h, query, body, scene_id):
+    return {"Photoscene": {"photosceneid": scene_id, "progressmsg": "DONE", "progress": "100",
+                           "scenelink": h.url().split("/photo-to-3d/")[0]+"/download/{s}.rcm".format(s=scene_id),
+                           "filesize": "1024"}}
+
+@route("POST", r"/photo-to-3d/v1/photoscene/([^/]+)/cancel")
+def _cancel_scene(h, query, body, scene_id):
+    return {"msg": "No error"}
+
+@route("DELETE", r"/photo-to-3d/v1/photoscene/([^/]+)")
+def _delete_scene(h, query, body, scene_id):
+    h.mock.scenes.pop(scene_id, None)
+    return {"msg": "No error"}
+
+# Token Flex
+
+@route("GET", r"/tokenflex/v1/contract")
+def _contracts(h, query, body):
+    return [h.mock.contract(n) for n in range(h.mock.contracts)]
+
+@route("GET", r"/tokenflex/v1/contract/([^/]+)")
+def _contract(h, query, body, number):
+    for n in range(h.mock.contracts):
+        if h.mock.contract(n)["contractNumber"] == number:
+            return h.mock.contract(n)
+    return 404, {"code": "404", "msg": "Contract not found"}
+
+@route("GET", r"/tokenflex/v1/contract/([^/]+)/enrichment")
+def _enrichment(h, query, body, number):
+    return ["costCenter", "department"]
+
+@route("GET", r"/tokenflex/v1/contract/([^/]+)/enrichment/([^/]+)")
+def _enrichment_values(h, query, body, number, category):
+    return ["{c}-{n}".format(c=category, n=n) for n in range(5)]
+
+@route("GET", r"/tokenflex/v1/usage/([^/]+)/summary")
+def _usage_summary(h, query, body, number):
+    return [{"month": "2021-{m:02d}".format(m=m), "tokensConsumed": 100*m} for m in range(1, 13)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in for the Forge APIs")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every response")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Up to this many seconds more, at random")
+    parser.add_argument("--throttle", type=float, default=0.0, help="Fraction of requests answered with a 429")
+    parser.add_argument("--retry-after", type=float, default=1)
+    parser.add_argument("--page-limit", type=int, default=50)
+    parser.add_argument("--projects", type=int, default=10)
+    parser.add_argument("--items", type=int, default=20)
+    parser.add_argument("--http2", action="store_true", help="Speak HTTP/2 (cleartext, prior knowledge)")
+    args = parser.parse_args()
+    mock = MockForge(args.host, args.port, args.latency, args.jitter, args.throttle, args.retry_after,
+                     args.page_limit, projects=args.projects, items=args.items, http2=args.http2)
+    print("Mock Forge on {u}".format(u=mock.base_url), flush=True)
+    try:
+        mock.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,4 @@
-from distutils.core import setup
+from setuptools import setup # distutils ignores python_requires
 setup(
   name = 'adeskForgeWrapper',
   packages = ['adeskForgeWrapper'],
@@ -10,17 +10,23 @@ setup(
   url = 'https://github.com/GastonBC/adeskForgeWrapper',
   download_url = 'https://github.com/GastonBC/adeskForgeWrapper/archive/v1.2.3.tar.gz',
   keywords = ["python", "autodesk", "forge", "wrapper"],
+  python_requires='>=3.7',
   install_requires=[  
           'requests'
       ],
+  extras_require={
+          'http2': ['httpx[http2]>=0.26'] # HTTP/2 transport
+      },
   classifiers=[
     'Development Status :: 3 - Alpha',      # Chose either "3 - Alpha", "4 - Beta" or "5 - Production/Stable" as the current state of your package
     'Intended Audience :: Developers',      # Define that your audience are developers
     'Topic :: Software Development :: Build Tools',
     'License :: OSI Approved :: MIT License',   # Again, pick a license
     'Programming Language :: Python :: 3',      #Specify which pyhton versions that you want to support
-    'Programming Language :: Python :: 3.4',
-    'Programming Language :: Python :: 3.5',
-    'Programming Language :: Python :: 3.6',
+    'Programming Language :: Python :: 3.7',
+    'Programming Language :: Python :: 3.8',
+    'Programming Language :: Python :: 3.9',
+    'Programming Language :: Python :: 3.10',
+    'Programming Language :: Python :: 3.11',
   ],
 )
\ No newline at end of file